@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+
+@author: Frank Shi
+"""
+import os
+import subprocess
+import sys
+
+
+# modules that must not be loaded by a bare import of the project modules
+HEAVY_MODULES = ['bs4', 'holidays', 'requests', 'lxml', 'streamlit', 'plotly',
+                 'seaborn', 'matplotlib', 'statsmodels']
+
+# import time budget in seconds for each project module, measured in a fresh interpreter
+IMPORT_BUDGET = {'useful_functions': 1.5, 'objects': 1.5, 'charting': 0.2}
+
+TIMING_SNIPPET = '''
+import sys, time
+t = time.perf_counter()
+import {0}
+elapsed = time.perf_counter() - t
+print(elapsed)
+print('loaded:' + ','.join(m for m in {1} if m in sys.modules))
+'''
+
+
+def time_import(module_name, repeat=3):
+    '''
+    Purpose
+    -------
+    measure the import time of a project module in fresh interpreters
+
+    Parameters
+    ----------
+    module_name : str
+        name of the module to import, e.g. 'objects'
+
+    repeat : int, optional
+        number of fresh interpreters to start, the best time is kept, default 3
+
+    Returns
+    -------
+    a float representing the best import time in seconds, and a list of heavy modules that got loaded
+
+    '''
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    snippet = TIMING_SNIPPET.format(module_name, HEAVY_MODULES)
+    best_time = None
+    loaded = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', snippet], cwd=repo_dir, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError('importing {} failed:\n{}'.format(module_name, result.stderr))
+        lines = result.stdout.strip().split('\n')
+        elapsed = float(lines[-2])
+        loaded = [m for m in lines[-1].replace('loaded:', '').split(',') if m != '']
+        if (best_time is None) or (elapsed < best_time):
+            best_time = elapsed
+    return best_time, loaded
+
+
+def check_imports(budget_dict=None):
+    '''
+    Purpose
+    -------
+    check every module in budget_dict against its import time budget and the heavy module list
+
+    Parameters
+    ----------
+    budget_dict : dict, optional
+        module names as keys and budgets in seconds as values, default IMPORT_BUDGET
+
+    Returns
+    -------
+    a list of strings describing every regression, empty if there is none
+
+    '''
+    if budget_dict is None:
+        budget_dict = IMPORT_BUDGET
+    failures = []
+    for module_name in budget_dict:
+        elapsed, loaded = time_import(module_name)
+        print('{}: {:.3f}s (budget {:.3f}s), heavy modules loaded: {}'.format(module_name, elapsed,
+                                                                               budget_dict[module_name], loaded))
+        if elapsed > budget_dict[module_name]:
+            failures.append('{} took {:.3f}s to import'.format(module_name, elapsed))
+        if len(loaded) > 0:
+            failures.append('{} loads {} at import time'.format(module_name, ', '.join(loaded)))
+    return failures
+
+
+#% test
+if __name__ == '__main__':
+    regressions = check_imports()
+    for r in regressions:
+        print('REGRESSION: ' + r)
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 02:41:17 2026
+
+@author: Frank Shi
+"""
+import base64
+import gzip
+import json
+import os
+import threading
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import useful_functions
+
+
+MODES = ['replay', 'record', 'refresh']
+
+
+def normalize_url(url):
+    # the same key for the same request however the url was put together: case of scheme and host, order of
+    # the query parameters, trailing slash and fragment do not matter
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+
+class CassetteResponse():
+    # a recorded response, with what the parsers read from a live one
+    status_code = 200
+    content = b''
+    url = ''
+
+
+    def __init__(self, status_code, content, url):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class Cassette():
+    '''
+    responses of every url fetched through useful_functions.get or the market_data client, kept in one gzip
+    compressed file keyed by normalized url, so that a run can be repeated without the network
+
+    modes: 'replay' answers only from the file and fails a url it does not have like offline mode does;
+    'record' answers from the file and fetches and keeps what it does not have; 'refresh' fetches everything
+    again and replaces what it had
+
+    used as a context manager it is installed for every scraping function and saved on exit
+    '''
+    filename = ''
+    mode = 'replay'
+    entries = None
+    hits = None
+    misses = None
+    recorded = None
+    lock = None
+
+
+    def __init__(self, filename, mode='replay'):
+        '''
+        Parameters
+        ----------
+        filename : str
+            path of the cassette, e.g. 'cassettes/2026-09-30.json.gz'
+
+        mode : str, optional
+            one of MODES, default 'replay'
+
+        '''
+        if mode not in MODES:
+            raise ValueError('cassette mode must be one of {}, not {}'.format(MODES, mode))
+        self.filename = filename
+        self.mode = mode
+        self.entries = {}
+        self.hits = {}
+        self.misses = []
+        self.recorded = []
+        self.lock = threading.Lock()
+        if os.path.exists(filename):
+            with gzip.open(filename, 'rt', encoding='utf-8') as f:
+                self.entries = json.load(f)['entries']
+
+
+    def lookup(self, url):
+        '''
+        Returns
+        -------
+        the recorded response of url, or None if it has to be fetched; in replay mode a url that is not in
+        the cassette raises ConnectionError
+
+        '''
+        key = normalize_url(url)
+        with self.lock:
+            entry = self.entries.get(key) if self.mode != 'refresh' else None
+            if entry is not None:
+                self.hits[key] = self.hits.get(key, 0) + 1
+                return CassetteResponse(entry['status_code'], base64.b64decode(entry['content']), entry['url'])
+            self.misses.append(key)
+        if self.mode == 'replay':
+            raise ConnectionError('{} is not in the cassette {}'.format(url, self.filename))
+        return None
+
+
+    def store(self, url, response):
+        # keep a live response; failed ones are not kept, so a later run tries again
+        if response.status_code >= 400:
+            return
+        key = normalize_url(url)
+        with self.lock:
+            self.entries[key] = {'url': url, 'status_code': response.status_code,
+                                 'content': base64.b64encode(response.content).decode('ascii'),
+                                 'recorded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            self.recorded.append(key)
+
+
+    def get(self, url, headers, fetch):
+        # the recorded response of url, or fetch(url, headers) kept for next time
+        response = self.lookup(url)
+        if response is None:
+            response = fetch(url, headers)
+            self.store(url, response)
+        return response
+
+
+    def save(self):
+        if (self.mode == 'replay') or (len(self.recorded) == 0):
+            return
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+        with self.lock:
+            # written next to the cassette first, so that a failed write leaves the old one intact
+            with gzip.open(self.filename + '.tmp', 'wt', encoding='utf-8') as f:
+                json.dump({'version': 1, 'entries': self.entries}, f)
+            os.replace(self.filename + '.tmp', self.filename)
+
+
+    def coverage(self):
+        '''
+        Purpose
+        -------
+        how much of this run the cassette answered
+
+        Returns
+        -------
+        a dictionary: 'requests', 'hits', 'misses', 'recorded', 'hit_rate', 'entries', 'unused' (entries not
+        asked for in this run) and 'missed_urls'
+
+        '''
+        with self.lock:
+            hits = sum(self.hits.values())
+            requests = hits + len(self.misses)
+            return {'requests': requests, 'hits': hits, 'misses': len(self.misses), 'recorded': len(self.recorded),
+                    'hit_rate': hits / requests if requests > 0 else 1.0, 'entries': len(self.entries),
+                    'unused': len(set(self.entries) - set(self.hits) - set(self.recorded)),
+                    'missed_urls': sorted(set(self.misses))}
+
+
+    def __enter__(self):
+        useful_functions.set_cassette(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        useful_functions.set_cassette(None)
+        self.save()
+        return False
+
+
+#% test
+if __name__ == '__main__':
+    import tempfile
+    import time
+    from quote_service import serve_quotes
+
+    prices = {'XIU.TO': 35.0, 'SPY': 580.0}
+    server, base_url = serve_quotes(prices)
+    useful_functions.YAHOO_BASE_URL = base_url
+    filename = os.path.join(tempfile.mkdtemp(), 'quotes.json.gz')
+
+    with Cassette(filename, mode='record') as cassette:
+        assert useful_functions.get_last_price('XIU.TO')[1] == 35.0
+        assert useful_functions.get_last_price('SPY')[1] == 580.0
+        assert cassette.coverage()['recorded'] == 2
+    server.shutdown()
+
+    # the site is gone and the prices moved, the replay still gives the recorded ones without the network
+    prices['SPY'] = 1.0
+    useful_functions.set_offline(True)
+    with Cassette(filename) as cassette:
+        t = time.perf_counter()
+        for _ in range(100):
+            assert useful_functions.get_last_price('SPY')[1] == 580.0
+        print('100 replayed quotes in {:.4f}s'.format(time.perf_counter() - t))
+        try:
+            useful_functions.get_last_price('VFV.TO')
+            raise AssertionError('a url that was never recorded must fail')
+        except ConnectionError:
+            pass
+        coverage = cassette.coverage()
+    print(coverage)
+    assert coverage['hits'] == 100 and coverage['misses'] == 1 and coverage['unused'] == 1
+    assert normalize_url('HTTPS://Finance.Yahoo.com/quote/SPY/?b=2&a=1') == 'https://finance.yahoo.com/quote/SPY?a=1&b=2'
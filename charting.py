@@ -4,15 +4,8 @@ Created on Fri Jan  1 01:17:33 2021
 
 @author: Frank Shi
 """
-import streamlit as st
-
-import seaborn as sns
-import matplotlib.pyplot as plt
-import statsmodels.api as sm #Linear regression
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly import subplots
-from plotly.offline import plot
+# plotly and streamlit are imported inside each chart function so that importing this module is cheap;
+# seaborn, matplotlib and statsmodels are not used and no longer imported at all
 
 def barchart_groupby(holdings_df, by_column, sum_column, title):
     '''
@@ -43,6 +36,9 @@ def barchart_groupby(holdings_df, by_column, sum_column, title):
     outputs a chart in streamlit
 
     '''
+    import plotly.express as px
+    import streamlit as st
+
     df = holdings_df.groupby(by_column)[[sum_column]].sum()
     df = df.sort_values(by=[sum_column], ascending=False)
     fig = px.bar(df, x=df.index, y=sum_column, title=title, text=sum_column)
@@ -97,6 +93,9 @@ def barchart_detailed(holdings_df, by_column, sum_column, hover_column, title):
     outputs a chart in streamlit
 
     '''
+    import plotly.express as px
+    import streamlit as st
+
     fig = px.bar(holdings_df, x=by_column, y=sum_column, title=title, text=sum_column, hover_name=hover_column)
     fig.update_traces(texttemplate='%{text:.2%}')
     st.plotly_chart(fig)
@@ -133,6 +132,9 @@ def top5_holdings_bar(holdings_df, sort_column, column_x, title):
     plots a chart in streamlit
 
     '''
+    import plotly.express as px
+    import streamlit as st
+
     df = holdings_df.sort_values(by=[sort_column], ascending=False)
     if len(df) >= 5:
         df = df.head(5)
@@ -181,6 +183,8 @@ def a_by_b_bar(holdings_df, a_column, by_b_column, measure_column, title=None, t
     plots several bar charts in streamlit
 
     '''
+    import plotly.graph_objects as go
+    from plotly import subplots
 
     sorted_by_b = holdings_df.groupby(by_b_column)[[measure_column]].sum()
     sorted_by_b = sorted_by_b.sort_values(by=[measure_column], ascending=False)
@@ -215,13 +219,202 @@ def a_by_b_bar(holdings_df, a_column, by_b_column, measure_column, title=None, t
         fig['layout'].update(title=title)
 
     if testing:
+        from plotly.offline import plot
         plot(fig)
     else:
+        import streamlit as st
         st.plotly_chart(fig)
 
     return fig
 
 
+def line_chart(df, x_column, y_columns, title, y_format=None):
+    '''
+    Purpose
+    -------
+    chart one or more columns against a date column in streamlit using plotly
+
+    Parameters
+    ----------
+    df : DataFrame
+        the dataframe that the chart is based on
+
+    x_column : str
+        the name of the column displayed on the x-axis, usually 'Date'
+
+    y_columns : list
+        the names of the columns drawn as lines
+
+    title : str
+        title of the chart
+
+    y_format : str, optional
+        plotly tick format of the y-axis, e.g. '.1%', default None
+
+    Returns
+    -------
+    plotly.graph_object.Figure
+
+    Effects
+    -------
+    outputs a chart in streamlit
+
+    '''
+    import plotly.express as px
+    import streamlit as st
+
+    fig = px.line(df, x=x_column, y=y_columns, title=title)
+    if y_format is not None:
+        fig.update_yaxes(tickformat=y_format)
+    st.plotly_chart(fig)
+
+    return fig
+
+
+def time_series_chart(points, title, y_format=None, x_range=None):
+    '''
+    Purpose
+    -------
+    chart downsampled series as webgl lines in streamlit using plotly, so that years of daily values of
+    many series stay a small payload and draw fast
+
+    Parameters
+    ----------
+    points : dict
+        series names as keys and (dates, values) arrays as values, e.g. the output of
+        downsample.Downsampler.series
+
+    title : str
+        title of the chart
+
+    y_format : str, optional
+        plotly tick format of the y-axis, e.g. '.1%', default None
+
+    x_range : tuple, optional
+        (start, end) of the x-axis, default None to fit the points
+
+    Returns
+    -------
+    plotly.graph_object.Figure
+
+    Effects
+    -------
+    outputs a chart in streamlit
+
+    '''
+    import plotly.graph_objects as go
+    import streamlit as st
+
+    fig = go.Figure()
+    for (name, (x, y)) in points.items():
+        fig.add_trace(go.Scattergl(x=x, y=y, mode='lines', name=str(name)))
+    fig['layout'].update(title=title, hovermode='x unified')
+    if y_format is not None:
+        fig.update_yaxes(tickformat=y_format)
+    if x_range is not None:
+        fig.update_xaxes(range=list(x_range))
+    st.plotly_chart(fig)
+
+    return fig
+
+
+def contribution_bar(df, x_column, y_column, title):
+    '''
+    Purpose
+    -------
+    chart positive contributions in green and negative ones in red in streamlit using plotly
+
+    Parameters
+    ----------
+    df : DataFrame
+        the dataframe that the chart is based on, e.g. the output of contribution.top_contributors
+
+    x_column : str
+        the name of the column displayed on the x-axis
+
+    y_column : str
+        the name of the column displayed on the y-axis
+
+    title : str
+        title of the chart
+
+    Returns
+    -------
+    plotly.graph_object.Figure
+
+    Effects
+    -------
+    outputs a chart in streamlit
+
+    '''
+    import plotly.graph_objects as go
+    import streamlit as st
+
+    colours = ['seagreen' if y >= 0 else 'indianred' for y in df[y_column]]
+    fig = go.Figure(go.Bar(x=df[x_column], y=df[y_column], marker_color=colours, text=df[y_column],
+                           texttemplate='%{text:.2%}'))
+    fig['layout'].update(title=title)
+    fig.update_yaxes(tickformat='.1%')
+    st.plotly_chart(fig)
+
+    return fig
+
+
+def fan_chart(df, x_column, band_columns, median_column, title, y_format=None):
+    '''
+    Purpose
+    -------
+    chart percentile bands as shaded areas around a median line in streamlit using plotly, e.g. the output
+    of projection.project
+
+    Parameters
+    ----------
+    df : DataFrame
+        the dataframe that the chart is based on
+
+    x_column : str
+        the name of the column displayed on the x-axis, usually 'Date'
+
+    band_columns : list
+        pairs of (lower, upper) column names, outermost band first, e.g. [('P5', 'P95'), ('P25', 'P75')]
+
+    median_column : str
+        the name of the column drawn as a line
+
+    title : str
+        title of the chart
+
+    y_format : str, optional
+        plotly tick format of the y-axis, default None
+
+    Returns
+    -------
+    plotly.graph_object.Figure
+
+    Effects
+    -------
+    outputs a chart in streamlit
+
+    '''
+    import plotly.graph_objects as go
+    import streamlit as st
+
+    fig = go.Figure()
+    for (i, (lower, upper)) in enumerate(band_columns):
+        opacity = 0.15 + 0.2 * i
+        fig.add_trace(go.Scatter(x=df[x_column], y=df[lower], mode='lines', line={'width': 0}, showlegend=False))
+        fig.add_trace(go.Scatter(x=df[x_column], y=df[upper], mode='lines', line={'width': 0}, fill='tonexty',
+                                 fillcolor='rgba(31, 119, 180, {})'.format(opacity), name='{} - {}'.format(lower, upper)))
+    fig.add_trace(go.Scatter(x=df[x_column], y=df[median_column], mode='lines', name=median_column,
+                             line={'color': 'rgb(31, 119, 180)'}))
+    fig['layout'].update(title=title)
+    if y_format is not None:
+        fig.update_yaxes(tickformat=y_format)
+    st.plotly_chart(fig)
+
+    return fig
+
+
 #% test
 if __name__ == '__main__':
     import pandas as pd
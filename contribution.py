@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:04:12 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+
+from returns import ReturnEngine
+
+
+# whatever the positions held overnight do not explain: dividends, interest, commissions and trading at
+# prices other than the close
+RESIDUAL_COLUMN = 'Income & Trading'
+
+
+def security_returns(nav_history):
+    '''
+    Purpose
+    -------
+    daily return in cad of every security and cash currency of an account, all at once from the dense matrices
+
+    Parameters
+    ----------
+    nav_history : nav.NavHistory
+
+    Returns
+    -------
+    two DataFrames indexed by date, one column per security then per cash currency: the returns, and the cad
+    values at the close, from which the weights are taken
+
+    '''
+    currencies = list(nav_history.cash.columns)
+    # price_index is continuous through splits and option adjustments, so the ratio is the return of what was
+    # held overnight; a journalled security drops to 0 the day its new symbol appears, with nothing lost between
+    price_cad = np.hstack([nav_history.price_index.values * nav_history.fx.values,
+                           nav_history.fx_rates[currencies].values])
+    value = np.hstack([nav_history.value.values, (nav_history.cash * nav_history.fx_rates[currencies]).values])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = price_cad[1:] / price_cad[:-1] - 1
+    held = value[:-1] != 0
+    returns = np.where(held & np.isfinite(returns), returns, 0)
+
+    columns = list(nav_history.value.columns) + ['{} Cash'.format(c) for c in currencies]
+    returns_df = pd.DataFrame(returns, index=nav_history.dates[1:], columns=columns)
+    value_df = pd.DataFrame(value, index=nav_history.dates, columns=columns)
+    return returns_df, value_df
+
+
+def daily_contributions(nav_history, cash_flows):
+    '''
+    Purpose
+    -------
+    contribution of every security to the daily time weighted return: its weight at the previous close times
+    its return, plus a residual column so that every row sums to the return of ReturnEngine.daily_returns
+
+    Parameters
+    ----------
+    nav_history : nav.NavHistory
+
+    cash_flows : Series
+        external cash flows in cad indexed by date, see returns.cash_flow_series
+
+    Returns
+    -------
+    DataFrame indexed by date with one column per security and cash currency, RESIDUAL_COLUMN, 'Return' and
+    'Growth Index', the value of 1 invested at the previous close
+
+    '''
+    returns_df, value_df = security_returns(nav_history)
+    nav_values = value_df.sum(axis=1).values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = value_df.values[:-1] / nav_values[:-1, None]
+    contribution = np.nan_to_num(weights) * returns_df.values
+
+    engine = ReturnEngine(pd.Series(nav_values, index=nav_history.dates), cash_flows)
+    daily = engine.daily_returns().values
+    df = pd.DataFrame(contribution, index=returns_df.index, columns=returns_df.columns)
+    df[RESIDUAL_COLUMN] = daily - contribution.sum(axis=1)
+    df['Return'] = daily
+    df['Growth Index'] = engine.growth_index().values[:-1]
+    df.index.name = 'Date'
+    return df
+
+
+def range_contributions(contribution_df, start, end):
+    '''
+    Purpose
+    -------
+    contribution of every security to the time weighted return between two dates; each day is weighted by
+    the growth up to the previous close, so the contributions sum to the chain linked return exactly
+
+    Parameters
+    ----------
+    contribution_df : DataFrame
+        output of daily_contributions, or the same read back from a report with a 'Date' column
+
+    start, end : datetime
+        the return runs from the close of start to the close of end
+
+    Returns
+    -------
+    Series indexed by security, with 'Return' for the whole range
+
+    '''
+    df = contribution_df.set_index('Date') if 'Date' in contribution_df.columns else contribution_df
+    growth = df['Growth Index'].values
+    position_cols = [c for c in df.columns if c not in ['Return', 'Growth Index']]
+
+    # prefix sums of growth-weighted daily contributions make any range two lookups
+    prefix = np.vstack([np.zeros(len(position_cols) + 1),
+                        np.cumsum(df[position_cols + ['Return']].values * growth[:, None], axis=0)])
+    dates = pd.DatetimeIndex(df.index)
+    start_pos = np.searchsorted(dates.values, np.datetime64(pd.Timestamp(start)), side='right')
+    end_pos = np.searchsorted(dates.values, np.datetime64(pd.Timestamp(end)), side='right')
+    start_growth = growth[start_pos] if start_pos < len(growth) else growth[-1] * (1 + df['Return'].values[-1])
+    return pd.Series((prefix[end_pos] - prefix[start_pos]) / start_growth, index=position_cols + ['Return'])
+
+
+def top_contributors(contribution_df, start, end, n=5):
+    # the n largest and n smallest contributions between two dates, largest first
+    contributions = range_contributions(contribution_df, start, end).drop('Return')
+    contributions = contributions[contributions != 0].sort_values(ascending=False)
+    if len(contributions) > 2 * n:
+        contributions = pd.concat([contributions.head(n), contributions.tail(n)])
+    df = contributions.to_frame('Contribution')
+    df.index.name = 'Symbol'
+    return df.reset_index()
+
+
+#% test
+if __name__ == '__main__':
+    # contributions over random ranges against the chain linked daily returns
+    dates = pd.bdate_range('2020-01-01', '2026-10-16')
+    rng = np.random.default_rng(4)
+    n = len(dates) - 1
+    contribution = rng.normal(0.00001, 0.0005, (n, 40))
+    df = pd.DataFrame(contribution, index=dates[1:], columns=['S{}'.format(i) for i in range(40)])
+    df[RESIDUAL_COLUMN] = rng.normal(0, 0.0005, n)
+    df['Return'] = df.sum(axis=1)
+    df['Growth Index'] = np.concatenate([[1], np.cumprod(1 + df['Return'].values)[:-1]])
+
+    for _ in range(20):
+        a, b = np.sort(rng.choice(len(dates), 2, replace=False))
+        result = range_contributions(df, dates[a], dates[b])
+        twr = np.prod(1 + df['Return'].values[a:b]) - 1
+        assert np.isclose(result['Return'], twr, rtol=1e-10)
+        assert np.isclose(result.drop('Return').sum(), twr, rtol=1e-10)
+    print(top_contributors(df, dates[0], dates[-1]))
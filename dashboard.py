@@ -6,34 +6,45 @@ Created on Thu Nov 26 13:18:46 2020
 """
 
 #%% Import packages
-import json
+import os
+import sys
 import pandas as pd
 import streamlit as st
-import os
-
-# bmoil_path = r'C:\Users\Frank Shi\Documents\FrankS\Banking & Investing\Huichuan Shi\BMOInvestorLine'
-# os.chdir(bmoil_path)
-home_dir = r'C:\Users\Frank Shi\Documents\FrankS\Banking & Investing\Huichuan Shi\Questrade'
-os.chdir(home_dir)
 
 import charting
+from contribution import top_contributors
+from downsample import METHODS, Downsampler
+from export import read_report
+from lookthrough import LookThrough
+from objects import combine_holdings_df
+from portfolio_modelling import load_config, load_stage
+from position_index import PositionIndex
+from quote_service import QuoteService
+from rebalance import Rebalancer
+from stress import stress_test
+
+# run as: streamlit run dashboard.py -- path/to/config.json, or set PORTFOLIO_CONFIG
+home_dir = r'C:\Users\Frank Shi\Documents\FrankS\Banking & Investing\Huichuan Shi\Questrade'
+if len(sys.argv) > 1:
+    config_filename = sys.argv[1]
+else:
+    config_filename = os.environ.get('PORTFOLIO_CONFIG', os.path.join(home_dir, 'config.json'))
 
 #%% read files
-config_filename = 'config.json'
-with open(config_filename) as f:
-    config = json.load(f)
-paths_dict = config['paths']
+config = load_config(config_filename)
 filename_dict = config['filenames']
+sheet_names = ['Current Holdings', 'Performance Asof', 'Risk', 'Rolling Risk', 'Contribution', 'Projection',
+               'Stress Test', 'NAV History', 'Cash History']
 
-tfsa_stats = pd.read_excel(os.path.join(os.getcwd(), filename_dict['tfsa_output']), sheet_name=None)
+tfsa_stats = read_report(os.path.join(config['home_dir'], filename_dict['tfsa_output']), sheet_names)
 tfsa_holdings = tfsa_stats['Current Holdings']
 tfsa_perf = tfsa_stats['Performance Asof']
 
-rrsp_stats = pd.read_excel(os.path.join(os.getcwd(), filename_dict['rrsp_output']), sheet_name=None)
+rrsp_stats = read_report(os.path.join(config['home_dir'], filename_dict['rrsp_output']), sheet_names)
 rrsp_holdings = rrsp_stats['Current Holdings']
 rrsp_perf = rrsp_stats['Performance Asof']
 
-q_margin_stats = pd.read_excel(os.path.join(os.getcwd(), filename_dict['q_margin_output']), sheet_name=None)
+q_margin_stats = read_report(os.path.join(config['home_dir'], filename_dict['q_margin_output']), sheet_names)
 q_margin_holdings = q_margin_stats['Current Holdings']
 q_margin_perf = q_margin_stats['Performance Asof']
 
@@ -42,36 +53,220 @@ q_margin_perf = q_margin_stats['Performance Asof']
 
 # sidebar
 account_list = {'Questrade TFSA': tfsa_holdings, 'Questrade RRSP': rrsp_holdings, 'Questrade Margin': q_margin_holdings}
+# the household view is combined from the frames already loaded, nothing is fetched again
+account_list['All Accounts'] = combine_holdings_df(account_list)[1]
+stats_list = {'Questrade TFSA': tfsa_stats, 'Questrade RRSP': rrsp_stats, 'Questrade Margin': q_margin_stats}
+account_keys = {'Questrade TFSA': 'tfsa', 'Questrade RRSP': 'rrsp', 'Questrade Margin': 'q_margin'}
 account_selected = st.sidebar.radio('Choose an account:', list(account_list.keys()))
 
+
+
+# fund constituents, e.g. "paths": {"constituents_folder": "constituents"} in the config; loaded once per session
+@st.cache_resource
+def look_through(folder):
+    return LookThrough.from_folder(folder)
+
+
+constituents_folder = os.path.join(config['home_dir'], config['paths'].get('constituents_folder', 'constituents'))
+look_through_on = os.path.isdir(constituents_folder) and st.sidebar.checkbox('Look through funds')
+
 # tfsa page
 st.title('{} Holdings Stats'.format(account_selected))
 holdings_displayed = account_list[account_selected]
+# exposure charts see through funds to their constituents when asked; the expanded holdings are cached per snapshot
+if look_through_on:
+    exposure_displayed = look_through(constituents_folder).expand(holdings_displayed)
+    attribute_list = ['Currency', 'Instrument', 'Region', 'Sector', 'Asset Class', 'Symbol']
+else:
+    exposure_displayed = holdings_displayed
+    attribute_list = ['Currency', 'Instrument', 'Region', 'Asset Class', 'Symbol']
 
 # exposure by different attributes
-charting.barchart_groupby(holdings_displayed, 'Currency', 'Pct Portfolio', 'Holdings by Currency')
+charting.barchart_groupby(exposure_displayed, 'Currency', 'Pct Portfolio', 'Holdings by Currency')
 charting.barchart_groupby(holdings_displayed, 'Instrument', 'Pct Portfolio', 'Holdings by Instrument')
-charting.barchart_groupby(holdings_displayed, 'Region', 'Pct Portfolio', 'Holdings by Region')
-charting.barchart_groupby(holdings_displayed, 'Asset Class', 'Pct Portfolio', 'Holdings by Asset Class')
+charting.barchart_groupby(exposure_displayed, 'Region', 'Pct Portfolio', 'Holdings by Region')
+if look_through_on:
+    charting.barchart_groupby(exposure_displayed, 'Sector', 'Pct Portfolio', 'Holdings by Sector')
+charting.barchart_groupby(exposure_displayed, 'Asset Class', 'Pct Portfolio', 'Holdings by Asset Class')
 
 # attribute A by attribute B
 st.write('Below is charting the market value of attribute A grouped by attribute B.')
 st.write('For example, if attribute A is Region, attribute B is Asset Class, then the chart will display percentage of all regions of each asset class:')
-charting.a_by_b_bar(holdings_displayed, 'Region', 'Asset Class', 'Market Value CAD')
+charting.a_by_b_bar(exposure_displayed, 'Region', 'Asset Class', 'Market Value CAD')
 
 st.write('Please make your selection:')
-attribute_list = ['Currency', 'Instrument', 'Region', 'Asset Class', 'Symbol']
 attribute_a = st.selectbox('I would like to see the exposure of:', attribute_list)
 attribute_b = st.selectbox('in each:', attribute_list)
-charting.a_by_b_bar(holdings_displayed, attribute_a, attribute_b, 'Market Value CAD')
+charting.a_by_b_bar(exposure_displayed, attribute_a, attribute_b, 'Market Value CAD')
 
 # top 5 holdings
 charting.top5_holdings_bar(holdings_displayed, 'Pct Portfolio', 'Symbol', 'Top 5 Holdings')
 
+# risk, only for accounts whose report has been through the risk stage
+account_stats = stats_list.get(account_selected)
+if (account_stats is not None) and (account_stats['Risk'] is not None):
+    st.header('Risk')
+    st.table(account_stats['Risk'].set_index('Statistic'))
+    rolling_risk = account_stats['Rolling Risk']
+    charting.line_chart(rolling_risk, 'Date', ['Rolling Volatility'], 'Rolling Volatility', y_format='.1%')
+    charting.line_chart(rolling_risk, 'Date', ['Rolling Drawdown'], 'Rolling Drawdown', y_format='.1%')
+    beta_columns = [c for c in rolling_risk.columns if c.startswith('Rolling Beta')]
+    if len(beta_columns) > 0:
+        charting.line_chart(rolling_risk, 'Date', beta_columns, 'Rolling Beta')
+
+# contribution to return over any range, only for accounts whose report has been through the risk stage
+if (account_stats is not None) and (account_stats['Contribution'] is not None):
+    st.header('Contribution to Return')
+    contribution_df = account_stats['Contribution']
+    first_date = contribution_df['Date'].min().date()
+    last_date = contribution_df['Date'].max().date()
+    contribution_range = st.date_input('From and to:', (first_date, last_date), min_value=first_date,
+                                       max_value=last_date)
+    if len(contribution_range) == 2:
+        contributors = top_contributors(contribution_df, contribution_range[0], contribution_range[1], n=5)
+        charting.contribution_bar(contributors, 'Symbol', 'Contribution', 'Top and Bottom Contributors')
+
+# projection, only for accounts whose report has been through the projection stage
+if (account_stats is not None) and (account_stats['Projection'] is not None):
+    st.header('Projection')
+    projection_df = account_stats['Projection']
+    charting.fan_chart(projection_df, 'Date', [('P5', 'P95'), ('P25', 'P75')], 'P50', 'Projected Market Value CAD')
+    st.write('Probability of running out by the end: {:.1%}'.format(projection_df['Depleted'].iloc[-1]))
+
+
+# history charts: every series is cut to the range picked and downsampled to the chart width before plotting;
+# the downsamplers live for the session and keep the points of every range already drawn
+@st.cache_resource
+def history_downsampler(account, sheet):
+    return Downsampler(stats_list[account][sheet])
+
+
+@st.cache_resource
+def security_downsampler(account):
+    work_dir = os.path.join(config['home_dir'], config['paths'].get('work_folder', 'work'))
+    return Downsampler(load_stage(work_dir, account, 'risk').nav_history.value)
+
+
+if (account_stats is not None) and (account_stats['NAV History'] is not None) and (len(account_stats['NAV History']) > 1):
+    st.header('History')
+    chart_width = st.sidebar.number_input('Chart width (px)', 200, 4000, 1000, step=100)
+    chart_method = st.sidebar.selectbox('Downsampling', METHODS)
+    nav_sampler = history_downsampler(account_selected, 'NAV History')
+    first_date = pd.Timestamp(nav_sampler.dates[0]).date()
+    last_date = pd.Timestamp(nav_sampler.dates[-1]).date()
+    history_range = st.slider('Range:', min_value=first_date, max_value=last_date, value=(first_date, last_date))
+    # minmax keeps two points per bucket, so half as many buckets as pixels
+    n_out = chart_width if chart_method == 'lttb' else 2 * chart_width
+
+    nav_columns = [c for c in ['Market Value CAD', 'Securities CAD', 'Cash CAD'] if c in nav_sampler.columns]
+    charting.time_series_chart(nav_sampler.series(nav_columns, *history_range, n_out=n_out, method=chart_method),
+                               'Market Value CAD', x_range=history_range)
+    if (account_stats['Rolling Risk'] is not None) and ('Drawdown From Peak' in account_stats['Rolling Risk'].columns):
+        drawdown_sampler = history_downsampler(account_selected, 'Rolling Risk')
+        charting.time_series_chart(drawdown_sampler.series(['Drawdown From Peak'], *history_range, n_out=n_out,
+                                                           method=chart_method),
+                                   'Drawdown From Peak', y_format='.1%', x_range=history_range)
+    if account_stats['Cash History'] is not None:
+        cash_sampler = history_downsampler(account_selected, 'Cash History')
+        cash_columns = [c for c in cash_sampler.columns if (c != 'Cash CAD') and not c.startswith('Interest')]
+        charting.time_series_chart(cash_sampler.series(cash_columns, *history_range, n_out=n_out, method=chart_method),
+                                   'Cash', x_range=history_range)
+
+    # market value of every security, from the risk stage of the account
+    if account_selected in account_keys:
+        try:
+            value_sampler = security_downsampler(account_keys[account_selected])
+        except FileNotFoundError as e:
+            value_sampler = None
+            st.info('No security history yet, run the risk stage: {}'.format(e))
+        if value_sampler is not None:
+            largest = pd.Series(value_sampler.values.max(axis=0), index=value_sampler.columns).nlargest(10)
+            symbols_shown = st.multiselect('Securities:', value_sampler.columns, list(largest.index))
+            if len(symbols_shown) > 0:
+                charting.time_series_chart(value_sampler.series(symbols_shown, *history_range, n_out=n_out,
+                                                                method=chart_method),
+                                           'Market Value CAD by Security', x_range=history_range)
+
+
+# holdings on any past date, from the index built once per account on the normalized ledger
+@st.cache_resource
+def position_index(account):
+    work_dir = os.path.join(config['home_dir'], config['paths'].get('work_folder', 'work'))
+    return PositionIndex.from_transaction(load_stage(work_dir, account, 'normalize'))
+
+
+if account_selected in account_keys:
+    try:
+        index = position_index(account_keys[account_selected])
+    except FileNotFoundError as e:
+        index = None
+        st.info('No holdings as of a past date yet, run the normalize stage: {}'.format(e))
+    if (index is not None) and (len(index.cash_dates) > 0):
+        st.header('Holdings as of')
+        first_date = index.cash_dates[0].astype('datetime64[D]').item()
+        asof_date = st.date_input('Holdings on:', first_date, min_value=first_date)
+        st.dataframe(index.positions(asof_date).set_index('Symbol'))
+        st.table(index.cash([asof_date]).T.rename(columns=lambda c: 'Cash'))
+
+
+# stress test: the scenarios of the report, then one of your own on the holdings displayed
+st.header('Stress Test')
+if (account_stats is not None) and (account_stats['Stress Test'] is not None):
+    worst = account_stats['Stress Test'].sort_values(by='P&L CAD').head(10)
+    charting.contribution_bar(worst, 'Scenario', 'Pct Change', 'Worst Scenarios')
+us_equity_shock = st.slider('US equity (%)', -50, 50, 0)
+canada_equity_shock = st.slider('Canadian equity (%)', -50, 50, 0)
+usd_shock = st.slider('USDCAD (%)', -20, 20, 0)
+custom_scenario = pd.DataFrame({'Scenario': ['Custom'],
+                                'Region=US & Asset Class=Equity': [us_equity_shock / 100],
+                                'Region=Canada & Asset Class=Equity': [canada_equity_shock / 100],
+                                'Currency=USD': [usd_shock / 100]})
+custom_summary, custom_pnl = stress_test(holdings_displayed, custom_scenario)
+st.metric('P&L CAD', '{:,.2f}'.format(custom_summary['P&L CAD'].iloc[0]),
+          '{:.1%}'.format(custom_summary['Pct Change'].iloc[0]))
+
 
+# what-if rebalancing: every slider position is evaluated in one batch the first time a segment is picked
+@st.cache_data
+def rebalance_sweep(holdings_df, attribute, segment):
+    rebalancer = Rebalancer(holdings_df, attribute)
+    weights, targets = rebalancer.sweep(segment)
+    return weights, targets, rebalancer.evaluate(targets)
 
 
+st.header('Rebalance')
+rebalance_attribute = st.selectbox('Rebalance by:', ['Region', 'Asset Class', 'Currency'])
+rebalancer = Rebalancer(holdings_displayed, rebalance_attribute)
+rebalance_segment = st.selectbox('Target weight of:', rebalancer.segments)
+sweep_weights, sweep_targets, sweep_batch = rebalance_sweep(holdings_displayed, rebalance_attribute, rebalance_segment)
+current_weight = rebalancer.current_weights()[rebalancer.segments.index(rebalance_segment)]
+target_pct = st.slider('{} target (%)'.format(rebalance_segment), 0, 100, int(round(current_weight * 100)))
+st.write('Turnover: {:.1%}, estimated commissions: {:.2f} CAD'.format(sweep_batch['turnover'][target_pct],
+                                                                        sweep_batch['commission_cad'][target_pct]))
+st.table(rebalancer.exposure_df(sweep_targets[target_pct]).set_index(rebalance_attribute))
+st.dataframe(rebalancer.trade_list(sweep_targets[target_pct]))
 
 
+# live market value: one quote service per session polls in the background, refreshes only read its cache
+@st.cache_resource
+def quote_service(interval):
+    service = QuoteService({a: h for (a, h) in account_list.items() if a != 'All Accounts'},
+                           interval=interval, ttl=interval)
+    service.start()
+    return service
 
 
+if st.sidebar.checkbox('Live quotes'):
+    st.header('Live')
+    service = quote_service(config.get('quote_interval', 30))
+    live_nav = service.nav()
+    if account_selected in live_nav:
+        live_value = live_nav[account_selected]
+    else:
+        live_value = sum(live_nav.values())
+    st.metric('Market Value CAD', '{:,.2f}'.format(live_value),
+              '{:,.2f}'.format(live_value - holdings_displayed['Market Value CAD'].sum()))
+    missing = service.missing_quotes()
+    if len(missing) > 0:
+        st.write('No quote yet for: {}'.format(', '.join(missing)))
+    st.button('Refresh')
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 03:48:06 2026
+
+@author: Frank Shi
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+METHODS = ['lttb', 'minmax']
+
+
+def bucket_ids(n, n_buckets):
+    # bucket of each of n points, n_buckets buckets of sizes differing by at most one
+    return np.arange(n) * n_buckets // n
+
+
+def lttb(x, y, n_out):
+    '''
+    Purpose
+    -------
+    largest triangle three buckets: the first and last points, and in every bucket in between the point
+    making the largest triangle with the point kept in the previous bucket and the average of the next
+    bucket; the shape of a line chart survives with one point per pixel
+
+    the buckets are shared by every column of y, so many series cost one loop over the buckets
+
+    Parameters
+    ----------
+    x : numpy array
+        n increasing values, e.g. dates as int64 nanoseconds
+
+    y : numpy array
+        n values, or n by k for k series on the same x
+
+    n_out : int
+        points kept per series, at least 3
+
+    Returns
+    -------
+    numpy array of the row indices kept, n_out by k, or n_out if y is 1-D
+
+    '''
+    y = np.asarray(y, dtype=float)
+    flat = y.ndim == 1
+    y = np.nan_to_num(y.reshape(len(x), -1))
+    n, k = y.shape
+    if n <= n_out:
+        idx = np.repeat(np.arange(n)[:, None], k, axis=1)
+        return idx[:, 0] if flat else idx
+
+    # the first and last points are buckets of their own
+    x = np.asarray(x, dtype=float)
+    x = x - x[0]
+    edges = np.append(1 + np.searchsorted(bucket_ids(n - 2, n_out - 2), np.arange(n_out - 2)), n - 1)
+    idx = np.zeros((n_out, k), dtype=np.int64)
+    idx[-1] = n - 1
+    columns = np.arange(k)
+    for b in range(n_out - 2):
+        start, end = edges[b], edges[b + 1]
+        next_end = edges[b + 2] if b + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean(axis=0)
+        prev_x = x[idx[b]]
+        prev_y = y[idx[b], columns]
+        # twice the triangle areas of every point of the bucket, for every series
+        area = np.abs((prev_x - avg_x) * (y[start:end] - prev_y) - (prev_x - x[start:end, None]) * (avg_y - prev_y))
+        idx[b + 1] = start + area.argmax(axis=0)
+    return idx[:, 0] if flat else idx
+
+
+def minmax(x, y, n_out):
+    '''
+    Purpose
+    -------
+    the lowest and highest point of every bucket, in the order they occur; keeps every spike, e.g. the
+    bottom of a drawdown, and needs no loop
+
+    Parameters
+    ----------
+    x : numpy array
+        n increasing values
+
+    y : numpy array
+        n values, or n by k
+
+    n_out : int
+        points kept per series, two per bucket
+
+    Returns
+    -------
+    numpy array of the row indices kept, n_out by k, or n_out if y is 1-D
+
+    '''
+    y = np.asarray(y, dtype=float)
+    flat = y.ndim == 1
+    y = y.reshape(len(x), -1)
+    n, k = y.shape
+    n_buckets = n_out // 2
+    if n <= n_out:
+        idx = np.repeat(np.arange(n)[:, None], k, axis=1)
+        return idx[:, 0] if flat else idx
+
+    # buckets padded to the same size, so that one argmin and one argmax along an axis do all of them
+    bucket = bucket_ids(n, n_buckets)
+    starts = np.searchsorted(bucket, np.arange(n_buckets))
+    size = np.diff(np.append(starts, n)).max()
+    rows = starts[:, None] + np.arange(size)
+    padded = rows >= np.append(starts[1:], n)[:, None]
+    rows = np.where(padded, starts[:, None], rows)
+    values = y[rows]
+    low = np.where(padded[:, :, None], np.inf, np.nan_to_num(values, nan=np.inf)).argmin(axis=1)
+    high = np.where(padded[:, :, None], -np.inf, np.nan_to_num(values, nan=-np.inf)).argmax(axis=1)
+    first = starts[:, None] + np.minimum(low, high)
+    second = starts[:, None] + np.maximum(low, high)
+    idx = np.stack([first, second], axis=1).reshape(2 * n_buckets, k)
+    return idx[:, 0] if flat else idx
+
+
+class Downsampler():
+    '''
+    the columns of a date indexed frame, e.g. nav or cash history, cut to a date range and downsampled to a
+    number of points, usually the width of the chart in pixels
+
+    the points of every (columns, range, points, method) asked for are kept, so panning back to a range
+    or redrawing the same chart does no work
+    '''
+    dates = None
+    columns = None
+    values = None
+    cache = None
+    max_size = 64
+
+
+    def __init__(self, df, x_column='Date', max_size=64):
+        '''
+        Parameters
+        ----------
+        df : DataFrame
+            one row per date, sorted, with x_column and numeric columns, or a DatetimeIndex
+
+        x_column : str, optional
+            default 'Date'; the index is used if df has no such column
+
+        max_size : int, optional
+            most results kept, default 64
+
+        '''
+        if x_column in df.columns:
+            df = df.set_index(x_column)
+        df = df.select_dtypes(include='number')
+        self.dates = pd.DatetimeIndex(df.index).values
+        self.columns = list(df.columns)
+        self.values = df.values.astype(float)
+        self.max_size = max_size
+        self.cache = OrderedDict()
+
+
+    def window(self, start=None, end=None):
+        # first and one past the last row between start and end, both included
+        first = 0 if start is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side='left')
+        last = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)),
+                                                                    side='right')
+        return first, last
+
+
+    def series(self, columns=None, start=None, end=None, n_out=1000, method='lttb'):
+        '''
+        Purpose
+        -------
+        the points to draw of every column between start and end
+
+        Parameters
+        ----------
+        columns : list, optional
+            default None for every column
+
+        start, end : date, optional
+            range shown, default None for the whole history
+
+        n_out : int, optional
+            points per column, default 1000
+
+        method : str, optional
+            'lttb' or 'minmax', see lttb and minmax, default 'lttb'
+
+        Returns
+        -------
+        dictionary with columns as keys and (dates, values) numpy arrays as values
+
+        '''
+        if method not in METHODS:
+            raise ValueError('downsampling method must be one of {}, not {}'.format(METHODS, method))
+        columns = self.columns if columns is None else list(columns)
+        first, last = self.window(start, end)
+        key = (tuple(columns), first, last, n_out, method)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        positions = [self.columns.index(c) for c in columns]
+        dates = self.dates[first:last]
+        values = self.values[first:last][:, positions]
+        if len(dates) == 0:
+            result = {c: (dates, values[:, i]) for (i, c) in enumerate(columns)}
+        else:
+            sampler = lttb if method == 'lttb' else minmax
+            idx = sampler(dates.astype(np.int64), values, n_out)
+            result = {c: (dates[idx[:, i]], values[idx[:, i], i]) for (i, c) in enumerate(columns)}
+
+        self.cache[key] = result
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return result
+
+
+#% test
+if __name__ == '__main__':
+    import time
+
+    # twenty years of daily values for two hundred symbols, with one spike
+    rng = np.random.default_rng(11)
+    dates = pd.bdate_range('2006-01-02', periods=5200)
+    values = 100 * np.cumprod(1 + rng.normal(0.0003, 0.01, (len(dates), 200)), axis=0)
+    values[2600, 0] = 1.0
+    df = pd.DataFrame(values, index=dates, columns=['S{}'.format(i) for i in range(200)])
+    df.index.name = 'Date'
+    downsampler = Downsampler(df.reset_index())
+
+    t = time.perf_counter()
+    points = downsampler.series(n_out=1000)
+    print('{} series of {} days to {} points in {:.4f}s'.format(len(points), len(dates), len(points['S0'][0]),
+                                                                time.perf_counter() - t))
+    x0, y0 = points['S0']
+    assert (len(x0) == 1000) and (x0[0] == dates[0]) and (x0[-1] == dates[-1]) and (np.diff(x0.astype(np.int64)) > 0).all()
+    assert y0.min() == 1.0
+
+    t = time.perf_counter()
+    points = downsampler.series(['S0', 'S1'], start='2010-01-01', end='2012-12-31', n_out=400, method='minmax')
+    print('minmax of a zoomed range in {:.4f}s'.format(time.perf_counter() - t))
+    x1, y1 = points['S1']
+    in_range = df.loc['2010-01-01':'2012-12-31', 'S1']
+    assert (y1.min() == in_range.min()) and (y1.max() == in_range.max()) and (np.diff(x1.astype(np.int64)) >= 0).all()
+    assert downsampler.series(['S0', 'S1'], start='2010-01-01', end='2012-12-31', n_out=400, method='minmax') is points
+
+    # a short series is drawn as is
+    assert (lttb(np.arange(5), np.arange(5.0), 10) == np.arange(5)).all()
+    assert (minmax(np.arange(5), np.arange(5.0), 10) == np.arange(5)).all()
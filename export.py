@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:20:52 2026
+
+@author: Frank Shi
+"""
+import json
+import os
+import pandas as pd
+
+
+# columnar formats are written next to the workbook, one file per sheet, in '<workbook name>_frames'
+COLUMNAR_FORMATS = ['feather', 'parquet']
+# the sheets of the last write, in the frames folder, see read_report
+MANIFEST_FILENAME = 'sheets.json'
+
+
+def excel_engine():
+    '''
+    Purpose
+    -------
+    pick the fastest installed engine for writing xlsx files
+
+    Returns
+    -------
+    str, 'xlsxwriter' if it is installed, otherwise 'openpyxl'
+
+    '''
+    try:
+        import xlsxwriter
+        return 'xlsxwriter'
+    except ImportError:
+        return 'openpyxl'
+
+
+def frames_folder(filename):
+    return os.path.splitext(filename)[0] + '_frames'
+
+
+def sheet_filename(filename, sheet_name, file_format):
+    return os.path.join(frames_folder(filename), '{}.{}'.format(sheet_name.replace(' ', '_'), file_format))
+
+
+def manifest_filename(filename):
+    return os.path.join(frames_folder(filename), MANIFEST_FILENAME)
+
+
+def clear_frames(filename):
+    # remove the columnar files and the manifest of an earlier write, so that no sheet outlives the run
+    # that wrote it
+    folder = frames_folder(filename)
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        if (name == MANIFEST_FILENAME) or (os.path.splitext(name)[1][1:] in COLUMNAR_FORMATS):
+            os.remove(os.path.join(folder, name))
+
+
+def to_columnar(df):
+    '''
+    Purpose
+    -------
+    make a dataframe storable in arrow based formats: a default index and columns of one type each
+
+    Parameters
+    ----------
+    df : DataFrame
+
+    Returns
+    -------
+    DataFrame
+
+    '''
+    if not isinstance(df.index, pd.RangeIndex):
+        df = df.reset_index()
+    df.columns = [str(c) for c in df.columns]
+    # columns mixing e.g. datetimes and strings cannot be stored by arrow, store them as text
+    for col in df.columns[df.dtypes == object]:
+        if df[col].dropna().map(type).nunique() > 1:
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def write_report(sheet_dict, filename, formats=('xlsx', 'feather')):
+    '''
+    Purpose
+    -------
+    write the sheets of a report to an excel workbook and/or one columnar file per sheet
+
+    Parameters
+    ----------
+    sheet_dict : dict
+        sheet names as keys and DataFrames as values; the index is written to excel only if it is not the
+        default range index
+
+    filename : str
+        path of the xlsx workbook; columnar files go to the '<workbook name>_frames' folder next to it
+
+    formats : iterable, optional
+        any of 'xlsx', 'feather' and 'parquet', default ('xlsx', 'feather'); the columnar files of an earlier
+        write are removed either way, and a manifest of the sheets is written next to the new ones
+
+    Returns
+    -------
+    None.
+
+    '''
+    clear_frames(filename)
+    if 'xlsx' in formats:
+        with pd.ExcelWriter(filename, engine=excel_engine(), mode='w') as writer:
+            for sheet_name in sheet_dict:
+                df = sheet_dict[sheet_name]
+                df.to_excel(writer, sheet_name=sheet_name, index=not isinstance(df.index, pd.RangeIndex))
+
+    columnar_formats = [f for f in formats if f in COLUMNAR_FORMATS]
+    if len(columnar_formats) > 0:
+        os.makedirs(frames_folder(filename), exist_ok=True)
+        for sheet_name in sheet_dict:
+            df = to_columnar(sheet_dict[sheet_name].copy())
+            if 'feather' in columnar_formats:
+                # uncompressed so that it can be memory mapped when read back
+                df.to_feather(sheet_filename(filename, sheet_name, 'feather'), compression='uncompressed')
+            if 'parquet' in columnar_formats:
+                df.to_parquet(sheet_filename(filename, sheet_name, 'parquet'), index=False)
+        with open(manifest_filename(filename), 'w') as f:
+            json.dump(list(sheet_dict), f)
+
+
+def read_columnar_sheet(filename, sheet_name):
+    '''
+    Purpose
+    -------
+    read one sheet of a report written by write_report from its memory mapped columnar file
+
+    Parameters
+    ----------
+    filename : str
+        path of the xlsx workbook the report was written to
+
+    sheet_name : str
+        e.g. 'Current Holdings'
+
+    Returns
+    -------
+    DataFrame, or None if the sheet was not written in a columnar format
+
+    '''
+    feather_filename = sheet_filename(filename, sheet_name, 'feather')
+    if os.path.exists(feather_filename):
+        import pyarrow.feather as feather
+        return feather.read_table(feather_filename, memory_map=True).to_pandas()
+
+    parquet_filename = sheet_filename(filename, sheet_name, 'parquet')
+    if os.path.exists(parquet_filename):
+        return pd.read_parquet(parquet_filename, memory_map=True)
+
+    return None
+
+
+def read_report(filename, sheet_names):
+    '''
+    Purpose
+    -------
+    read several sheets of a report written by write_report
+
+    Parameters
+    ----------
+    filename : str
+        path of the xlsx workbook the report was written to
+
+    sheet_names : list
+        e.g. ['Current Holdings', 'Performance Asof']
+
+    Returns
+    -------
+    a dictionary with sheet names as keys and DataFrames as values, None for a sheet the report does not have;
+    with a manifest, only the sheets of the last write
+
+    '''
+    if os.path.exists(manifest_filename(filename)):
+        with open(manifest_filename(filename)) as f:
+            written = json.load(f)
+        return {sheet_name: read_columnar_sheet(filename, sheet_name) if sheet_name in written else None
+                for sheet_name in sheet_names}
+
+    sheets = {sheet_name: read_columnar_sheet(filename, sheet_name) for sheet_name in sheet_names}
+    missing = [sheet_name for sheet_name in sheet_names if sheets[sheet_name] is None]
+    if (len(missing) > 0) and os.path.exists(filename):
+        # older reports only have the workbook, open it once for every missing sheet
+        with pd.ExcelFile(filename) as workbook:
+            for sheet_name in missing:
+                if sheet_name in workbook.sheet_names:
+                    sheets[sheet_name] = workbook.parse(sheet_name)
+    return sheets
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 00:12:36 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+import useful_functions
+
+
+# every rate is fetched as a usd leg, units of the currency per usd, and crosses are triangulated through it
+PIVOT = 'USD'
+
+
+def leg_symbol(currency):
+    # yahoo finance symbol of the usd leg of a currency, e.g. 'CAD=X' for cad per usd
+    return useful_functions.fx_symbol(PIVOT + currency)
+
+
+def pair_name(currency, base='CAD'):
+    # key of a rate in Holdings.fx_dict, e.g. 'usdcad' for the cad value of one usd
+    return '{}{}'.format(currency, base).lower()
+
+
+def legs_needed(currencies, base='CAD'):
+    # the usd legs that convert currencies to base; none if everything is already in base
+    currencies = set(currencies) - {base}
+    if len(currencies) == 0:
+        return []
+    return sorted((currencies | {base}) - {PIVOT})
+
+
+def spot_rates(currencies, base='CAD', date=None):
+    '''
+    Purpose
+    -------
+    the rate of every currency to base on one date, from one usd leg per currency however many pairs that
+    makes, see useful_functions.get_fx
+
+    Parameters
+    ----------
+    currencies : iterable
+        currency codes, e.g. ['USD', 'EUR']
+
+    base : str, optional
+        default 'CAD'
+
+    date : datetime, optional
+        rates on the close of date, default None for the latest
+
+    Returns
+    -------
+    a dictionary of pair_name keys, e.g. 'usdcad', and the value of one unit of the currency in base
+
+    '''
+    legs = legs_needed(currencies, base)
+    fetched = useful_functions.get_fx([pair_name(PIVOT, c) for c in legs], date)
+    per_usd = {c: fetched[pair_name(PIVOT, c)] for c in legs}
+    per_usd[PIVOT] = 1.0
+    return {pair_name(c, base): per_usd[base] / per_usd[c] for c in set(currencies) - {base}}
+
+
+def spot_rate(currency, base, date=None):
+    # value of one unit of currency in base
+    if currency == base:
+        return 1.0
+    return spot_rates([currency], base, date)[pair_name(currency, base)]
+
+
+class FXMatrix():
+    '''
+    a dense date by currency matrix of the value of one unit of each currency in the base currency, built from
+    one usd leg per currency; crosses, e.g. eur to cad, are triangulated through usd, so a new listing currency
+    is one more column fetched once, not a lookup per row
+
+    convert and convert_matrix turn whole arrays of amounts to the base currency with one broadcast multiply
+    '''
+    base = 'CAD'
+    dates = None
+    currencies = None
+    rates = None
+
+
+    def __init__(self, per_usd, base='CAD'):
+        '''
+        Parameters
+        ----------
+        per_usd : DataFrame
+            dates as index, currency codes as columns and units of the currency per usd as values; the base
+            currency must be one of the columns unless it is usd
+
+        base : str, optional
+            default 'CAD'
+
+        '''
+        per_usd = per_usd.copy()
+        per_usd[PIVOT] = 1.0
+        self.base = base
+        self.dates = pd.DatetimeIndex(per_usd.index)
+        self.currencies = list(per_usd.columns)
+        # base per unit of currency = (base per usd) / (currency per usd)
+        self.rates = per_usd[[base]].values / per_usd.values
+
+
+    @classmethod
+    def from_store(cls, store, currencies, dates, base='CAD'):
+        '''
+        Purpose
+        -------
+        the matrix on dates from the daily closes of the usd legs in a price_store.PriceStore, fetched at
+        once for whatever the store does not have
+
+        '''
+        dates = pd.DatetimeIndex(dates)
+        legs = legs_needed(currencies, base)
+        closes = store.price_matrix([leg_symbol(c) for c in legs], dates)
+        per_usd = pd.DataFrame(closes.values, index=dates, columns=legs)
+        for c in set(currencies) | {base}:
+            if c not in per_usd.columns and c != PIVOT:
+                # only base itself when nothing needs converting
+                per_usd[c] = 1.0
+        return cls(per_usd, base)
+
+
+    @classmethod
+    def from_provider(cls, currencies, dates, base='CAD'):
+        '''
+        Purpose
+        -------
+        the matrix on dates without a price store: one history request per usd leg over the whole range,
+        through the shared market_data client
+
+        '''
+        from market_data import client
+
+        dates = pd.DatetimeIndex(dates).normalize()
+        legs = legs_needed(currencies, base)
+        per_usd = pd.DataFrame(index=dates)
+        if len(legs) > 0:
+            # a week of look back so that the first rows have a close to carry forward
+            start = dates.min() - timedelta(days=7)
+            ranges = [(leg_symbol(c), start, dates.max()) for c in legs]
+            results = client().run(client().histories(ranges))
+            for (c, r) in zip(legs, ranges):
+                if isinstance(results[r], Exception):
+                    raise results[r]
+                closes = results[r]['Close']
+                per_usd[c] = closes.reindex(closes.index.union(dates)).ffill().reindex(dates).values
+        for c in set(currencies) | {base}:
+            if c not in per_usd.columns and c != PIVOT:
+                per_usd[c] = 1.0
+        return cls(per_usd, base)
+
+
+    def positions(self, currencies):
+        # column of every currency, one hashed lookup for the whole array
+        idx = pd.Index(self.currencies).get_indexer(list(currencies))
+        if (idx < 0).any():
+            missing = sorted(set(np.asarray(currencies, dtype=object)[idx < 0]))
+            raise KeyError('no rates for {}, build the matrix with these currencies'.format(missing))
+        return idx
+
+
+    def columns(self, currencies):
+        # date by len(currencies) matrix of rates, a currency may repeat, e.g. one column per position
+        return self.rates[:, self.positions(currencies)]
+
+
+    def rate_df(self, currencies=None):
+        currencies = self.currencies if currencies is None else list(currencies)
+        return pd.DataFrame(self.columns(currencies), index=self.dates, columns=currencies)
+
+
+    def convert_matrix(self, amounts, currencies):
+        '''
+        Purpose
+        -------
+        a date by column matrix of local amounts, e.g. position values or cash balances on self.dates, in the
+        base currency
+
+        Parameters
+        ----------
+        amounts : array-like
+            len(self.dates) rows, one column per entry of currencies
+
+        currencies : list
+            currency of every column
+
+        '''
+        return np.asarray(amounts) * self.columns(currencies)
+
+
+    def convert(self, amounts, currencies, dates):
+        '''
+        Purpose
+        -------
+        one amount per row, e.g. the cash flows of a ledger, in the base currency, each at the rate of its own
+        date or the last date before it
+
+        Parameters
+        ----------
+        amounts, currencies, dates : array-like
+            of the same length
+
+        Returns
+        -------
+        numpy array
+
+        '''
+        rows = np.searchsorted(self.dates.values, pd.DatetimeIndex(dates).normalize().values, side='right') - 1
+        return np.asarray(amounts, dtype=float) * self.rates[rows.clip(min=0), self.positions(currencies)]
+
+
+#% test
+if __name__ == '__main__':
+    import time
+
+    dates = pd.bdate_range('2016-01-01', '2026-10-16')
+    rng = np.random.default_rng(4)
+    per_usd = pd.DataFrame({'CAD': 1.3 + rng.normal(0, 0.01, len(dates)).cumsum() * 0.01,
+                            'EUR': 0.9 + rng.normal(0, 0.01, len(dates)).cumsum() * 0.01,
+                            'GBP': 0.78 + rng.normal(0, 0.01, len(dates)).cumsum() * 0.01,
+                            'HKD': 7.8 + np.zeros(len(dates))}, index=dates)
+    fx = FXMatrix(per_usd, base='CAD')
+    eurcad = fx.rate_df(['EUR'])['EUR']
+    assert np.allclose(eurcad, per_usd['CAD'] / per_usd['EUR'])
+    assert np.allclose(fx.rate_df(['CAD'])['CAD'], 1)
+    assert np.allclose(fx.rate_df(['USD'])['USD'], per_usd['CAD'])
+
+    # the same numbers against a gbp base
+    gbp = FXMatrix(per_usd, base='GBP')
+    assert np.allclose(gbp.rate_df(['EUR'])['EUR'] * fx.rate_df(['GBP'])['GBP'], eurcad)
+
+    # a ledger of a million cash flows in four currencies, converted in one multiply
+    n = 1000000
+    flow_currencies = rng.choice(['CAD', 'USD', 'EUR', 'HKD'], n)
+    flow_dates = dates[rng.integers(0, len(dates), n)]
+    amounts = rng.normal(0, 1000, n)
+    t = time.perf_counter()
+    converted = fx.convert(amounts, flow_currencies, flow_dates)
+    print('{} flows in {:.3f}s'.format(n, time.perf_counter() - t))
+    i = int(np.flatnonzero(flow_currencies == 'EUR')[0])
+    assert np.isclose(converted[i], amounts[i] * eurcad[flow_dates[i]])
+
+    positions = rng.normal(0, 1000, (len(dates), 3))
+    assert np.allclose(fx.convert_matrix(positions, ['USD', 'USD', 'HKD'])[:, 1], positions[:, 1] * per_usd['CAD'])
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 20:15:40 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from pandas.tseries.offsets import DateOffset
+
+from fx import FXMatrix
+
+
+# questrade (activity type, action) pairs that are income or expenses, None matching any action
+INCOME_TYPES = {('Dividends', 'DIV'): 'Dividend',
+                ('Dividends', 'NRT'): 'Withholding Tax',
+                ('Dividends', None): 'Dividend',
+                ('Corporate actions', 'CIL'): 'Cash in Lieu',
+                ('Fees and rebates', 'FCH'): 'Fee',
+                ('Other', 'GST'): 'Fee',
+                ('Interest', None): 'Interest'}
+
+
+def income_type(activity, action):
+    return INCOME_TYPES.get((activity, action), INCOME_TYPES.get((activity, None)))
+
+
+def income_ledger(transaction, store):
+    '''
+    Purpose
+    -------
+    every dividend, withholding tax, cash in lieu, fee and interest row of a ledger as a typed table with
+    gross, withholding and net amounts in the row's currency and in cad
+
+    Parameters
+    ----------
+    transaction : TransactionHistory
+
+    store : PriceStore
+        for the fx rate of every row's currency and date, looked up in one go
+
+    Returns
+    -------
+    DataFrame with one row per ledger row: 'Date', 'Symbol', 'Type', 'Currency', 'Gross', 'Withholding',
+    'Net', 'FX', 'Gross CAD', 'Withholding CAD', 'Net CAD' and 'Description'; withholding is negative
+
+    '''
+    df = transaction.df
+    types = pd.Series([income_type(a, b) for (a, b) in zip(df['Activity Type'], df['Action'])], index=df.index)
+    rows = df[types.notna()]
+    ledger = pd.DataFrame({'Date': pd.DatetimeIndex(rows['Transaction Date']).normalize(),
+                           'Symbol': rows['Symbol'].fillna('').values, 'Type': types[types.notna()].values,
+                           'Currency': rows['Currency'].str.upper().values,
+                           'Net': rows['Net Amount'].values.astype(float),
+                           'Description': rows['Description'].values})
+
+    # a dividend reported net of withholding carries the gross in 'Gross Amount'; a separate NRT row is all
+    # withholding
+    gross_amount = rows['Gross Amount'].fillna(0).values.astype(float)
+    is_withholding = (ledger['Type'] == 'Withholding Tax').values
+    ledger['Gross'] = np.where(is_withholding, 0, np.where(gross_amount != 0, gross_amount, ledger['Net']))
+    ledger['Withholding'] = np.where(is_withholding, ledger['Net'], ledger['Net'] - ledger['Gross'])
+    ledger['Type'] = ledger['Type'].replace('Withholding Tax', 'Dividend')
+
+    if len(ledger) > 0:
+        dates = pd.DatetimeIndex(sorted(ledger['Date'].unique()))
+        fx_matrix = FXMatrix.from_store(store, ledger['Currency'].unique(), dates)
+        ledger['FX'] = fx_matrix.convert(np.ones(len(ledger)), ledger['Currency'], ledger['Date'])
+    else:
+        ledger['FX'] = []
+    for col in ['Gross', 'Withholding', 'Net']:
+        ledger['{} CAD'.format(col)] = ledger[col] * ledger['FX']
+
+    columns = ['Date', 'Symbol', 'Type', 'Currency', 'Gross', 'Withholding', 'Net', 'FX', 'Gross CAD',
+               'Withholding CAD', 'Net CAD', 'Description']
+    return ledger[columns].sort_values(by='Date', kind='stable').reset_index(drop=True)
+
+
+def income_by_month(ledger_df, value_col='Net CAD'):
+    # one row per symbol (fees and interest under their type), one column per month
+    df = ledger_df.assign(Month=ledger_df['Date'].dt.to_period('M').astype(str),
+                          Symbol=np.where(ledger_df['Symbol'] == '', ledger_df['Type'], ledger_df['Symbol']))
+    wide = df.pivot_table(index='Symbol', columns='Month', values=value_col, aggfunc='sum', fill_value=0)
+    wide['Total'] = wide.sum(axis=1)
+    return wide.sort_values(by='Total', ascending=False).reset_index()
+
+
+def withholding_summary(ledger_df):
+    # gross dividends and tax withheld by calendar year and currency
+    dividends = ledger_df[ledger_df['Type'] == 'Dividend']
+    df = dividends.groupby([dividends['Date'].dt.year.rename('Year'), 'Currency'])[
+        ['Gross', 'Withholding', 'Gross CAD', 'Withholding CAD']].sum()
+    df['Withholding Rate'] = (0 - df['Withholding']) / df['Gross']
+    return df.reset_index()
+
+
+def yield_on_cost(ledger_df, position_df, asof_date):
+    '''
+    Purpose
+    -------
+    trailing twelve month dividends of every security held on asof_date over its book cost
+
+    Parameters
+    ----------
+    ledger_df : DataFrame
+        output of income_ledger
+
+    position_df : DataFrame
+        first output of objects.position_history, for quantity and average cost without pricing anything
+
+    asof_date : datetime
+
+    Returns
+    -------
+    DataFrame with one row per symbol: 'Currency', 'Quantity', 'Average Cost', 'Book Cost', 'T12M Gross',
+    'T12M Net' and 'Yield on Cost', the gross dividends over book cost, both in the security's currency
+
+    '''
+    asof_date = pd.Timestamp(asof_date)
+    held = position_df[pd.DatetimeIndex(position_df['Date']) <= asof_date]
+    held = held.groupby('Symbol')[['Currency', 'Instrument', 'Quantity', 'Average Cost']].last()
+    held = held[(held['Quantity'] != 0) & (held['Instrument'] != 'Option')]
+    held['Book Cost'] = held['Quantity'] * held['Average Cost']
+
+    window = ledger_df[(ledger_df['Date'] > asof_date - DateOffset(months=12)) & (ledger_df['Date'] <= asof_date)
+                       & (ledger_df['Type'] == 'Dividend')]
+    trailing = window.groupby('Symbol')[['Gross', 'Net']].sum().rename(columns={'Gross': 'T12M Gross',
+                                                                                'Net': 'T12M Net'})
+    df = held.join(trailing, how='left').fillna({'T12M Gross': 0, 'T12M Net': 0})
+    df['Yield on Cost'] = df['T12M Gross'] / df['Book Cost']
+    df.index.name = 'Symbol'
+    return df.drop(columns=['Instrument']).sort_values(by='Yield on Cost', ascending=False).reset_index()
+
+
+def income_report(transaction, store, asof_date=None):
+    '''
+    Purpose
+    -------
+    every income table of an account from its ledger alone, without valuing the holdings
+
+    Parameters
+    ----------
+    transaction : TransactionHistory
+
+    store : PriceStore
+
+    asof_date : datetime, optional
+        default None for the last transaction date
+
+    Returns
+    -------
+    a dictionary of sheet names and DataFrames, see export.write_report
+
+    '''
+    from objects import position_history
+    if asof_date is None:
+        asof_date = transaction.last_transaction_date
+    ledger_df = income_ledger(transaction, store)
+    ledger_df = ledger_df[ledger_df['Date'] <= pd.Timestamp(asof_date)]
+    position_df = position_history(transaction)[0]
+    return {'Income Ledger': ledger_df, 'Income by Month': income_by_month(ledger_df),
+            'Withholding Tax': withholding_summary(ledger_df),
+            'Yield on Cost': yield_on_cost(ledger_df, position_df, asof_date)}
+
+
+#% test
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import useful_functions
+    from objects import TransactionHistory
+    from price_store import PriceStore
+
+    useful_functions.set_offline(True)
+
+    def row(date, activity, action, symbol, quantity, price, net, currency='CAD', gross=None):
+        date_str = pd.Timestamp(date).strftime('%Y-%m-%d %H:%M:%S') + ' AM'
+        return {'Transaction Date': date_str, 'Settlement Date': date_str, 'Action': action, 'Symbol': symbol,
+                'Description': '', 'Quantity': quantity, 'Price': price,
+                'Gross Amount': net if gross is None else gross, 'Commission': 0.0, 'Net Amount': net,
+                'Currency': currency, 'Activity Type': activity, 'Account #': 1, 'Account Type': 'Margin'}
+
+    ledger = pd.DataFrame([row('2025-06-02', 'Deposits', 'DEP', np.nan, 0, 0, 10000),
+                           row('2025-06-02', 'Deposits', 'DEP', np.nan, 0, 0, 10000, 'USD'),
+                           row('2025-06-03', 'Trades', 'Buy', 'SPY', 10, 500.0, -5000, 'USD'),
+                           row('2025-06-03', 'Trades', 'Buy', 'XIU.TO', 100, 30.0, -3000),
+                           # the day the window starts is left out, the next quarter is in
+                           row('2025-06-30', 'Dividends', 'DIV', 'XIU.TO', 0, 0, 40.0),
+                           row('2025-09-30', 'Dividends', 'DIV', 'XIU.TO', 0, 0, 45.0),
+                           # net of withholding, the gross in 'Gross Amount'
+                           row('2026-03-31', 'Dividends', 'DIV', 'SPY', 0, 0, 16.0, 'USD', gross=18.8),
+                           # the withholding as a row of its own
+                           row('2026-06-30', 'Dividends', 'DIV', 'SPY', 0, 0, 18.0, 'USD'),
+                           row('2026-06-30', 'Dividends', 'NRT', 'SPY', 0, 0, -2.7, 'USD'),
+                           row('2026-02-27', 'Fees and rebates', 'FCH', np.nan, 0, 0, -25.0),
+                           row('2026-03-02', 'Fees and rebates', 'REB', np.nan, 0, 0, 25.0)])
+    transaction = TransactionHistory(ledger, 'questrade')
+
+    folder = tempfile.mkdtemp()
+    dates = pd.bdate_range('2025-05-01', '2026-07-31')
+    pd.DataFrame({'Date': dates, 'Close': 1.4, 'Adj Close': 1.4}).to_csv(os.path.join(folder, 'CAD_X.csv'),
+                                                                         index=False)
+    report = income_report(transaction, PriceStore(folder), asof_date=pd.Timestamp('2026-06-30'))
+
+    ledger_df = report['Income Ledger']
+    spy = ledger_df[ledger_df['Symbol'] == 'SPY'].set_index('Date')
+    assert (spy.loc['2026-03-31', 'Gross'] == 18.8) and np.isclose(spy.loc['2026-03-31', 'Withholding'], -2.8)
+    assert np.isclose(spy.loc['2026-03-31', 'Gross CAD'], 18.8 * 1.4)
+    nrt = spy.loc['2026-06-30'].set_index('Net')
+    assert (nrt.loc[-2.7, 'Gross'] == 0) and (nrt.loc[-2.7, 'Withholding'] == -2.7)
+    assert nrt.loc[-2.7, 'Type'] == 'Dividend'
+    assert (nrt.loc[18.0, 'Gross'] == 18.0) and (nrt.loc[18.0, 'Withholding'] == 0)
+
+    # the fee is booked, the rebate is not
+    fees = ledger_df[ledger_df['Type'] == 'Fee']
+    assert (len(fees) == 1) and (fees['Net'].iloc[0] == -25.0)
+    assert not (ledger_df['Net'] == 25.0).any()
+
+    withholding = report['Withholding Tax'].set_index(['Year', 'Currency'])
+    assert np.isclose(withholding.loc[(2026, 'USD'), 'Withholding Rate'], (2.8 + 2.7) / (18.8 + 18.0))
+
+    yield_df = report['Yield on Cost'].set_index('Symbol')
+    assert yield_df.loc['XIU.TO', 'T12M Gross'] == 45.0
+    assert np.isclose(yield_df.loc['XIU.TO', 'Yield on Cost'], 45.0 / 3000)
+    assert np.isclose(yield_df.loc['SPY', 'Yield on Cost'], (18.8 + 18.0) / 5000)
+    print(yield_df)
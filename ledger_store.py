@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 22:58:14 2026
+
+@author: Frank Shi
+"""
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from objects import parse_questrade_dates
+
+
+# columns of the questrade export that identify a row; anything else in an export is stored but not hashed
+FINGERPRINT_COLUMNS = ['Transaction Date', 'Settlement Date', 'Action', 'Symbol', 'Description', 'Quantity',
+                       'Price', 'Gross Amount', 'Commission', 'Net Amount', 'Currency', 'Account #', 'Activity Type',
+                       'Account Type']
+DATE_COLUMNS = ['Transaction Date', 'Settlement Date']
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def canonical(value):
+    # the same text for a value however the export was read, e.g. 123, 123.0 and '123'
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return format(float(value), '.10g')
+    text = str(value).strip()
+    try:
+        return format(float(text), '.10g')
+    except ValueError:
+        return text
+
+
+def fingerprints(transaction_df, account):
+    '''
+    Purpose
+    -------
+    a stable id of every row of a questrade export: a hash of the account and the row's values, plus how many
+    identical rows came before it in the same export, so that two real fills with the same values are kept
+    while the same fill in two overlapping exports is not
+
+    Parameters
+    ----------
+    transaction_df : DataFrame
+        the dataframe exported by questrade, dates already parsed
+
+    account : str
+        account key, e.g. 'tfsa'
+
+    Returns
+    -------
+    a list of str, one per row
+
+    '''
+    columns = [c for c in FINGERPRINT_COLUMNS if c in transaction_df.columns]
+    hashes = []
+    for values in transaction_df[columns].itertuples(index=False, name=None):
+        text = '\x1f'.join([account] + [canonical(v) for v in values])
+        hashes.append(hashlib.sha1(text.encode('utf-8')).hexdigest())
+    occurrence = pd.Series(hashes).groupby(hashes).cumcount().values
+    return ['{}-{}'.format(h, n) for (h, n) in zip(hashes, occurrence)]
+
+
+def dedupe(transaction_dfs, account):
+    # several overlapping exports of one account as one ledger, every row once, without a store
+    frames = [parse_questrade_dates(df.copy()) for df in transaction_dfs]
+    frames = [df.assign(Fingerprint=fingerprints(df, account)) for df in frames]
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(subset=['Fingerprint'])
+    return df.drop(columns=['Fingerprint']).reset_index(drop=True)
+
+
+class LedgerStore():
+    '''
+    every questrade row of every account in one append-only sqlite file; rows are never updated or deleted,
+    an export that overlaps what is stored only adds the rows that are new
+
+    rows are indexed on (account, transaction date, action, symbol), so an account or date range is read
+    with an indexed range query
+    '''
+    filename = ''
+    connection = None
+    columns = None
+
+
+    def __init__(self, filename):
+        self.filename = filename
+        folder = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS ingests (id INTEGER PRIMARY KEY, source TEXT, '
+                                    'account TEXT, ingested_at TEXT, rows INTEGER, new_rows INTEGER)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS ledger (fingerprint TEXT PRIMARY KEY, '
+                                    'account TEXT NOT NULL, ingest_id INTEGER, seq INTEGER, '
+                                    '"Transaction Date" TEXT, "Settlement Date" TEXT, "Action" TEXT, "Symbol" TEXT)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS ledger_account_date ON ledger '
+                                    '(account, "Transaction Date", "Action", "Symbol")')
+        self.columns = self.table_columns()
+
+
+    def table_columns(self):
+        return [r[1] for r in self.connection.execute('PRAGMA table_info(ledger)')]
+
+
+    def add_columns(self, transaction_df):
+        # exports that carry a column the table has not seen yet widen it
+        for col in transaction_df.columns:
+            if col not in self.columns:
+                sql_type = 'REAL' if pd.api.types.is_numeric_dtype(transaction_df[col]) else 'TEXT'
+                self.connection.execute('ALTER TABLE ledger ADD COLUMN "{}" {}'.format(col.replace('"', '""'), sql_type))
+        self.columns = self.table_columns()
+
+
+    def ingest(self, transaction_df, account, source=''):
+        '''
+        Purpose
+        -------
+        append the rows of an export that are not stored yet, in time proportional to the export
+
+        Parameters
+        ----------
+        transaction_df : DataFrame
+            the dataframe exported by questrade
+
+        account : str
+            account key, e.g. 'tfsa'
+
+        source : str, optional
+            where the export came from, kept in the ingests table, default ''
+
+        Returns
+        -------
+        the number of new rows
+
+        '''
+        df = parse_questrade_dates(transaction_df.copy())
+        keys = fingerprints(df, account)
+        with self.connection:
+            self.add_columns(df)
+            for col in DATE_COLUMNS:
+                df[col] = df[col].dt.strftime(DATE_FORMAT)
+            df = df.astype(object).where(df.notna(), None)
+            cursor = self.connection.execute('INSERT INTO ingests (source, account, ingested_at, rows) VALUES (?, ?, ?, ?)',
+                                             (source, account, datetime.now().strftime(DATE_FORMAT), len(df)))
+            ingest_id = cursor.lastrowid
+            before = self.connection.total_changes
+            columns = ['fingerprint', 'account', 'ingest_id', 'seq'] + list(df.columns)
+            sql = 'INSERT OR IGNORE INTO ledger ({}) VALUES ({})'.format(
+                ', '.join('"{}"'.format(c.replace('"', '""')) for c in columns), ', '.join('?' * len(columns)))
+            self.connection.executemany(sql, ([k, account, ingest_id, i] + list(row) for (i, (k, row)) in
+                                              enumerate(zip(keys, df.itertuples(index=False, name=None)))))
+            new_rows = self.connection.total_changes - before
+            self.connection.execute('UPDATE ingests SET new_rows = ? WHERE id = ?', (new_rows, ingest_id))
+        print('{}: {} rows of {} are new'.format(account, new_rows, len(df)))
+        return new_rows
+
+
+    def query(self, account, start=None, end=None):
+        # the sql and parameters of an account and date slice; both ends are inclusive dates
+        sql = 'SELECT * FROM ledger WHERE account = ?'
+        params = [account]
+        if start is not None:
+            sql += ' AND "Transaction Date" >= ?'
+            params.append(pd.Timestamp(start).normalize().strftime(DATE_FORMAT))
+        if end is not None:
+            sql += ' AND "Transaction Date" < ?'
+            params.append((pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).strftime(DATE_FORMAT))
+        sql += ' ORDER BY "Transaction Date", "Settlement Date", ingest_id, seq'
+        return sql, params
+
+
+    def to_export(self, df):
+        # back to the columns and types of the questrade export
+        df = df.drop(columns=['fingerprint', 'account', 'ingest_id', 'seq'])
+        for col in DATE_COLUMNS:
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT)
+        return df
+
+
+    def load(self, account, start=None, end=None):
+        '''
+        Purpose
+        -------
+        the rows of one account, optionally between two transaction dates, in the questrade export format
+
+        Parameters
+        ----------
+        account : str
+
+        start, end : datetime, optional
+            first and last transaction date, inclusive, default None for no limit
+
+        Returns
+        -------
+        DataFrame sorted by transaction and settlement date, dates parsed
+
+        '''
+        sql, params = self.query(account, start, end)
+        return self.to_export(pd.read_sql_query(sql, self.connection, params=params))
+
+
+    def chunks(self, account, start=None, end=None, chunksize=10000):
+        # the same slice in batches of rows, e.g. for objects.stream_replay
+        sql, params = self.query(account, start, end)
+        for chunk in pd.read_sql_query(sql, self.connection, params=params, chunksize=chunksize):
+            yield self.to_export(chunk)
+
+
+    def accounts(self):
+        return [r[0] for r in self.connection.execute('SELECT DISTINCT account FROM ledger ORDER BY account')]
+
+
+    def ingests(self):
+        return pd.read_sql_query('SELECT * FROM ingests ORDER BY id', self.connection)
+
+
+    def close(self):
+        self.connection.close()
+
+
+#% test
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    # three monthly exports of a year of trades, each overlapping the one before by half a month
+    rng = np.random.default_rng(1)
+    n = 3000
+    dates = pd.Timestamp('2026-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 90 * 24, n)), unit='h')
+    ledger_df = pd.DataFrame({'Transaction Date': dates.strftime('%Y-%m-%d %H:%M:%S') + ' AM',
+                              'Settlement Date': dates.strftime('%Y-%m-%d %H:%M:%S') + ' AM',
+                              'Action': rng.choice(['Buy', 'Sell'], n), 'Symbol': rng.choice(['XIU.TO', 'ZSP.TO'], n),
+                              'Description': '', 'Quantity': rng.integers(1, 5, n) * 10,
+                              'Price': 30.0, 'Gross Amount': 0.0, 'Commission': -4.95, 'Net Amount': 0.0,
+                              'Currency': 'CAD', 'Account #': 123, 'Activity Type': 'Trades', 'Account Type': 'TFSA'})
+    # the same fill twice on purpose, a real duplicate that must survive
+    ledger_df = pd.concat([ledger_df, ledger_df.iloc[[10]]]).sort_values(by='Transaction Date', kind='stable')
+    ledger_df = ledger_df.reset_index(drop=True)
+    month = pd.to_datetime(ledger_df['Transaction Date'], format='%Y-%m-%d %H:%M:%S %p')
+    exports = [ledger_df[(month >= pd.Timestamp('2026-01-01') + pd.DateOffset(months=m) - pd.DateOffset(days=15))
+                         & (month < pd.Timestamp('2026-02-01') + pd.DateOffset(months=m))] for m in range(3)]
+
+    store = LedgerStore(os.path.join(tempfile.mkdtemp(), 'ledger.sqlite'))
+    t = time.perf_counter()
+    new_rows = [store.ingest(e, 'tfsa', source='export {}'.format(i)) for (i, e) in enumerate(exports)]
+    print('ingested in {:.3f}s'.format(time.perf_counter() - t))
+    assert sum(new_rows) == len(ledger_df)
+    assert store.ingest(exports[1], 'tfsa') == 0
+    assert len(dedupe(exports, 'tfsa')) == len(ledger_df)
+
+    loaded = store.load('tfsa')
+    assert len(loaded) == len(ledger_df)
+    assert (loaded['Quantity'].values == ledger_df['Quantity'].values).all()
+    february = store.load('tfsa', '2026-02-01', '2026-02-28')
+    assert february['Transaction Date'].dt.month.unique().tolist() == [2]
+    plan = store.connection.execute('EXPLAIN QUERY PLAN ' + store.query('tfsa', '2026-02-01', '2026-02-28')[0],
+                                    store.query('tfsa', '2026-02-01', '2026-02-28')[1]).fetchall()
+    assert 'ledger_account_date' in str(plan), plan
+    print(store.ingests())
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 00:47:52 2026
+
+@author: Frank Shi
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# attributes a constituent file may carry; anything missing is 'Unknown'
+ATTRIBUTES = ['Region', 'Sector', 'Asset Class', 'Currency']
+
+
+def load_constituents(folder):
+    '''
+    Purpose
+    -------
+    read the constituent files of every fund in folder: one csv per fund named after its symbol, e.g.
+    'ZSP.TO.csv', with a 'Constituent' and a 'Weight' column and any of the ATTRIBUTES columns
+
+    Parameters
+    ----------
+    folder : str
+
+    Returns
+    -------
+    DataFrame with 'Fund', 'Constituent', 'Weight' and ATTRIBUTES columns, weights of every fund summing to 1
+
+    '''
+    frames = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.lower().endswith('.csv'):
+            continue
+        df = pd.read_csv(os.path.join(folder, filename))
+        df = df.dropna(subset=['Constituent', 'Weight'])
+        # issuers publish percentages or fractions; either way the fund is its constituents
+        df['Weight'] = df['Weight'] / df['Weight'].sum()
+        df['Fund'] = filename[:-len('.csv')]
+        frames.append(df)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['Fund', 'Constituent', 'Weight'] + ATTRIBUTES)
+    df = pd.concat(frames, ignore_index=True)
+    for col in ATTRIBUTES:
+        if col not in df.columns:
+            df[col] = 'Unknown'
+    df[ATTRIBUTES] = df[ATTRIBUTES].fillna('Unknown')
+    return df[['Fund', 'Constituent', 'Weight'] + ATTRIBUTES]
+
+
+def snapshot_key(holdings_df, value_col):
+    # the same key for the same positions and values, however the frame was read
+    return tuple(zip(holdings_df['Symbol'], holdings_df[value_col].round(2)))
+
+
+class LookThrough():
+    '''
+    expands fund positions into the securities the funds hold: a sparse fund by constituent weight matrix,
+    kept as its nonzero (fund, constituent, weight) triplets, times the fund value vector; a position without a
+    constituent file, or cash, is its own constituent
+
+    an attribute a constituent file does not give, e.g. no 'Asset Class' column, is the fund's own attribute in
+    the holdings, so a constituent of unknown attributes is kept apart per fund until those are filled in
+
+    the expanded holdings of each distinct snapshot are kept, so redrawing the same holdings does no work
+    '''
+    funds = None
+    constituents = None
+    attributes = None
+    rows = None
+    cols = None
+    weights = None
+    groups = None
+    group_cols = None
+    group_funds = None
+    cache = None
+    max_size = 32
+
+
+    def __init__(self, constituents_df, max_size=32):
+        '''
+        Parameters
+        ----------
+        constituents_df : DataFrame
+            output of load_constituents
+
+        max_size : int, optional
+            most snapshots kept, default 32
+
+        '''
+        self.funds = sorted(constituents_df['Fund'].unique())
+        # an attribute any file gives for a constituent is its attribute, whichever fund it is held through
+        constituent_df = constituents_df[['Constituent'] + ATTRIBUTES].replace('Unknown', np.nan)
+        constituent_df = constituent_df.groupby('Constituent', sort=True)[ATTRIBUTES].first().fillna('Unknown')
+        self.constituents = list(constituent_df.index)
+        self.attributes = constituent_df.reset_index()
+        self.rows = pd.Index(self.funds).get_indexer(constituents_df['Fund'])
+        self.cols = pd.Index(self.constituents).get_indexer(constituents_df['Constituent'])
+        self.weights = constituents_df['Weight'].values.astype(float)
+
+        # one group per constituent, or per (constituent, fund) when the fund has to fill in an attribute
+        unknown = (constituent_df[ATTRIBUTES] == 'Unknown').any(axis=1).values[self.cols]
+        n_funds = len(self.funds) + 1
+        keys = self.cols * n_funds + np.where(unknown, self.rows + 1, 0)
+        group_keys, self.groups = np.unique(keys, return_inverse=True)
+        self.group_cols = group_keys // n_funds
+        self.group_funds = group_keys % n_funds - 1
+        self.max_size = max_size
+        self.cache = OrderedDict()
+
+
+    @classmethod
+    def from_folder(cls, folder, max_size=32):
+        return cls(load_constituents(folder), max_size=max_size)
+
+
+    def exposure(self, fund_values):
+        # weights transposed times the vector of fund values: the value held in every constituent group
+        return np.bincount(self.groups, weights=self.weights * fund_values[self.rows], minlength=len(self.group_cols))
+
+
+    def fund_attributes(self, holdings_df):
+        # ATTRIBUTES of every fund as the holdings report gives them, 'Unknown' if it does not
+        df = holdings_df.drop_duplicates(subset=['Symbol']).set_index('Symbol')
+        df = df.reindex(columns=ATTRIBUTES).reindex(self.funds)
+        return df.fillna('Unknown')
+
+
+    def expand(self, holdings_df, value_col='Market Value CAD'):
+        '''
+        Purpose
+        -------
+        the holdings of a report with every fund replaced by its share of the fund's constituents
+
+        Parameters
+        ----------
+        holdings_df : DataFrame
+            Holdings.to_df output or a 'Current Holdings' sheet
+
+        value_col : str, optional
+            default 'Market Value CAD'
+
+        Returns
+        -------
+        DataFrame with one row per constituent and per position held directly: 'Symbol', 'Via' (the funds, or
+        '' if held directly), 'Instrument', ATTRIBUTES, value_col and 'Pct Portfolio'
+
+        '''
+        key = snapshot_key(holdings_df, value_col)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        fund_idx = pd.Index(self.funds).get_indexer(holdings_df['Symbol'])
+        is_fund = fund_idx >= 0
+        values = holdings_df[value_col].fillna(0).values.astype(float)
+        fund_values = np.bincount(fund_idx[is_fund], weights=values[is_fund], minlength=len(self.funds))
+
+        # attributes of every group, the unknown ones from the fund; groups that end up alike are one row
+        expanded = self.attributes.iloc[self.group_cols].rename(columns={'Constituent': 'Symbol'}).reset_index(drop=True)
+        fund_attributes = self.fund_attributes(holdings_df)
+        has_fund = self.group_funds >= 0
+        for col in ATTRIBUTES:
+            values = expanded[col].values.copy()
+            fill = has_fund & (values == 'Unknown')
+            values[fill] = fund_attributes[col].values[self.group_funds[fill]]
+            expanded[col] = values
+        final = expanded.groupby(['Symbol'] + ATTRIBUTES, sort=False).ngroup().values
+        expanded = expanded.drop_duplicates().reset_index(drop=True)
+
+        held = fund_values[self.rows] != 0
+        triplet_final = final[self.groups]
+        via = pd.DataFrame({'row': triplet_final[held], 'fund': np.array(self.funds, dtype=object)[self.rows[held]]})
+        via = via.drop_duplicates().sort_values(by=['row', 'fund']).groupby('row')['fund'].agg(', '.join)
+        expanded[value_col] = np.bincount(final, weights=self.exposure(fund_values), minlength=len(expanded))
+        expanded['Via'] = via.reindex(np.arange(len(expanded))).fillna('').values
+        expanded['Instrument'] = 'Look-through'
+        expanded = expanded[expanded['Via'] != '']
+
+        direct = holdings_df[~is_fund].copy()
+        for col in ATTRIBUTES:
+            if col not in direct.columns:
+                direct[col] = 'Unknown'
+        direct['Via'] = ''
+        columns = ['Symbol', 'Via', 'Instrument'] + ATTRIBUTES + [value_col]
+        df = pd.concat([direct[columns], expanded[columns]], ignore_index=True)
+        df[ATTRIBUTES] = df[ATTRIBUTES].fillna('Unknown')
+        df['Pct Portfolio'] = df[value_col] / df[value_col].sum()
+
+        self.cache[key] = df
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return df
+
+
+#% test
+if __name__ == '__main__':
+    import tempfile
+    import time
+
+    # two index funds that overlap in one name, held next to a stock and cash
+    folder = tempfile.mkdtemp()
+    pd.DataFrame({'Constituent': ['AAPL', 'MSFT', 'NVDA'], 'Weight': [40, 35, 25], 'Region': 'US',
+                  'Sector': ['Tech', 'Tech', 'Tech'], 'Currency': 'USD'}).to_csv(os.path.join(folder, 'ZSP.TO.csv'))
+    pd.DataFrame({'Constituent': ['AAPL', 'NESN', 'SHEL'], 'Weight': [0.5, 0.3, 0.2],
+                  'Region': ['US', 'Europe', 'Europe'], 'Sector': ['Tech', 'Staples', 'Energy']}).to_csv(
+        os.path.join(folder, 'XAW.TO.csv'))
+    holdings_df = pd.DataFrame({'Symbol': ['ZSP.TO', 'XAW.TO', 'RY.TO', 'CAD'],
+                                'Instrument': ['ETF', 'ETF', 'Stock', 'Cash'],
+                                'Region': ['US', 'Global', 'Canada', 'Canada'],
+                                'Asset Class': ['Equity', 'Equity', 'Equity', 'Cash'],
+                                'Currency': ['CAD', 'CAD', 'CAD', 'CAD'],
+                                'Market Value CAD': [1000.0, 2000.0, 500.0, 100.0]})
+
+    look_through = LookThrough.from_folder(folder)
+    df = look_through.expand(holdings_df)
+    by_symbol = df.set_index('Symbol')['Market Value CAD']
+    assert np.isclose(by_symbol['AAPL'], 0.4 * 1000 + 0.5 * 2000)
+    assert np.isclose(df['Market Value CAD'].sum(), holdings_df['Market Value CAD'].sum())
+    assert df.set_index('Symbol').loc['AAPL', 'Via'] == 'XAW.TO, ZSP.TO'
+    region = df.groupby('Region')['Pct Portfolio'].sum()
+    assert np.isclose(region['Europe'], 1000 / 3600)
+    assert look_through.expand(holdings_df) is df
+    # neither file gives the asset class and xaw does not give the currency: the funds' own are used, except
+    # for aapl whose currency the other file gives
+    assert (df['Asset Class'] == 'Equity').sum() == 6
+    currency = df.groupby('Currency')['Market Value CAD'].sum()
+    assert np.isclose(currency['CAD'], 0.5 * 2000 + 500 + 100) and np.isclose(currency['USD'], 1000 + 0.5 * 2000)
+
+    # a few thousand constituents across ten funds
+    rng = np.random.default_rng(5)
+    n = 10 * 3000
+    big = pd.DataFrame({'Fund': np.repeat(['F{}'.format(i) for i in range(10)], 3000),
+                        'Constituent': rng.integers(0, 8000, n).astype(str), 'Weight': 1 / 3000,
+                        'Region': 'US', 'Sector': 'Tech', 'Asset Class': 'Equity', 'Currency': 'USD'})
+    look_through = LookThrough(big)
+    funds_df = pd.DataFrame({'Symbol': ['F{}'.format(i) for i in range(10)], 'Instrument': 'ETF',
+                             'Market Value CAD': rng.uniform(1000, 5000, 10)})
+    t = time.perf_counter()
+    df = look_through.expand(funds_df)
+    print('{} funds to {} constituents in {:.4f}s'.format(len(funds_df), len(df), time.perf_counter() - t))
+    assert np.isclose(df['Market Value CAD'].sum(), funds_df['Market Value CAD'].sum())
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 03:12:40 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+
+
+# activities whose net amount always moves cash, see objects.apply_questrade_row
+CASH_ACTIVITIES = ['Deposits', 'Dividends', 'FX conversion', 'Withdrawals', 'Trades']
+# (activity, action) pairs that move cash; transfers only without a symbol, i.e. not in kind
+CASH_ACTIONS = [('Other', 'GST'), ('Fees and rebates', 'FCH'), ('Corporate actions', 'CIL')]
+
+
+def cash_mask(transaction_df):
+    # rows of a questrade ledger that change a cash balance, the same rows the replay adds to holdings_dict
+    activity = transaction_df['Activity Type']
+    action = transaction_df['Action']
+    symbol = transaction_df['Symbol']
+    mask = activity.isin(CASH_ACTIVITIES)
+    for (a, b) in CASH_ACTIONS:
+        mask |= (activity == a) & (action == b)
+    no_symbol = symbol.isna() | (symbol.astype(str) == '')
+    mask |= (activity == 'Transfers') & action.isin(['TF6', 'TFO']) & no_symbol
+    return mask.values
+
+
+def cash_balances(transaction_df, dates, currencies=('CAD', 'USD')):
+    '''
+    Purpose
+    -------
+    end of day cash balance of every currency on every date, from cumulative sums of the net amounts of the
+    sorted ledger instead of a replay
+
+    Parameters
+    ----------
+    transaction_df : DataFrame
+        TransactionHistory.df of a questrade account
+
+    dates : DatetimeIndex
+
+    currencies : iterable, optional
+        columns kept even without a transaction, default ('CAD', 'USD') like the replay
+
+    Returns
+    -------
+    DataFrame with dates as index and one column per currency
+
+    '''
+    df = transaction_df[cash_mask(transaction_df)]
+    flows = pd.DataFrame({'Date': pd.DatetimeIndex(df['Transaction Date']).normalize(),
+                          'Currency': df['Currency'].str.upper().values, 'Net Amount': df['Net Amount'].values})
+    daily = flows.pivot_table(index='Date', columns='Currency', values='Net Amount', aggfunc='sum')
+    daily = daily.reindex(columns=sorted(set(daily.columns) | set(currencies)), fill_value=0).fillna(0)
+    # flows before the first date or on weekends land on the next date through the cumulative sum
+    balances = daily.reindex(daily.index.union(dates), fill_value=0).cumsum()
+    balances = balances.reindex(dates).ffill().fillna(0)
+    balances.columns.name = None
+    return balances
+
+
+def load_rates(filename):
+    '''
+    Purpose
+    -------
+    read a margin rate table: a csv with 'Date', 'Currency' and 'Rate' columns, one row per rate change, the
+    annual rate as a fraction, e.g. 0.0795, in effect from that date until the next row of the currency
+
+    Returns
+    -------
+    DataFrame
+
+    '''
+    df = pd.read_csv(filename)
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Currency'] = df['Currency'].str.upper()
+    return df.sort_values(by='Date').reset_index(drop=True)
+
+
+def rate_matrix(rate_df, currencies, dates):
+    # annual rate of every currency on every date, NaN before the first rate of a currency
+    wide = rate_df.pivot_table(index='Date', columns='Currency', values='Rate', aggfunc='last')
+    wide = wide.reindex(wide.index.union(dates)).ffill().reindex(dates)
+    return wide.reindex(columns=list(currencies))
+
+
+def margin_interest(cash_df, rate_df, day_count=365):
+    '''
+    Purpose
+    -------
+    interest charged on every debit cash balance: the balance of a date times the daily rate accrues for every
+    calendar day until the next date, so a friday balance is charged for the weekend too
+
+    Parameters
+    ----------
+    cash_df : DataFrame
+        output of cash_balances or NavHistory.cash
+
+    rate_df : DataFrame
+        output of load_rates
+
+    day_count : int, optional
+        days in a year of the daily rate, default 365
+
+    Returns
+    -------
+    DataFrame like cash_df of interest in each currency, negative as it is a cost
+
+    '''
+    dates = pd.DatetimeIndex(cash_df.index)
+    days = np.append(np.diff(dates.values).astype('timedelta64[D]').astype(float), 1)
+    borrowed = (-cash_df.values).clip(min=0)
+    rates = rate_matrix(rate_df, cash_df.columns, dates).values
+    missing = (borrowed > 0) & np.isnan(rates)
+    if missing.any():
+        ccy = cash_df.columns[missing.any(axis=0)]
+        raise ValueError('no margin rate for {} on {}'.format(', '.join(ccy), dates[missing.any(axis=1)][0].date()))
+    interest = 0.0 - borrowed * np.nan_to_num(rates) / day_count * days[:, None]
+    return pd.DataFrame(interest, index=cash_df.index, columns=cash_df.columns)
+
+
+def margin_summary(cash_df, interest_df, fx_rates):
+    '''
+    Purpose
+    -------
+    borrowing of an account over its history, per currency and in total
+
+    Parameters
+    ----------
+    cash_df : DataFrame
+        output of cash_balances or NavHistory.cash
+
+    interest_df : DataFrame
+        output of margin_interest
+
+    fx_rates : DataFrame
+        cad per unit of every currency on the same dates, e.g. NavHistory.fx_rates
+
+    Returns
+    -------
+    DataFrame, one row per currency and a 'Total' row in cad: 'Days in Debit' (calendar days), 'Peak Borrowing',
+    'Peak Borrowing Date', 'Average Borrowing' while in debit, 'Interest' and 'Interest CAD'
+
+    '''
+    dates = pd.DatetimeIndex(cash_df.index)
+    days = np.append(np.diff(dates.values).astype('timedelta64[D]').astype(float), 1)
+    fx = fx_rates[cash_df.columns].values
+    borrowed = (-cash_df).clip(lower=0)
+    borrowed['Total'] = (borrowed.values * fx).sum(axis=1)
+    interest = interest_df.sum()
+    interest['Total'] = (interest_df.values * fx).sum()
+
+    in_debit = borrowed.values > 0
+    debit_days = (in_debit * days[:, None]).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = (borrowed.values * days[:, None]).sum(axis=0) / debit_days
+    peak = borrowed.values.argmax(axis=0)
+    df = pd.DataFrame({'Currency': borrowed.columns, 'Days in Debit': debit_days,
+                       'Peak Borrowing': borrowed.values.max(axis=0),
+                       'Peak Borrowing Date': np.where(in_debit.any(axis=0), dates[peak], pd.NaT),
+                       'Average Borrowing': np.nan_to_num(average), 'Interest': interest.values})
+    df['Interest CAD'] = np.append((interest_df.values * fx).sum(axis=0), interest['Total'])
+    return df
+
+
+#% test
+if __name__ == '__main__':
+    import time
+    from objects import TransactionHistory, position_history
+
+    def row(date, activity, action, symbol, quantity, price, net, currency='CAD', description=''):
+        d = pd.Timestamp(date).strftime('%Y-%m-%d %H:%M:%S') + ' AM'
+        return {'Transaction Date': d, 'Settlement Date': d, 'Action': action, 'Symbol': symbol,
+                'Description': description, 'Quantity': quantity, 'Price': price, 'Gross Amount': net,
+                'Commission': 0.0, 'Net Amount': net, 'Currency': currency, 'Activity Type': activity,
+                'Account #': 123, 'Account Type': 'Margin'}
+
+    # buying on margin in both currencies, paid back by a deposit and a sale
+    ledger = pd.DataFrame([row('2026-01-02', 'Deposits', 'DEP', np.nan, 0, 0, 1000),
+                           row('2026-01-05', 'Trades', 'Buy', 'XIU.TO', 100, 30.0, -3000),
+                           row('2026-01-05', 'Trades', 'Buy', 'SPY', 2, 600.0, -1200, 'USD'),
+                           row('2026-01-09', 'Dividends', 'DIV', 'XIU.TO', 0, 0, 50),
+                           row('2026-01-15', 'Deposits', 'DEP', np.nan, 0, 0, 1950),
+                           row('2026-02-02', 'Trades', 'Sell', 'SPY', -2, 650.0, 1300, 'USD')])
+    transaction = TransactionHistory(ledger, 'questrade')
+    dates = pd.bdate_range('2026-01-02', '2026-02-06')
+    cash_df = cash_balances(transaction.df, dates)
+
+    # the same balances as the replay
+    replay_cash = position_history(transaction)[1]
+    replay_cash = replay_cash.set_index(pd.DatetimeIndex(replay_cash.index).normalize())
+    replay_cash = replay_cash[~replay_cash.index.duplicated(keep='last')]
+    replay_cash = replay_cash.reindex(replay_cash.index.union(dates)).ffill().reindex(dates).fillna(0)
+    assert np.allclose(cash_df[replay_cash.columns].values, replay_cash.values)
+
+    rate_df = pd.DataFrame({'Date': pd.to_datetime(['2025-01-01', '2025-01-01', '2026-01-12']),
+                            'Currency': ['CAD', 'USD', 'CAD'], 'Rate': [0.0730, 0.0800, 0.0365]})
+    interest_df = margin_interest(cash_df, rate_df)
+    # cad -2000 from monday the 5th to thursday the 8th, -1950 over the weekend to the 12th, then a lower rate
+    cad = 2000 * 0.073 / 365 * 4 + 1950 * 0.073 / 365 * 3 + 1950 * 0.0365 / 365 * 3
+    assert np.isclose(interest_df['CAD'].sum(), -cad)
+    usd = 1200 * 0.08 / 365 * (pd.Timestamp('2026-02-02') - pd.Timestamp('2026-01-05')).days
+    assert np.isclose(interest_df['USD'].sum(), -usd)
+
+    fx_rates = pd.DataFrame({'CAD': 1.0, 'USD': 1.4}, index=dates)
+    summary = margin_summary(cash_df, interest_df, fx_rates).set_index('Currency')
+    print(summary)
+    assert summary.loc['CAD', 'Days in Debit'] == 10 and summary.loc['CAD', 'Peak Borrowing'] == 2000
+    assert summary.loc['Total', 'Peak Borrowing'] == 2000 + 1200 * 1.4
+    assert np.isclose(summary.loc['Total', 'Interest CAD'], -cad - usd * 1.4)
+
+    # ten years of a busy margin account
+    rng = np.random.default_rng(3)
+    n = 50000
+    big = pd.DataFrame({'Transaction Date': pd.Timestamp('2016-01-04') + pd.to_timedelta(rng.integers(0, 3650, n), 'D'),
+                        'Activity Type': rng.choice(['Trades', 'Dividends', 'Transfers', 'Other'], n),
+                        'Action': rng.choice(['Buy', 'DIV', 'TF6', 'EXP'], n), 'Symbol': np.nan,
+                        'Currency': rng.choice(['CAD', 'USD'], n), 'Net Amount': rng.normal(0, 1000, n)})
+    big_dates = pd.bdate_range('2016-01-04', '2025-12-31')
+    t = time.perf_counter()
+    big_cash = cash_balances(big.sort_values(by='Transaction Date'), big_dates)
+    big_interest = margin_interest(big_cash, rate_df.assign(Date=pd.Timestamp('2010-01-01')))
+    print('{} rows to {} days of cash and interest in {:.4f}s'.format(n, len(big_dates), time.perf_counter() - t))
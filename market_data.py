@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:48:05 2026
+
+@author: Frank Shi
+"""
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import useful_functions
+
+
+# http/2 pseudo headers, which the connection sets itself; header_function carries them as plain headers
+PSEUDO_HEADERS = ('authority', 'method', 'path', 'scheme')
+
+# the shared client behind useful_functions.get, see client
+_client = None
+_client_lock = threading.Lock()
+
+
+def accept_encoding():
+    # only advertise the encodings the installed packages can decode
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli
+        encodings.append('br')
+    except ImportError:
+        pass
+    return ', '.join(encodings)
+
+
+class MarketDataClient():
+    '''
+    asynchronous http client for market data: an event loop of its own in a background thread, pooled
+    keep-alive connections, gzip, and http/2 when httpx and h2 are installed (requests in a thread pool
+    otherwise)
+
+    requests for a url that is already in flight wait for the same response instead of sending another one;
+    the batch coroutines quotes, histories and fx fetch many symbols at once, at most max_connections at a
+    time, and the sync methods get and run serve callers that are not async
+    '''
+    max_connections = 16
+    timeout = 30
+    backend = ''
+    loop = None
+    thread = None
+    in_flight = None
+
+
+    def __init__(self, max_connections=16, timeout=30):
+        '''
+        Parameters
+        ----------
+        max_connections : int, optional
+            most requests in flight and connections kept alive, default 16
+
+        timeout : float, optional
+            seconds before a request fails, default 30
+
+        '''
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.in_flight = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.run(self.open())
+
+
+    async def open(self):
+        headers = {k: v for (k, v) in useful_functions.YAHOO_HEADERS.items() if k not in PSEUDO_HEADERS}
+        headers['accept-encoding'] = accept_encoding()
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        try:
+            import httpx
+            try:
+                import h2
+                http2 = True
+            except ImportError:
+                http2 = False
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self.session = httpx.AsyncClient(http2=http2, limits=limits, headers=headers, timeout=self.timeout)
+            self.backend = 'httpx (http/2)' if http2 else 'httpx'
+        except ImportError:
+            import requests
+            from concurrent.futures import ThreadPoolExecutor
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.max_connections, pool_maxsize=self.max_connections)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.session.headers.update(headers)
+            self.executor = ThreadPoolExecutor(max_workers=self.max_connections)
+            self.backend = 'requests'
+
+
+    async def request(self, url, headers):
+        if headers is not None:
+            headers = {k: v for (k, v) in headers.items() if k not in PSEUDO_HEADERS + ('accept-encoding',)}
+        async with self.semaphore:
+            if self.backend == 'requests':
+                return await self.loop.run_in_executor(
+                    self.executor, lambda: self.session.get(url, headers=headers, timeout=self.timeout))
+            return await self.session.get(url, headers=headers)
+
+
+    async def fetch(self, url, headers=None):
+        '''
+        Purpose
+        -------
+        GET url, sharing the response with every other caller asking for the same url while it is in flight;
+        from the cassette instead if one is set, see useful_functions.set_cassette
+
+        Returns
+        -------
+        the response of the backend, with content, text and status_code
+
+        '''
+        cassette = useful_functions.CASSETTE
+        if cassette is None:
+            return await self.fetch_live(url, headers)
+        response = cassette.lookup(url)
+        if response is None:
+            response = await self.fetch_live(url, headers)
+            cassette.store(url, response)
+        return response
+
+
+    async def fetch_live(self, url, headers=None):
+        # GET url from the network, see fetch
+        if useful_functions.OFFLINE:
+            raise ConnectionError('offline mode, not fetching {}'.format(url))
+        task = self.in_flight.get(url)
+        if task is None:
+            task = self.loop.create_task(self.request(url, headers))
+            self.in_flight[url] = task
+            task.add_done_callback(lambda t: self.in_flight.pop(url, None))
+        # shielded, so that one caller giving up does not cancel the request for the others
+        return await asyncio.shield(task)
+
+
+    def run(self, coroutine):
+        # run a coroutine on the client's loop and wait for its result, from any thread but the loop's own
+        if threading.current_thread() is self.thread:
+            raise RuntimeError('MarketDataClient.run called from its own event loop, await the coroutine instead')
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+    def get(self, url, headers=None):
+        return self.run(self.fetch(url, headers))
+
+
+    async def gather(self, keys, coroutines):
+        # results by key, a failed request leaves its exception as the value
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        return dict(zip(keys, results))
+
+
+    async def quote(self, symbol):
+        sub = useful_functions.subdomain_last_price(symbol)
+        page = await self.fetch(useful_functions.YAHOO_BASE_URL + sub, useful_functions.header_function(sub))
+        return datetime.now(), float(useful_functions.parse_last_price(page.content)[0].text_content())
+
+
+    async def quotes(self, symbols):
+        '''
+        Purpose
+        -------
+        latest price of every symbol, see useful_functions.get_last_price
+
+        Returns
+        -------
+        a dictionary of symbols and (datetime, price), or the exception if the quote could not be fetched
+
+        '''
+        symbols = list(dict.fromkeys(symbols))
+        return await self.gather(symbols, [self.quote(s) for s in symbols])
+
+
+    async def history(self, symbol, start, end):
+        start_string = useful_functions.format_date(start)
+        end_string = useful_functions.format_date(end + timedelta(days=1))
+        sub = useful_functions.subdomain(symbol.replace('=', '%3D'), start_string, end_string)
+        page = await self.fetch(useful_functions.YAHOO_BASE_URL + sub, useful_functions.header_function(sub))
+        return useful_functions.clean_price_history(useful_functions.parse_tables(page.content)[0])
+
+
+    async def histories(self, ranges):
+        '''
+        Purpose
+        -------
+        daily prices of many symbols and date ranges at once, see useful_functions.get_price_history
+
+        Parameters
+        ----------
+        ranges : list
+            (symbol, start, end) tuples
+
+        Returns
+        -------
+        a dictionary of the tuples and DataFrames, or the exception if the range could not be fetched
+
+        '''
+        ranges = list(dict.fromkeys(ranges))
+        return await self.gather(ranges, [self.history(*r) for r in ranges])
+
+
+    async def fx_rate(self, pair, date=None):
+        symbol = useful_functions.fx_symbol(pair)
+        if date is None:
+            return (await self.quote(symbol))[1]
+        date = useful_functions.last_business_day(date)
+        history = await self.history(symbol, date, date)
+        return float(history['Close'].iloc[-1])
+
+
+    async def fx(self, pairs, date=None):
+        # rates of every pair, on the close of date or the latest if date is None, see useful_functions.get_fx
+        pairs = list(dict.fromkeys(pairs))
+        return await self.gather(pairs, [self.fx_rate(p, date) for p in pairs])
+
+
+    def close(self):
+        async def close_session():
+            if self.backend == 'requests':
+                self.session.close()
+                self.executor.shutdown(wait=False)
+            else:
+                await self.session.aclose()
+        self.run(close_session())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def client():
+    # the client shared by every module, started on first use
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MarketDataClient()
+    return _client
+
+
+#% test
+if __name__ == '__main__':
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from quote_service import serve_quotes
+
+    prices = {'XIU.TO': 35.0, 'SPY': 580.0, 'CAD=X': 1.38}
+    server, base_url = serve_quotes(prices)
+    useful_functions.YAHOO_BASE_URL = base_url
+    market_data = MarketDataClient(max_connections=4)
+    print(market_data.backend)
+    quotes = market_data.run(market_data.quotes(['XIU.TO', 'SPY', 'SPY', 'MISSING']))
+    assert quotes['SPY'][1] == 580.0 and isinstance(quotes['MISSING'], Exception)
+    assert market_data.run(market_data.fx(['usdcad']))['usdcad'] == 1.38
+    # the sync path of the existing call sites goes through the same pool
+    assert useful_functions.get_last_price('XIU.TO')[1] == 35.0
+    server.shutdown()
+
+    # ten callers of one slow url share a single request
+    hits = []
+    class SlowHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            time.sleep(0.3)
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, format, *args):
+            pass
+
+    slow_server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=slow_server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/slow'.format(slow_server.server_address[1])
+
+    async def many():
+        return await asyncio.gather(*[market_data.fetch(url) for _ in range(10)])
+    t = time.perf_counter()
+    responses = market_data.run(many())
+    assert len(hits) == 1 and all(r.content == b'ok' for r in responses)
+    print('10 coalesced requests in {:.2f}s'.format(time.perf_counter() - t))
+    slow_server.shutdown()
+    market_data.close()
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:31:45 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+import margin
+import useful_functions
+from fx import FXMatrix
+from objects import position_history
+from splits import SplitIndex, as_split_index, split_index
+
+
+# yahoo finance symbol of the usdcad rate in the price store
+USDCAD_SYMBOL = 'CAD=X'
+
+
+def wide_on_dates(long_df, value_col, dates):
+    # one column per symbol, the last change on or before each date carried forward
+    long_df = long_df.assign(Date=pd.DatetimeIndex(long_df['Date']).normalize())
+    wide = long_df.pivot_table(index='Date', columns='Symbol', values=value_col, aggfunc='last')
+    return wide.reindex(wide.index.union(dates)).ffill().reindex(dates).fillna(0)
+
+
+def security_attributes(position_df):
+    '''
+    Purpose
+    -------
+    the latest description of every symbol that appears in a position history
+
+    Parameters
+    ----------
+    position_df : DataFrame
+        first output of objects.position_history
+
+    Returns
+    -------
+    DataFrame indexed by symbol with 'Currency', 'Instrument', 'Option Underlying', 'Option Type',
+    'Strike Price' and 'Num Shares' columns
+
+    '''
+    open_rows = position_df[position_df['Currency'] != '']
+    return open_rows.groupby('Symbol')[['Currency', 'Instrument', 'Option Underlying', 'Option Type',
+                                        'Strike Price', 'Num Shares']].last()
+
+
+def ledger_split_factors(transaction, position_df, dates):
+    '''
+    Purpose
+    -------
+    for every symbol that went through a (reverse) split booked in the ledger, the product of the share ratios
+    of the splits after each date, see split_factors
+
+    Parameters
+    ----------
+    transaction : TransactionHistory
+        its 'REV' rows give the split dates
+
+    position_df : DataFrame
+        first output of objects.position_history; the ratio of each split is the quantity after over before
+
+    dates : DatetimeIndex
+
+    Returns
+    -------
+    DataFrame with dates as index and one column per split symbol
+
+    '''
+    df = transaction.df
+    split_dates = set(pd.DatetimeIndex(df.loc[df['Action'] == 'REV', 'Transaction Date']).normalize())
+    factors = pd.DataFrame(index=dates)
+    if len(split_dates) == 0:
+        return factors
+
+    daily = position_df.assign(Date=pd.DatetimeIndex(position_df['Date']).normalize())
+    daily = daily.groupby(['Symbol', 'Date'])['Quantity'].last().reset_index()
+    index = SplitIndex(fetch=False)
+    for symbol, group in daily.groupby('Symbol'):
+        before = group['Quantity'].shift(1).values
+        after = group['Quantity'].values
+        is_split = group['Date'].isin(split_dates).values & (before != 0) & (after != 0) & ~np.isnan(before)
+        if not is_split.any():
+            continue
+        index.add(symbol, group['Date'].values[is_split], after[is_split] / before[is_split])
+        factors[symbol] = index.factor(symbol, dates)
+    return factors
+
+
+def split_factors(transaction, position_df, symbols, dates, urls=None, index=None):
+    '''
+    Purpose
+    -------
+    for every symbol, the product of the share multipliers of the splits after each date; a split-adjusted
+    close times this factor is the close actually traded on that date
+
+    the splits are the ones the provider reports, like get_hist_price(split_adjust=False), so a split after the
+    position is closed or one the broker never books is still taken out of the closes; the ledger's 'REV' rows
+    are only used for a symbol the provider has no split for
+
+    Parameters
+    ----------
+    transaction : TransactionHistory
+
+    position_df : DataFrame
+        first output of objects.position_history
+
+    symbols : list
+
+    dates : DatetimeIndex
+
+    urls : dictionary, optional
+        yahoo finance symbol of every symbol, default None for the symbol itself
+
+    index : splits.SplitIndex, optional
+        splits of the yahoo finance symbols, default None for splits.split_index(), or the split_reference of
+        transaction when offline
+
+    Returns
+    -------
+    DataFrame with dates as index and symbols as columns
+
+    '''
+    if index is None:
+        index = as_split_index(transaction.split_reference) if useful_functions.OFFLINE else split_index()
+    ledger_factors = ledger_split_factors(transaction, position_df, dates)
+    factors = {}
+    for symbol in symbols:
+        url = symbol if urls is None else urls.get(symbol, symbol)
+        index.load(url)
+        if (len(index.dates.get(url, [])) == 0) and (symbol in ledger_factors.columns):
+            factors[symbol] = ledger_factors[symbol].values
+        else:
+            factors[symbol] = index.factor(url, dates)
+    return pd.DataFrame(factors, index=dates, columns=list(symbols))
+
+
+def ticker_urls(info_df, symbols, symbol_col='ticker_summary'):
+    # yahoo finance symbol of each symbol through the info table, the symbol itself if it is not listed
+    if info_df is None:
+        return {s: s for s in symbols}
+    lookup = info_df.drop_duplicates(subset=[symbol_col]).set_index(symbol_col)['ticker_url']
+    return {s: lookup.get(s, s) for s in symbols}
+
+
+class NavHistory():
+    '''
+    dense date by symbol matrices of an account: quantities, local prices, fx to cad and cad values,
+    plus end of day cash of every currency; nav is the row sum of the values plus cash
+
+    local prices are the prices actually traded, while price_index is continuous through splits and option
+    adjustments, for returns
+    '''
+    dates = None
+    position_df = None
+    attributes = None
+    quantity = None
+    local_price = None
+    price_index = None
+    fx = None
+    value = None
+    cash = None
+    fx_rates = None
+
+
+    def __init__(self, transaction, store, info_df=None, dates=None, symbol_col='ticker_summary', base_currency='CAD',
+                 splits=None):
+        '''
+        Parameters
+        ----------
+        transaction : TransactionHistory
+
+        store : PriceStore
+            local daily prices, also of the usd legs of the fx rates
+
+        info_df : DataFrame, optional
+            the info table, used to map symbols to yahoo finance symbols, default None
+
+        dates : DatetimeIndex, optional
+            rows of the matrices, default None for every business day from the first transaction to today
+
+        base_currency : str, optional
+            currency of the values, default 'CAD'; the CAD names of to_df are kept
+
+        splits : splits.SplitIndex, optional
+            splits of the yahoo finance symbols, default None for the provider's, see split_factors
+
+        '''
+        position_df, cash_df = position_history(transaction)
+        if dates is None:
+            dates = pd.bdate_range(transaction.first_transaction_date.normalize(), datetime.today())
+        self.dates = pd.DatetimeIndex(dates)
+        self.position_df = position_df
+        self.attributes = security_attributes(position_df)
+
+        self.quantity = wide_on_dates(position_df, 'Quantity', self.dates)
+        symbols = list(self.quantity.columns)
+        attributes = self.attributes.reindex(symbols)
+
+        # price of every symbol in its own currency: stocks from the store, options at intrinsic value
+        is_option = (attributes['Option Type'] != 'NA').values
+        underlying = np.where(is_option, attributes['Option Underlying'].values, np.array(symbols, dtype=object))
+        urls = ticker_urls(info_df, set(underlying), symbol_col)
+        underlying_url = [urls[u] for u in underlying]
+        prices = store.price_matrix(sorted(set(underlying_url)), self.dates)
+        underlying_price = prices[underlying_url].values
+
+        # closes are split-adjusted; an option keeps the factor of the last day it is held, since its strike and
+        # size only change with a new symbol, see Option.adjust_for_split
+        factor = split_factors(transaction, position_df, sorted(set(underlying)), self.dates, urls, splits)
+        factor = factor[underlying].values
+        held = self.quantity.values != 0
+        last_held = np.where(held.any(axis=0), len(self.dates) - 1 - np.argmax(held[::-1], axis=0), len(self.dates) - 1)
+        option_factor = factor[last_held, np.arange(len(symbols))]
+
+        strike = attributes['Strike Price'].fillna(0).values / option_factor
+        is_call = (attributes['Option Type'] == 'Call').values
+        intrinsic = np.where(is_call, underlying_price - strike, strike - underlying_price).clip(min=0)
+        option_price = intrinsic * attributes['Num Shares'].values * option_factor
+        self.local_price = pd.DataFrame(np.where(is_option, option_price, underlying_price * factor),
+                                        index=self.dates, columns=symbols)
+        self.price_index = pd.DataFrame(np.where(is_option, option_price, underlying_price),
+                                        index=self.dates, columns=symbols)
+
+        # cumulative sums of the ledger's cash rows give the same balances as the replay on every date at once
+        self.cash = margin.cash_balances(transaction.df, self.dates, currencies=cash_df.columns)
+
+        # fx to the base currency of every currency held, one usd leg each, broadcast over the dates
+        currencies = sorted(set(attributes['Currency'].dropna()) | set(self.cash.columns) | {base_currency})
+        fx_matrix = FXMatrix.from_store(store, currencies, self.dates, base=base_currency)
+        self.fx_rates = fx_matrix.rate_df(currencies)
+        self.fx = pd.DataFrame(fx_matrix.columns(attributes['Currency'].values), index=self.dates, columns=symbols)
+
+        self.value = self.quantity * self.local_price * self.fx
+
+
+    def cash_cad(self):
+        return (self.cash * self.fx_rates[self.cash.columns]).sum(axis=1)
+
+
+    def margin_interest(self, rate_df, day_count=365):
+        # interest on the debit balances of self.cash, see margin.margin_interest
+        return margin.margin_interest(self.cash, rate_df, day_count)
+
+
+    def cash_history_df(self, rate_df=None, day_count=365):
+        '''
+        Returns
+        -------
+        DataFrame with one row per date: the balance of every currency, 'Cash CAD' and, with a rate table,
+        the margin interest of every currency and 'Interest CAD'
+
+        '''
+        df = self.cash.copy()
+        df['Cash CAD'] = self.cash_cad()
+        if rate_df is not None:
+            interest_df = self.margin_interest(rate_df, day_count)
+            for ccy in interest_df.columns:
+                df['Interest {}'.format(ccy)] = interest_df[ccy]
+            df['Interest CAD'] = (interest_df * self.fx_rates[interest_df.columns]).sum(axis=1)
+        df.index.name = 'Date'
+        return df.reset_index()
+
+
+    def margin_df(self, rate_df, day_count=365):
+        # days in debit, peak and average borrowing and interest, see margin.margin_summary
+        return margin.margin_summary(self.cash, self.margin_interest(rate_df, day_count), self.fx_rates)
+
+
+    def nav(self):
+        '''
+        Returns
+        -------
+        Series of market value in cad indexed by date
+
+        '''
+        return self.value.sum(axis=1) + self.cash_cad()
+
+
+    def to_df(self):
+        df = pd.DataFrame({'Securities CAD': self.value.sum(axis=1), 'Cash CAD': self.cash_cad()})
+        df['Market Value CAD'] = df['Securities CAD'] + df['Cash CAD']
+        df.index.name = 'Date'
+        return df.reset_index()
+
+
+#% test
+if __name__ == '__main__':
+    import os
+    import tempfile
+    from objects import TransactionHistory
+    from price_store import PriceStore
+
+    useful_functions.set_offline(True)
+
+    def row(date, activity, action, symbol, quantity, price, net):
+        date_str = pd.Timestamp(date).strftime('%Y-%m-%d %H:%M:%S') + ' AM'
+        return {'Transaction Date': date_str, 'Settlement Date': date_str, 'Action': action, 'Symbol': symbol,
+                'Description': '', 'Quantity': quantity, 'Price': price, 'Gross Amount': net, 'Commission': 0.0,
+                'Net Amount': net, 'Currency': 'CAD', 'Activity Type': activity, 'Account #': 1,
+                'Account Type': 'TFSA'}
+
+    # ABC traded at 50 and sold before a 2:1 split; DEF went through a 1:10 reverse split booked in the ledger
+    # that the provider does not report
+    ledger = pd.DataFrame([row('2026-01-02', 'Deposits', 'DEP', np.nan, 0, 0, 10000),
+                           row('2026-01-05', 'Trades', 'Buy', 'ABC', 100, 50.0, -5000),
+                           row('2026-01-05', 'Trades', 'Buy', 'DEF', 100, 2.0, -200),
+                           row('2026-02-02', 'Trades', 'Sell', 'ABC', -100, 50.0, 5000),
+                           row('2026-03-02', 'Corporate actions', 'REV', 'DEF', -100, 0, 0),
+                           row('2026-03-02', 'Corporate actions', 'REV', 'DEF', 10, 0, 0)])
+    split_reference = pd.DataFrame({'date': [pd.Timestamp('2026-03-02')], 'multiplier': [0.1]})
+    transaction = TransactionHistory(ledger, 'questrade', split_reference_=split_reference)
+    dates = pd.bdate_range('2026-01-02', '2026-04-30')
+
+    # closes as the provider reports them today: split-adjusted
+    folder = tempfile.mkdtemp()
+    closes = {'ABC': np.full(len(dates), 25.0), 'DEF': np.full(len(dates), 20.0), 'CAD=X': np.ones(len(dates))}
+    for symbol, close in closes.items():
+        pd.DataFrame({'Date': dates, 'Close': close, 'Adj Close': close}).to_csv(
+            os.path.join(folder, '{}.csv'.format(symbol.replace('=', '_'))), index=False)
+    store = PriceStore(folder)
+
+    provider = SplitIndex(fetch=False)
+    provider.add('ABC', ['2026-06-01'], [2])
+    nav_history = NavHistory(transaction, store, dates=dates, splits=provider)
+    held = dates[(dates >= pd.Timestamp('2026-01-05')) & (dates < pd.Timestamp('2026-02-02'))]
+    assert (nav_history.local_price.loc[held, 'ABC'] == 50).all()
+    assert (nav_history.value.loc[held, 'ABC'] == 5000).all()
+    assert (nav_history.price_index.loc[held, 'ABC'] == 25).all()
+    # the ledger's reverse split for DEF: 100 shares at 2 before it, 10 at 20 after
+    assert (nav_history.value.loc[held, 'DEF'] == 200).all()
+    assert (nav_history.value.loc[dates >= pd.Timestamp('2026-03-02'), 'DEF'] == 200).all()
+    # no fake loss or jump: cash and securities add up to the deposit throughout
+    nav = nav_history.nav()
+    assert np.allclose(nav[dates >= pd.Timestamp('2026-01-05')], 10000)
+    print(nav_history.to_df().iloc[[0, 5, 30, -1]])
@@ -4,11 +4,15 @@ Created on Sun Dec 13 18:47:36 2020
 
 @author: Frank Shi
 """
+import copy
 import numpy as np
+from dataclasses import dataclass
 import pandas as pd
 import useful_functions
 from datetime import datetime, timedelta
-from useful_functions import vlookup, get_last_price, get_fx
+from useful_functions import vlookup, get_last_price
+from splits import as_split_index
+from fx import FXMatrix, pair_name, spot_rate, spot_rates
 
 
 def description_to_option(description, currency):
@@ -74,6 +78,200 @@ def journal_symbol_dest(symbol, old_currency):
             return symbol + '.TO'
 
 
+def apply_questrade_row(i_row, day_df, security_dict, holdings_dict, split_reference=None):
+    '''
+    Purpose
+    -------
+    apply one row of a questrade transaction history to the running securities and cash balances
+
+    Parameters
+    ----------
+    i_row : Series
+        one row of the dataframe exported by questrade
+
+    day_df : DataFrame
+        rows to search for the counterpart of a split or option adjustment, at least every row that shares
+        the transaction date of i_row
+
+    security_dict : dict
+        symbols as keys and Security objects as values, updated in place
+
+    holdings_dict : dict
+        currencies as keys and cash balances as values, updated in place
+
+    split_reference : DataFrame or splits.SplitIndex, optional
+        a reference dataframe for stock splits, default None
+
+    Returns
+    -------
+    bool, False if the row cannot be processed and the replay should stop
+
+    '''
+    i_transaction_date = i_row['Transaction Date']
+    i_action = i_row['Action']
+    i_symbol = i_row['Symbol']
+    i_description = i_row['Description']
+    i_quantity = i_row['Quantity']
+    i_price = i_row['Price']
+    i_gross_amount = i_row['Gross Amount']
+    i_commission = i_row['Commission']
+    i_net_amount = i_row['Net Amount']
+    i_currency = i_row['Currency']
+    i_activity = i_row['Activity Type']
+
+    # different cases
+    # cash deposit
+    if i_activity == 'Deposits':
+        holdings_dict[i_currency.upper()] += i_net_amount
+
+    # dividends operate the same way as deposits
+    elif i_activity == 'Dividends':
+        holdings_dict[i_currency.upper()] += i_net_amount
+
+    # fx conversion is like two deposits at once
+    elif i_activity == 'FX conversion':
+        holdings_dict[i_currency.upper()] += i_net_amount
+
+    # the opposite of deposits
+    elif i_activity == 'Withdrawals':
+        holdings_dict[i_currency.upper()] += i_net_amount
+
+    # buying or selling securities
+    elif i_activity == 'Trades':
+        # first see if it is an option
+        i_description_split = i_description.split(' ')
+        if (i_description_split[0] == 'PUT') or (i_description_split[0] == 'CALL'): # option
+            i_option = description_to_option(i_description, i_currency)
+            i_option_symbol = i_option.symbol
+            if i_option_symbol not in security_dict.keys():
+                security_dict[i_option_symbol] = i_option
+
+            i_option = security_dict[i_option_symbol]
+            i_option.new_trade(i_quantity, i_price * 100, abs(i_commission), trade_date=i_transaction_date)
+
+            if i_option.liquidated:
+                del security_dict[i_option_symbol]
+            else:
+                security_dict[i_option_symbol] = i_option
+        else: # not an option
+            if i_symbol not in security_dict.keys():
+                i_security = Security(i_symbol, i_currency)
+                security_dict[i_symbol] = i_security
+
+            i_security = security_dict[i_symbol]
+            i_security.new_trade(i_quantity, i_price, abs(i_commission), trade_date=i_transaction_date)
+
+            if i_security.liquidated:
+                del security_dict[i_symbol]
+            else:
+                security_dict[i_symbol] = i_security
+
+        holdings_dict[i_currency.upper()] += i_net_amount
+
+    # cash or in-knd transfer to and from another investment account
+    elif i_activity == 'Transfers':
+        if i_action == 'TF6': # transfer in
+            if (i_symbol != '') and (not pd.isna(i_symbol)): # in-kind transfer of shares
+                if (i_currency == 'CAD') and ('.TO' not in i_symbol):
+                    i_symbol = i_symbol + '.TO'
+                i_price = useful_functions.get_hist_price(i_symbol, i_transaction_date)
+                if i_symbol not in security_dict.keys():
+                    i_security = Security(i_symbol, i_currency)
+                    security_dict[i_symbol] = i_security
+                i_security = security_dict[i_symbol]
+                i_security.new_trade(i_quantity, i_price, 0, trade_date=i_transaction_date) # no commission for in-kind transfer
+            else: # cash transfer
+                holdings_dict[i_currency.upper()] += i_net_amount
+        elif i_action == 'TFO': # trasnfer out
+            if (i_symbol != '') and (not pd.isna(i_symbol)): # transferring securities
+                if i_symbol not in security_dict.keys():
+                    print('transferring out non-existent security')
+                    return False
+                i_security = security_dict[i_symbol]
+                i_security.new_trade(i_quantity, i_price, abs(i_commission), trade_date=i_transaction_date)
+
+                if i_security.liquidated:
+                    del security_dict[i_symbol]
+                else:
+                    security_dict[i_symbol] = i_security
+            else: # transferring out cash
+                holdings_dict[i_currency.upper()] += i_net_amount
+
+    # other activities
+    elif i_activity == 'Other':
+        if i_action == 'EXP': # option expiry
+            i_option = description_to_option(i_description, i_currency)
+            i_option_symbol = i_option.symbol
+            del security_dict[i_option_symbol]
+        elif i_action == 'GST': # tax on fees
+            holdings_dict[i_currency.upper()] += i_net_amount
+        elif i_action == 'BRW': # journalling
+            if i_quantity < 0:
+                i_security = security_dict[i_symbol]
+                symbol_to = journal_symbol_dest(i_symbol, i_currency) # need to define
+                i_security.journal(symbol_to, i_transaction_date)
+                del security_dict[i_symbol]
+                if symbol_to not in security_dict.keys():
+                    security_dict[symbol_to] = i_security
+                else:
+                    existing_security = security_dict[symbol_to]
+                    existing_security.merge(i_security)
+                    security_dict[symbol_to] = existing_security
+        elif i_action == 'ADJ': # option adjustment because of splits
+            if i_quantity < 0:
+                # first find the new underlying symbol
+                counter_adj = day_df[(day_df['Action'] == 'ADJ') &
+                                     (day_df['Transaction Date'] == i_transaction_date) &
+                                     (day_df['Quantity'] == -1 * i_quantity)].reset_index()
+                new_underlying_symbol = description_to_option(counter_adj.loc[0, 'Description'], counter_adj.loc[0, 'Currency']).underlying_symbol
+
+                # then find the mutliplier that should be applied to the strike/share number due to the split
+                lookup_date = datetime(i_transaction_date.year, i_transaction_date.month, i_transaction_date.day)
+                old_option = description_to_option(i_description, i_currency)
+                multiplier = as_split_index(split_reference).multiplier(lookup_date, old_option.underlying_symbol)
+
+                # get the current held option and manipulate it
+                old_symbol = old_option.symbol
+                i_option = security_dict[old_symbol]
+                i_option.adjust_for_split(multiplier, new_underlying_symbol)
+
+                # make the change
+                del security_dict[old_symbol]
+                security_dict[i_option.symbol] = i_option
+
+    # fees and rebates
+    elif i_activity == 'Fees and rebates':
+        if i_action == 'FCH': # fees
+            holdings_dict[i_currency.upper()] += i_net_amount
+        else:
+            pass
+
+    # corporate actions, e.g. splits, name changes
+    elif i_activity == 'Corporate actions':
+        if i_action == 'CIL': # cash in lieu
+            holdings_dict[i_currency.upper()] += i_net_amount
+        elif i_action == 'REV': # reverse split
+            if i_quantity < 0:
+                i_security = security_dict[i_symbol]
+                counter_split = day_df[(day_df['Action'] == 'REV') &
+                                       (day_df['Transaction Date'] == i_transaction_date) &
+                                       (day_df['Quantity'] > 0)]
+                new_quantity = int(counter_split['Quantity'])
+                lookup_date = datetime(i_transaction_date.year, i_transaction_date.month, i_transaction_date.day)
+                ratio = 1 / as_split_index(split_reference).multiplier(lookup_date, i_symbol)
+                i_security.reverse_split(ratio, new_quantity)
+                security_dict[i_symbol] = i_security
+        elif i_action == 'NAC': # name change
+            pass
+
+    # any activities not encountered before
+    else:
+        print('a new activity not encountered before, exiting...')
+        return False
+
+    return True
+
+
 def questrade_transaction_to_sec(transaction_df, split_reference=None):
     '''
     Parameters
@@ -81,7 +279,7 @@ def questrade_transaction_to_sec(transaction_df, split_reference=None):
     transaction_df : DataFrame
         the dataframe exported by questrade
 
-    split_reference : DataFrame, optional
+    split_reference : DataFrame or splits.SplitIndex, optional
         a reference dataframe for stock splits, default None
 
     Returns
@@ -93,172 +291,301 @@ def questrade_transaction_to_sec(transaction_df, split_reference=None):
     l = len(transaction_df)
     holdings_dict = {'CAD': 0, 'USD': 0}
     security_dict = {}
+    split_reference = as_split_index(split_reference)
     for i in range(l):
         if (i % 50) == 0:
             print('processing row {}'.format(i))
-        i_row = transaction_df.loc[i, ]
-        i_transaction_date = i_row['Transaction Date']
-        i_action = i_row['Action']
-        i_symbol = i_row['Symbol']
-        i_description = i_row['Description']
-        i_quantity = i_row['Quantity']
-        i_price = i_row['Price']
-        i_gross_amount = i_row['Gross Amount']
-        i_commission = i_row['Commission']
-        i_net_amount = i_row['Net Amount']
-        i_currency = i_row['Currency']
-        i_activity = i_row['Activity Type']
-
-        # different cases
-        # cash deposit
-        if i_activity == 'Deposits':
-            holdings_dict[i_currency.upper()] += i_net_amount
+        if not apply_questrade_row(transaction_df.loc[i, ], transaction_df, security_dict, holdings_dict, split_reference):
+            return
 
-        # dividends operate the same way as deposits
-        elif i_activity == 'Dividends':
-            holdings_dict[i_currency.upper()] += i_net_amount
+    return security_dict, holdings_dict
 
-        # fx conversion is like two deposits at once
-        elif i_activity == 'FX conversion':
-            holdings_dict[i_currency.upper()] += i_net_amount
 
-        # the opposite of deposits
-        elif i_activity == 'Withdrawals':
-            holdings_dict[i_currency.upper()] += i_net_amount
+def parse_questrade_dates(transaction_df):
+    '''
+    Purpose
+    -------
+    convert the date columns of a questrade export to datetime, in place
 
-        # buying or selling securities
-        elif i_activity == 'Trades':
-            # first see if it is an option
-            i_description_split = i_description.split(' ')
-            if (i_description_split[0] == 'PUT') or (i_description_split[0] == 'CALL'): # option
-                i_option = description_to_option(i_description, i_currency)
-                i_option_symbol = i_option.symbol
-                if i_option_symbol not in security_dict.keys():
-                    security_dict[i_option_symbol] = i_option
-
-                i_option = security_dict[i_option_symbol]
-                i_option.new_trade(i_quantity, i_price * 100, abs(i_commission))
-
-                if i_option.liquidated:
-                    del security_dict[i_option_symbol]
-                else:
-                    security_dict[i_option_symbol] = i_option
-            else: # not an option
-                if i_symbol not in security_dict.keys():
-                    i_security = Security(i_symbol, i_currency)
-                    security_dict[i_symbol] = i_security
+    Parameters
+    ----------
+    transaction_df : DataFrame
+        the dataframe exported by questrade
 
-                i_security = security_dict[i_symbol]
-                i_security.new_trade(i_quantity, i_price, abs(i_commission))
+    Returns
+    -------
+    the same DataFrame
 
-                if i_security.liquidated:
-                    del security_dict[i_symbol]
-                else:
-                    security_dict[i_symbol] = i_security
+    '''
+    for col in ['Transaction Date', 'Settlement Date']:
+        if not pd.api.types.is_datetime64_any_dtype(transaction_df[col]):
+            transaction_df[col] = pd.to_datetime(transaction_df[col], format='%Y-%m-%d %H:%M:%S %p')
+    return transaction_df
 
-            holdings_dict[i_currency.upper()] += i_net_amount
 
-        # cash or in-knd transfer to and from another investment account
-        elif i_activity == 'Transfers':
-            if i_action == 'TF6': # transfer in
-                if (i_symbol != '') and (not pd.isna(i_symbol)): # in-kind transfer of shares
-                    if (i_currency == 'CAD') and ('.TO' not in i_symbol):
-                        i_symbol = i_symbol + '.TO'
-                    i_price = useful_functions.get_hist_price(i_symbol, i_transaction_date)
-                    if i_symbol not in security_dict.keys():
-                        i_security = Security(i_symbol, i_currency)
-                        security_dict[i_symbol] = i_security
-                    i_security = security_dict[i_symbol]
-                    i_security.new_trade(i_quantity, i_price, 0) # no commission for in-kind transfer
-                else: # cash transfer
-                    holdings_dict[i_currency.upper()] += i_net_amount
-            elif i_action == 'TFO': # trasnfer out
-                if (i_symbol != '') and (not pd.isna(i_symbol)): # transferring securities
-                    if i_symbol not in security_dict.keys():
-                        print('transferring out non-existent security')
-                        return
-                    i_security = security_dict[i_symbol]
-                    i_security.new_trade(i_quantity, i_price, abs(i_commission))
-
-                    if i_security.liquidated:
-                        del security_dict[i_symbol]
-                    else:
-                        security_dict[i_symbol] = i_security
-                else: # transferring out cash
-                    holdings_dict[i_currency.upper()] += i_net_amount
-
-        # other activities
-        elif i_activity == 'Other':
-            if i_action == 'EXP': # option expiry
-                i_option = description_to_option(i_description, i_currency)
-                i_option_symbol = i_option.symbol
-                del security_dict[i_option_symbol]
-            elif i_action == 'GST': # tax on fees
-                holdings_dict[i_currency.upper()] += i_net_amount
-            elif i_action == 'BRW': # journalling
-                if i_quantity < 0:
-                    i_security = security_dict[i_symbol]
-                    symbol_to = journal_symbol_dest(i_symbol, i_currency) # need to define
-                    i_security.journal(symbol_to, i_transaction_date)
-                    del security_dict[i_symbol]
-                    if symbol_to not in security_dict.keys():
-                        security_dict[symbol_to] = i_security
-                    else:
-                        existing_security = security_dict[symbol_to]
-                        existing_security.new_trade(i_security.quantity, i_security.average_cost, i_security.commission)
-                        security_dict[symbol_to] = existing_security
-            elif i_action == 'ADJ': # option adjustment because of splits
-                if i_quantity < 0:
-                    # first find the new underlying symbol
-                    counter_adj = transaction_df[(transaction_df['Action'] == 'ADJ') &
-                                                 (transaction_df['Transaction Date'] == i_transaction_date) &
-                                                 (transaction_df['Quantity'] == -1 * i_quantity)].reset_index()
-                    new_underlying_symbol = description_to_option(counter_adj.loc[0, 'Description'], counter_adj.loc[0, 'Currency']).underlying_symbol
-
-                    # then find the mutliplier that should be applied to the strike/share number due to the split
-                    lookup_date = datetime(i_transaction_date.year, i_transaction_date.month, i_transaction_date.day)
-                    multiplier = vlookup(split_reference, lookup_date, 'date', 'multiplier')
-
-                    # get the current held option and manipulate it
-                    old_symbol = description_to_option(i_description, i_currency).symbol
-                    i_option = security_dict[old_symbol]
-                    i_option.adjust_for_split(multiplier, new_underlying_symbol)
-
-                    # make the change
-                    del security_dict[old_symbol]
-                    security_dict[i_option.symbol] = i_option
-
-        # fees and rebates
-        elif i_activity == 'Fees and rebates':
-            if i_action == 'FCH': # fees
-                holdings_dict[i_currency.upper()] += i_net_amount
-            else:
-                pass
+def read_ledger_chunks(filename, chunksize=10000):
+    '''
+    Purpose
+    -------
+    read a questrade transaction history from a csv or parquet file in batches of rows, so that the whole
+    file never has to be in memory
 
-        # corporate actions, e.g. splits, name changes
-        elif i_activity == 'Corporate actions':
-            if i_action == 'CIL': # cash in lieu
-                holdings_dict[i_currency.upper()] += i_net_amount
-            elif i_action == 'REV': # reverse split
-                if i_quantity < 0:
-                    i_security = security_dict[i_symbol]
-                    counter_split = transaction_df[(transaction_df['Action'] == 'REV') &
-                                                   (transaction_df['Transaction Date'] == i_transaction_date) &
-                                                   (transaction_df['Quantity'] > 0)]
-                    new_quantity = int(counter_split['Quantity'])
-                    lookup_date = datetime(i_transaction_date.year, i_transaction_date.month, i_transaction_date.day)
-                    ratio = 1 / vlookup(split_reference, lookup_date, 'date', 'multiplier')
-                    i_security.reverse_split(ratio, new_quantity)
-                    security_dict[i_symbol] = i_security
-            elif i_action == 'NAC': # name change
-                pass
+    Parameters
+    ----------
+    filename : str
+        path to a .csv or .parquet file with the same columns as the questrade export, sorted by
+        transaction date and settlement date
 
-        # any activities not encountered before
-        else:
-            print('a new activity not encountered before, exiting...')
-            return
+    chunksize : int, optional
+        number of rows per batch, default 10000
 
-    return security_dict, holdings_dict
+    Returns
+    -------
+    a generator of DataFrames
+
+    '''
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(filename)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield parse_questrade_dates(batch.to_pandas())
+    else:
+        for chunk in pd.read_csv(filename, chunksize=chunksize):
+            yield parse_questrade_dates(chunk)
+
+
+def stream_replay(chunks, snapshot_dates, split_reference=None, day_callback=None):
+    '''
+    Purpose
+    -------
+    replay a questrade transaction history batch by batch, keeping only the running securities and cash
+    balances in memory, and yield the holdings as of each requested date
+
+    Parameters
+    ----------
+    chunks : iterable
+        DataFrames in the questrade export format, sorted by transaction date across and within batches,
+        e.g. the output of read_ledger_chunks or [TransactionHistory.df]
+
+    snapshot_dates : list
+        datetime objects; a snapshot includes every transaction on or before its date, the same as
+        Holdings(transaction=..., asof_date=date)
+
+    split_reference : DataFrame or splits.SplitIndex, optional
+        a reference dataframe for stock splits, default None
+
+    day_callback : function, optional
+        called as day_callback(date, security_dict, holdings_dict) after the last transaction of every day,
+        default None
+
+    Returns
+    -------
+    a generator of (date, Holdings) pairs in ascending date order
+
+    '''
+    snapshot_dates = sorted(snapshot_dates)
+    split_reference = as_split_index(split_reference)
+    security_dict = {}
+    holdings_dict = {'CAD': 0, 'USD': 0}
+    next_snapshot = 0
+    pending = None # rows of the latest transaction date, which may continue in the next batch
+    rows_processed = 0
+
+    def replay_days(df):
+        nonlocal next_snapshot, rows_processed
+        for day, day_df in df.groupby('Transaction Date', sort=True):
+            while (next_snapshot < len(snapshot_dates)) and (snapshot_dates[next_snapshot] < day):
+                yield snapshot_dates[next_snapshot]
+                next_snapshot += 1
+            day_df = day_df.sort_values(by='Settlement Date', kind='stable').reset_index(drop=True)
+            for i in range(len(day_df)):
+                if not apply_questrade_row(day_df.loc[i, ], day_df, security_dict, holdings_dict, split_reference):
+                    raise ValueError('cannot replay the transaction on {}, row {}'.format(day, rows_processed))
+                rows_processed += 1
+            if day_callback is not None:
+                day_callback(day, security_dict, holdings_dict)
+
+    def snapshot(date):
+        return date, Holdings(security_dict=copy.deepcopy(security_dict), cash_dict=dict(holdings_dict),
+                              asof_date=date)
+
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if pending is not None:
+            if chunk['Transaction Date'].min() < pending['Transaction Date'].iloc[0]:
+                raise ValueError('ledger batches must be sorted by transaction date')
+            chunk = pd.concat([pending, chunk])
+        chunk_last_date = chunk['Transaction Date'].max()
+        pending = chunk[chunk['Transaction Date'] == chunk_last_date]
+        for date in replay_days(chunk[chunk['Transaction Date'] < chunk_last_date]):
+            yield snapshot(date)
+        print('{} rows replayed'.format(rows_processed))
+
+    if pending is not None:
+        for date in replay_days(pending):
+            yield snapshot(date)
+
+    while next_snapshot < len(snapshot_dates):
+        yield snapshot(snapshot_dates[next_snapshot])
+        next_snapshot += 1
+
+
+def position_history(transaction, chunks=None):
+    '''
+    Purpose
+    -------
+    replay a transaction history once and record every change of every position and cash balance at the
+    end of each day, so that the holdings on any date can be looked up without replaying again
+
+    Parameters
+    ----------
+    transaction : TransactionHistory
+
+    chunks : iterable, optional
+        sorted batches of the history to replay instead of transaction.df, see stream_replay, default None
+
+    Returns
+    -------
+    two DataFrames: position changes with one row per (date, symbol) that changed, quantity 0 once a
+    position is closed, and end of day cash balances with one row per day and one column per currency
+
+    '''
+    position_rows = []
+    cash_rows = []
+    last_state = {}
+
+    def record_day(day, security_dict, holdings_dict):
+        state = {}
+        for symbol, sec in security_dict.items():
+            state[symbol] = (sec.quantity, sec.average_cost, sec.commission)
+            if last_state.get(symbol) != state[symbol]:
+                is_option = sec.instrument == 'Option'
+                position_rows.append([day, symbol, sec.currency, sec.instrument, sec.quantity, sec.average_cost,
+                                      sec.commission, sec.underlying_symbol if is_option else '',
+                                      sec.option_type if is_option else 'NA', sec.strike if is_option else np.nan,
+                                      sec.num_shares if is_option else 1, sec.expiration if is_option else pd.NaT])
+        for symbol in last_state:
+            if symbol not in state:
+                position_rows.append([day, symbol, '', '', 0, 0, 0, '', 'NA', np.nan, 1, pd.NaT])
+        last_state.clear()
+        last_state.update(state)
+        cash_rows.append(dict(holdings_dict, **{'Date': day}))
+
+    if chunks is None:
+        chunks = [transaction.df]
+    for _ in stream_replay(chunks, [], transaction.split_reference, day_callback=record_day):
+        pass
+
+    position_df = pd.DataFrame(position_rows, columns=['Date', 'Symbol', 'Currency', 'Instrument', 'Quantity',
+                                                       'Average Cost', 'Commission', 'Option Underlying',
+                                                       'Option Type', 'Strike Price', 'Num Shares', 'Expiration'])
+    cash_df = pd.DataFrame(cash_rows).set_index('Date')
+    return position_df, cash_df
+
+
+def cached_price(symbol, date=None, price_cache=None):
+    '''
+    Purpose
+    -------
+    get the price of a symbol through a cache shared by every holdings being valued, so that a symbol
+    held in several accounts is only looked up once
+
+    Parameters
+    ----------
+    symbol : str
+        security name as looked up online, e.g. ZSP.TO
+
+    date : datetime, optional
+        closing price of that day, default None for the latest price
+
+    price_cache : dict, optional
+        (symbol, date) as keys and (price time, price) as values, updated in place, default None for
+        no caching
+
+    Returns
+    -------
+    datetime object and a floating point value representing price
+
+    '''
+    if (price_cache is not None) and ((symbol, date) in price_cache):
+        return price_cache[(symbol, date)]
+    if date is not None:
+        price_pair = (date, useful_functions.get_hist_price(symbol, date))
+    else:
+        price_pair = get_last_price(symbol)
+    if price_cache is not None:
+        price_cache[(symbol, date)] = price_pair
+    return price_pair
+
+
+def modified_dietz(starting_balance, ending_balance, starting_time, ending_time, cash_flows_df):
+    '''
+    Purpose
+    -------
+    rate of return between two valuations based on the modified Dietz method
+
+    Parameters
+    ----------
+    starting_balance, ending_balance : float
+        market values at starting_time and ending_time
+
+    starting_time, ending_time : datetime
+
+    cash_flows_df : DataFrame
+        external cash flows with 'Transaction Date' and 'Net Amount' columns, only the ones after
+        starting_time and up to ending_time are used
+
+    Returns
+    -------
+    float
+
+    '''
+    rd_cash_flows = cash_flows_df.set_index('Transaction Date')
+    rd_cash_flows = rd_cash_flows[(rd_cash_flows.index > starting_time) & (rd_cash_flows.index <= ending_time)]
+    cash_flow_sum = rd_cash_flows['Net Amount'].sum()
+
+    # construct weighted sum
+    time_weight = (ending_time - rd_cash_flows.index) / (ending_time - starting_time)
+    weighted_sum = time_weight.values.dot(rd_cash_flows['Net Amount'].values)
+
+    numerator = ending_balance - starting_balance - cash_flow_sum
+    denominator = starting_balance + weighted_sum
+    return numerator / denominator
+
+
+def combine_holdings_df(holdings_df_dict):
+    '''
+    Purpose
+    -------
+    combine the output of Holdings.to_df of several accounts into one row per symbol
+
+    Parameters
+    ----------
+    holdings_df_dict : dict
+        account names as keys and Holdings.to_df outputs as values
+
+    Returns
+    -------
+    two DataFrames: every account's rows with an 'Account' column for drilling down, and the rows combined
+    by symbol with 'Pct Portfolio' of the combined market value
+
+    '''
+    account_df = pd.concat([df.assign(Account=account) for account, df in holdings_df_dict.items()], ignore_index=True)
+    account_df['Pct Account'] = account_df['Pct Portfolio']
+    account_df['Pct Portfolio'] = account_df['Market Value CAD'] / account_df['Market Value CAD'].sum()
+
+    account_df['Book Value CAD'] = account_df['Book Cost CAD'] * account_df['Quantity']
+    key_cols = ['Symbol', 'Currency', 'Instrument', 'Asset Class', 'Region', 'Option Type', 'Option Underlying',
+                'Expiration', 'Strike Price']
+    sum_cols = ['Quantity', 'Market Value CAD', 'Book Value CAD', 'PnL CAD', 'Pct Portfolio']
+    first_cols = ['Market Price', 'Price Time', 'Market Price CAD', 'Underlying Market Price', 'Underlying Price Time']
+    grouped = account_df.groupby(key_cols, dropna=False, sort=False)
+    combined_df = grouped[sum_cols].sum().join(grouped[first_cols].first()).reset_index()
+    combined_df['Book Cost CAD'] = combined_df['Book Value CAD'] / combined_df['Quantity']
+    combined_df['Pct Return'] = combined_df['Market Value CAD'] / combined_df['Book Value CAD'] - 1
+    combined_df['Accounts'] = grouped['Account'].apply(lambda x: ', '.join(x)).values
+    return account_df.drop(columns=['Book Value CAD']), combined_df.drop(columns=['Book Value CAD'])
 
 
 def investorline_transaction_to_sec(transaction_df):
@@ -277,17 +604,49 @@ def investorline_transaction_to_sec(transaction_df):
     pass
 
 
+@dataclass(frozen=True)
+class PositionSnapshot():
+    symbol: str
+    currency: str
+    instrument: str
+    quantity: float
+    average_cost: float
+    market_price: float
+    market_price_time: object = None
+
+
+@dataclass(frozen=True)
+class HoldingsSnapshot():
+    # read-only copy of a valued Holdings, safe to hand to other threads and to compare
+    asof_time: object
+    market_value: float
+    cash: tuple # (currency, balance) pairs
+    fx: tuple # (pair, rate) pairs
+    positions: tuple # PositionSnapshot, in symbol order
+
+
+@dataclass(frozen=True)
+class PortfolioSnapshot():
+    account_name: str
+    current_time: object
+    inception_time: object
+    holdings: HoldingsSnapshot
+    hist_market_values: tuple # (return date name, market value) pairs
+    performance: tuple # (return date name, rate of return) pairs
+
+
 class TransactionHistory():
-    df = pd.DataFrame()
-    split_reference = None
-    first_transaction_date = None
-    last_transaction_date = None
-    current_datetime = None
-    broker = ''
+    __slots__ = ('df', 'split_reference', 'first_transaction_date', 'last_transaction_date', 'current_datetime',
+                 'broker')
 
 
     def __init__(self, raw_df_, broker_, split_reference_=None):
+        self.df = pd.DataFrame()
+        self.first_transaction_date = None
+        self.last_transaction_date = None
         if broker_ == 'questrade':
+            # a copy, the caller's frame may be read by other threads
+            raw_df_ = raw_df_.copy()
             raw_df_['Transaction Date'] = pd.to_datetime(raw_df_['Transaction Date'], format='%Y-%m-%d %H:%M:%S %p')
             raw_df_['Settlement Date'] = pd.to_datetime(raw_df_['Settlement Date'], format='%Y-%m-%d %H:%M:%S %p')
             raw_df_ = raw_df_.sort_values(by=['Transaction Date', 'Settlement Date'], axis=0).reset_index(drop=True)
@@ -301,6 +660,32 @@ class TransactionHistory():
         self.split_reference = split_reference_
 
 
+    @classmethod
+    def from_store(cls, store, account, broker_='questrade', start=None, end=None, split_reference_=None):
+        '''
+        Purpose
+        -------
+        the transaction history of one account, optionally between two transaction dates, read from a
+        ledger_store.LedgerStore with an indexed range query instead of the exports
+
+        Parameters
+        ----------
+        store : LedgerStore
+
+        account : str
+            account key the exports were ingested under, e.g. 'tfsa'
+
+        start, end : datetime, optional
+            first and last transaction date, inclusive, default None for no limit
+
+        Returns
+        -------
+        TransactionHistory
+
+        '''
+        return cls(store.load(account, start, end), broker_, split_reference_)
+
+
     def update_inkind_transfer(self, reference_df):
         inkind_transfers = self.df[(self.df['Activity Type'] == 'Transfers') & (~ pd.isna(self.df['Symbol']))]
         print('{} rows of in-kind transfers detectted'.format(len(inkind_transfers)))
@@ -381,36 +766,48 @@ class TransactionHistory():
 
 
 class Portfolio():
-    current_time = None
-    current_holdings = None
-    inception_time = None
-    external_cash_flow_df = None
-    return_dates_dict = {}
-    broker = ''
-    account_number = None
-    account_name = ''
-
-    hist_holdings = {}
-    performance = {}
-    performance_df = None
+    __slots__ = ('current_time', 'current_holdings', 'inception_time', 'external_cash_flow_df', 'return_dates_dict',
+                 'broker', 'account_number', 'account_name', 'hist_holdings', 'performance', 'performance_df',
+                 'nav_history', 'risk_df', 'rolling_risk_df', 'attribution_df', 'projection_df', 'contribution_df',
+                 'stress_df', 'cash_history_df', 'margin_df')
 
 
     def __init__(self, *args, **kwargs):
-
-        self.current_time = datetime.now()
+        self.current_holdings = None
+        self.inception_time = None
+        self.external_cash_flow_df = None
+        self.broker = ''
+        self.account_number = None
+        self.account_name = ''
+        self.nav_history = None
+        self.risk_df = None
+        self.rolling_risk_df = None
+        self.attribution_df = None
+        self.projection_df = None
+        self.contribution_df = None
+        self.stress_df = None
+        self.cash_history_df = None
+        self.margin_df = None
+
+        # asof_date replaces "now" as the valuation time, e.g. for re-running a past month end
+        asof_date = kwargs.get('asof_date')
+        if asof_date is not None:
+            self.current_time = asof_date
+        else:
+            self.current_time = datetime.now()
 
         # first get the inception date from transaction history
 
         if kwargs.get('transaction') is not None:
 
             transaction = kwargs.get('transaction')
-            self.current_holdings = Holdings(transaction=transaction)
+            self.current_holdings = Holdings(transaction=transaction, asof_date=asof_date)
 
             if transaction.broker == 'questrade':
 
                 # construct self.external_cash_flow_df
                 transaction_df = transaction.df
-                cash_flows_df = transaction_df[transaction_df['Activity Type'].isin(['Deposits', 'Withdrawals', 'Transfers'])]
+                cash_flows_df = transaction_df[transaction_df['Activity Type'].isin(['Deposits', 'Withdrawals', 'Transfers'])].copy()
 
                 cash_flows_df['Transaction Date'] = pd.to_datetime(cash_flows_df['Transaction Date'], format='%Y-%m-%d %H:%M:%S %p')
                 cash_flows_df['Settlement Date'] = pd.to_datetime(cash_flows_df['Settlement Date'], format='%Y-%m-%d %H:%M:%S %p')
@@ -424,13 +821,14 @@ class Portfolio():
                         i_price = useful_functions.get_hist_price(lookup_symbol, cash_flows_df.loc[i, 'Transaction Date'])
                         cash_flows_df.loc[i, 'Net Amount'] = i_price * cash_flows_df.loc[i, 'Quantity']
 
-                # convert USD cash flows into CAD
-                usd_rows = cash_flows_df[cash_flows_df['Currency'] == 'USD'].index
-                if len(usd_rows) > 0:
-                    for i in usd_rows:
-                        i_usdcad = get_fx(['usdcad'], cash_flows_df.loc[i, 'Transaction Date'])['usdcad']
-                        cash_flows_df.loc[i, 'Net Amount'] = cash_flows_df.loc[i, 'Net Amount'] * i_usdcad
-                        cash_flows_df.loc[i, 'Currency'] = 'CAD'
+                # convert foreign cash flows into CAD, one rate history per currency for all of them
+                foreign = cash_flows_df['Currency'] != 'CAD'
+                if foreign.any():
+                    flows = cash_flows_df[foreign]
+                    fx_matrix = FXMatrix.from_provider(flows['Currency'].unique(), flows['Transaction Date'].unique())
+                    cash_flows_df.loc[foreign, 'Net Amount'] = fx_matrix.convert(flows['Net Amount'], flows['Currency'],
+                                                                                flows['Transaction Date'])
+                    cash_flows_df.loc[foreign, 'Currency'] = 'CAD'
 
                 self.inception_time = cash_flows_df['Transaction Date'].min().to_pydatetime()
                 self.external_cash_flow_df = cash_flows_df
@@ -450,19 +848,23 @@ class Portfolio():
             self.return_dates_dict = useful_functions.past_dates_dict(self.current_time, self.inception_time)
 
         if kwargs.get('info_df') is not None:
-            self.current_holdings.market_value_cad(kwargs.get('info_df'))
+            self.current_holdings.market_value_cad(kwargs.get('info_df'), hist_date=asof_date,
+                                                   price_cache=kwargs.get('price_cache'))
 
         self.hist_holdings = {}
         self.performance = {}
         self.performance_df = None
 
 
-    def get_hist_holdings(self, transaction, info_df):
+    def get_hist_holdings(self, transaction, info_df, price_cache=None):
         if self.broker == 'questrade':
+            # one pass over the history gives the holdings at every return date
+            snapshots = dict(stream_replay([transaction.df], self.return_dates_dict.values(), transaction.split_reference))
             for rd in self.return_dates_dict.keys():
                 print(rd, ': from {}'.format(self.return_dates_dict[rd].strftime('%Y-%m-%d')))
-                self.hist_holdings[rd] = Holdings(transaction=transaction, asof_date=self.return_dates_dict[rd])
-                self.hist_holdings[rd].market_value_cad(info_df, hist_date=self.return_dates_dict[rd])
+                self.hist_holdings[rd] = copy.deepcopy(snapshots[self.return_dates_dict[rd]])
+                self.hist_holdings[rd].market_value_cad(info_df, hist_date=self.return_dates_dict[rd],
+                                                        price_cache=price_cache)
         elif self.broker == 'investorline':
             for rd in self.return_dates_dict.keys():
                 print(rd)
@@ -476,21 +878,144 @@ class Portfolio():
         for rd in self.return_dates_dict:
             starting_balance = self.hist_holdings[rd].market_value
             starting_time = self.return_dates_dict[rd]
-            rd_cash_flows = self.external_cash_flow_df.set_index('Transaction Date')
-            rd_cash_flows = rd_cash_flows[(rd_cash_flows.index > starting_time) & (rd_cash_flows.index <= ending_time)]
-            cash_flow_sum = rd_cash_flows['Net Amount'].sum()
-
-            # construct weighted sum
-            rd_cash_flows['Time Weight'] = (ending_time - rd_cash_flows.index) / (ending_time - starting_time)
-            weighted_sum = rd_cash_flows['Time Weight'].dot(rd_cash_flows['Net Amount'])
-
-            # compute the rate of return based on the modified Dietz method
-            numerator = ending_balance - starting_balance - cash_flow_sum
-            denominator = starting_balance + weighted_sum
-            self.performance[rd] = numerator / denominator
+            self.performance[rd] = modified_dietz(starting_balance, ending_balance, starting_time, ending_time,
+                                                  self.external_cash_flow_df)
         self.performance_df = pd.DataFrame(self.performance, index=[self.current_time.strftime('%Y-%m-%d %H:%M')])
 
 
+    def build_nav_history(self, transaction, store, info_df=None, dates=None):
+        # daily market value from dense quantity, price and fx matrices, see nav.NavHistory
+        import nav
+        if dates is None:
+            dates = pd.bdate_range(transaction.first_transaction_date.normalize(), self.current_time)
+        self.nav_history = nav.NavHistory(transaction, store, info_df=info_df, dates=dates)
+
+
+    def measure_margin(self, rate_df=None, day_count=365):
+        # daily cash of every currency and, with a margin rate table, interest and borrowing, from the nav history
+        self.cash_history_df = self.nav_history.cash_history_df(rate_df, day_count)
+        if rate_df is not None:
+            self.margin_df = self.nav_history.margin_df(rate_df, day_count)
+
+
+    def measure_risk(self, store, benchmarks=('SPY', 'XIU.TO'), risk_free=0.0, confidence=0.95, window=63):
+        # volatility, drawdown, sharpe/sortino, var/cvar and beta of the daily nav, see risk.account_risk
+        import risk
+        import returns
+        nav_series = self.nav_history.nav()
+        nav_series = nav_series[nav_series.index >= nav_series[nav_series > 0].index.min()]
+        benchmark_prices = store.price_matrix(list(benchmarks), nav_series.index, column='Adj Close')
+        self.risk_df, self.rolling_risk_df = risk.account_risk(nav_series,
+                                                               returns.cash_flow_series(self.external_cash_flow_df),
+                                                               benchmark_prices, risk_free, confidence, window)
+
+
+    def measure_contribution(self):
+        # daily return and contribution of every security from the nav history, see contribution.daily_contributions
+        import contribution
+        import returns
+        self.contribution_df = contribution.daily_contributions(self.nav_history,
+                                                                returns.cash_flow_series(self.external_cash_flow_df))
+
+
+    def measure_attribution(self, info_df, store, benchmark_df, by=('Asset Class', 'Region', 'Currency')):
+        '''
+        Purpose
+        -------
+        brinson attribution of the active return against a benchmark over every return date period, see
+        attribution.brinson; positions are held from the start of each period, so trades within the period
+        show up in neither the portfolio nor the benchmark return
+
+        Parameters
+        ----------
+        info_df : DataFrame
+            the info table
+
+        store : PriceStore
+            local daily prices of the benchmark constituents
+
+        benchmark_df : DataFrame
+            the benchmark weight file, see attribution.benchmark_panel
+
+        by : tuple, optional
+            attributes to group by, one block of rows each, default ('Asset Class', 'Region', 'Currency')
+
+        '''
+        import attribution
+        periods = list(self.return_dates_dict.keys())
+        start_dates = [self.return_dates_dict[rd] for rd in periods]
+        attribution_list = []
+        for attribute in by:
+            portfolio = attribution.portfolio_panel(self.nav_history, info_df, attribute, start_dates, self.current_time)
+            benchmark = attribution.benchmark_panel(benchmark_df, store, attribute, start_dates, self.current_time)
+            df = attribution.brinson(portfolio, benchmark, periods)
+            df.insert(1, 'Attribute', attribute)
+            attribution_list.append(df)
+        self.attribution_df = pd.concat(attribution_list, ignore_index=True)
+
+
+    def project(self, store, info_df=None, years=10, n_paths=10000, seed=0, workers=1, history_years=5):
+        '''
+        Purpose
+        -------
+        monte carlo projection of the market value from the current holdings, with contributions following
+        the pattern of the external cash flows, see projection.project; current_holdings must be valued
+
+        Parameters
+        ----------
+        store : PriceStore
+            local daily prices of the holdings, to estimate their covariance
+
+        info_df : DataFrame, optional
+            the info table, default None
+
+        years : int, optional
+            horizon, default 10
+
+        n_paths, seed, workers : optional
+            see projection.project
+
+        history_years : int, optional
+            years of price and cash flow history used, default 5
+
+        '''
+        import projection
+        weights, currencies = projection.holdings_weights(self.current_holdings.to_df(), info_df)
+        risky = [s for s in weights.index if s != 'CAD']
+        mu, cov = projection.estimate_moments(store, risky, currencies, self.current_time, years=history_years)
+        start_date = pd.Timestamp(self.current_time).normalize()
+        step_dates = pd.date_range(start_date, periods=years * 12, freq=pd.offsets.MonthEnd())
+        contributions = projection.contribution_schedule(self.external_cash_flow_df, step_dates, years=history_years)
+        self.projection_df = projection.project(self.current_holdings.market_value, weights[risky].values, mu, cov,
+                                                contributions, step_dates, n_paths=n_paths, seed=seed, workers=workers,
+                                                start_date=start_date)
+
+
+    def stress_test(self, scenario_df):
+        '''
+        Purpose
+        -------
+        change of the current market value under every scenario of scenario_df, all at once, see
+        stress.stress_test; current_holdings must be valued
+
+        Parameters
+        ----------
+        scenario_df : DataFrame
+            a 'Scenario' column and one shock column per factor, e.g. 'Region=US & Asset Class=Equity'
+
+        '''
+        import stress
+        self.stress_df = stress.stress_test(self.current_holdings.to_df(), scenario_df)[0]
+
+
+    def snapshot(self):
+        # immutable copy of the valuation and performance, see PortfolioSnapshot
+        return PortfolioSnapshot(self.account_name, self.current_time, self.inception_time,
+                                 self.current_holdings.snapshot(),
+                                 tuple((rd, h.market_value) for (rd, h) in self.hist_holdings.items()),
+                                 tuple(self.performance.items()))
+
+
     def print_current_holdings(self):
         print('Current: {}'.format(self.current_time.strftime('%Y-%m-%d %H:%M:%S')))
         self.current_holdings.print_info()
@@ -502,23 +1027,178 @@ class Portfolio():
             self.hist_holdings[hh].print_info()
 
 
-    def output_file(self, filename):
-        with pd.ExcelWriter(filename, mode='w') as writer:
-            self.current_holdings.to_df().to_excel(writer, sheet_name='Current Holdings', index=False)
-            self.performance_df.to_excel(writer, sheet_name='Performance Asof')
+    def nav_history_df(self):
+        if self.nav_history is not None:
+            return self.nav_history.to_df()
+        # market value at every return date that has been valued, plus the current one
+        periods = [rd for rd in self.hist_holdings.keys()] + ['Current']
+        dates = [self.return_dates_dict[rd] for rd in self.hist_holdings.keys()] + [self.current_time]
+        values = [self.hist_holdings[rd].market_value for rd in self.hist_holdings.keys()]
+        values.append(self.current_holdings.market_value)
+        df = pd.DataFrame({'Period': periods, 'Date': dates, 'Market Value CAD': values})
+        return df.sort_values(by='Date').reset_index(drop=True)
+
+
+    def output_file(self, filename, formats=('xlsx', 'feather')):
+        import export
+        sheet_dict = {'Current Holdings': self.current_holdings.to_df()}
+        if self.performance_df is not None:
+            sheet_dict['Performance Asof'] = self.performance_df
+        sheet_dict['NAV History'] = self.nav_history_df()
+        sheet_dict['Lots'] = self.current_holdings.lots_df()
+        if self.risk_df is not None:
+            sheet_dict['Risk'] = self.risk_df
+            sheet_dict['Rolling Risk'] = self.rolling_risk_df
+        if self.contribution_df is not None:
+            sheet_dict['Contribution'] = self.contribution_df.reset_index()
+        if self.attribution_df is not None:
+            sheet_dict['Attribution'] = self.attribution_df
+        if self.projection_df is not None:
+            sheet_dict['Projection'] = self.projection_df
+        if self.stress_df is not None:
+            sheet_dict['Stress Test'] = self.stress_df
+        if self.cash_history_df is not None:
+            sheet_dict['Cash History'] = self.cash_history_df
+        if self.margin_df is not None:
+            sheet_dict['Margin'] = self.margin_df
+        export.write_report(sheet_dict, filename, formats=formats)
+
+
+class ConsolidatedPortfolio():
+    __slots__ = ('current_time', 'inception_time', 'external_cash_flow_df', 'return_dates_dict', 'portfolios',
+                 'hist_holdings', 'price_cache', 'performance', 'performance_df', 'twr')
+
+
+    def __init__(self, portfolios, return_dates_dict=None):
+        '''
+        Parameters
+        ----------
+        portfolios : dict
+            account names as keys and Portfolio objects as values, valued or not, all with the same
+            current time
+
+        return_dates_dict : dict, optional
+            default None, in which case the return dates are based on the earliest inception of all accounts
+
+        '''
+        self.portfolios = portfolios
+        self.current_time = max(p.current_time for p in portfolios.values())
+        self.inception_time = min(p.inception_time for p in portfolios.values())
+
+        # one merged set of external cash flows, all in CAD already
+        self.external_cash_flow_df = pd.concat([p.external_cash_flow_df.assign(Account=account)
+                                                for account, p in portfolios.items()])
+        self.external_cash_flow_df = self.external_cash_flow_df.sort_values(by='Transaction Date').reset_index(drop=True)
+
+        if return_dates_dict is not None:
+            self.return_dates_dict = return_dates_dict
+        else:
+            self.return_dates_dict = useful_functions.past_dates_dict(self.current_time, self.inception_time)
+
+        # every price and fx rate looked up for any account is kept here and reused by the others
+        self.price_cache = {}
+        self.hist_holdings = {}
+        self.performance = {}
+        self.performance_df = None
+        self.twr = {}
+
+
+    def market_value_cad(self, info_df, hist_date=None):
+        # each symbol held in several accounts is only priced once through the shared cache
+        for account in self.portfolios:
+            print('valuing {}'.format(account))
+            self.portfolios[account].current_holdings.market_value_cad(info_df, hist_date=hist_date,
+                                                                      price_cache=self.price_cache)
+
+
+    @property
+    def market_value(self):
+        return sum(p.current_holdings.market_value for p in self.portfolios.values())
+
+
+    def get_hist_holdings(self, transactions, info_df):
+        '''
+        Parameters
+        ----------
+        transactions : dict
+            account names as keys and TransactionHistory objects as values
+
+        info_df : DataFrame
+            the info table
+
+        '''
+        for account in self.portfolios:
+            transaction = transactions[account]
+            snapshots = dict(stream_replay([transaction.df], self.return_dates_dict.values(), transaction.split_reference))
+            self.hist_holdings[account] = {}
+            for rd in self.return_dates_dict.keys():
+                print('{} {}: from {}'.format(account, rd, self.return_dates_dict[rd].strftime('%Y-%m-%d')))
+                self.hist_holdings[account][rd] = copy.deepcopy(snapshots[self.return_dates_dict[rd]])
+                self.hist_holdings[account][rd].market_value_cad(info_df, hist_date=self.return_dates_dict[rd],
+                                                                 price_cache=self.price_cache)
+
+
+    def hist_market_value(self, rd):
+        return sum(self.hist_holdings[account][rd].market_value for account in self.portfolios)
+
+
+    def measure_performance(self):
+        ending_balance = self.market_value
+        ending_time = self.current_time
+
+        # modified dietz of the combined balances over the merged cash flows
+        for rd in self.return_dates_dict:
+            self.performance[rd] = modified_dietz(self.hist_market_value(rd), ending_balance,
+                                                  self.return_dates_dict[rd], ending_time, self.external_cash_flow_df)
+
+        # time weighted return, linking the modified dietz returns between consecutive return dates
+        rd_sorted = sorted(self.return_dates_dict.keys(), key=lambda rd: self.return_dates_dict[rd])
+        balances = [self.hist_market_value(rd) for rd in rd_sorted] + [ending_balance]
+        times = [self.return_dates_dict[rd] for rd in rd_sorted] + [ending_time]
+        growth = 1
+        for i in range(len(rd_sorted) - 1, -1, -1):
+            if times[i] < times[i + 1]:
+                growth = growth * (1 + modified_dietz(balances[i], balances[i + 1], times[i], times[i + 1],
+                                                      self.external_cash_flow_df))
+            self.twr[rd_sorted[i]] = growth - 1
+
+        self.performance_df = pd.DataFrame([self.performance, self.twr], index=['Modified Dietz', 'TWR'])
+
+
+    def holdings_df(self):
+        '''
+        Returns
+        -------
+        two DataFrames, see combine_holdings_df; the per account rows are the drill-down of the combined ones
+
+        '''
+        return combine_holdings_df({account: p.current_holdings.to_df() for account, p in self.portfolios.items()})
+
+
+    def output_file(self, filename, formats=('xlsx', 'feather')):
+        import export
+        account_df, combined_df = self.holdings_df()
+        sheet_dict = {'Current Holdings': combined_df, 'Holdings by Account': account_df}
+        if self.performance_df is not None:
+            sheet_dict['Performance Asof'] = self.performance_df
+        export.write_report(sheet_dict, filename, formats=formats)
 
 
 class Holdings():
-    symbol_list = []
-    security_list = []
-    cash_dict = {}
-    fx_pairs = ['usdcad']
-    fx_dict = {}
-    market_value = 0
-    asof_time = None
+    __slots__ = ('symbol_list', 'security_list', 'cash_dict', 'base_currency', 'fx_pairs', 'fx_dict', 'market_value',
+                 'asof_time')
 
 
     def __init__(self, *args, **kwargs):
+        self.symbol_list = []
+        self.security_list = []
+        self.cash_dict = {}
+        # market values are in base_currency; 'CAD' unless given, the columns of to_df keep their CAD names
+        self.base_currency = kwargs.get('base_currency', 'CAD')
+        self.fx_pairs = []
+        self.fx_dict = {}
+        self.market_value = 0
+        self.asof_time = None
 
         if kwargs.get('transaction') is not None:
 
@@ -541,9 +1221,37 @@ class Holdings():
                 # execute investorline modelling
                 pass
 
+        elif kwargs.get('security_dict') is not None:
+            # already replayed elsewhere, e.g. a snapshot from stream_replay
+            sec_dict = kwargs.get('security_dict')
+            self.symbol_list = list(sec_dict.keys())
+            self.security_list = list(sec_dict.values())
+            self.cash_dict = kwargs.get('cash_dict')
+            self.asof_time = kwargs.get('asof_date')
+
+
+    def currencies(self):
+        return set(self.cash_dict.keys()) | set(sec.currency for sec in self.security_list)
 
-    def update_fx(self, hist_date=None):
-        self.fx_dict = get_fx(self.fx_pairs, hist_date)
+
+    def update_fx(self, hist_date=None, price_cache=None):
+        # one pair per currency held, e.g. 'usdcad', all from one usd leg per currency, see fx.spot_rates
+        currencies = self.currencies() - {self.base_currency}
+        self.fx_pairs = sorted(pair_name(c, self.base_currency) for c in currencies)
+        fx_key = ('fx', tuple(self.fx_pairs), hist_date)
+        if (price_cache is not None) and (fx_key in price_cache):
+            self.fx_dict = price_cache[fx_key]
+            return
+        self.fx_dict = spot_rates(currencies, self.base_currency, hist_date)
+        if price_cache is not None:
+            price_cache[fx_key] = self.fx_dict
+
+
+    def fx_rate(self, currency):
+        # value of one unit of currency in base_currency, after update_fx
+        if currency == self.base_currency:
+            return 1.0
+        return self.fx_dict[pair_name(currency, self.base_currency)]
 
 
     def get_security_info(self, info_df, symbol_col='ticker_summary'):
@@ -553,32 +1261,26 @@ class Holdings():
             self.security_list[i].update_security_info(info_df, symbol_col)
 
 
-    def get_market_price(self, info_df, symbol_col='ticker_summary', hist_date=None):
+    def get_market_price(self, info_df, symbol_col='ticker_summary', hist_date=None, price_cache=None):
         # get market price
         l = len(self.security_list)
         for i in range(l):
-            self.security_list[i].update_market_price(info_df, symbol_col, date=hist_date)
+            self.security_list[i].update_market_price(info_df, symbol_col, date=hist_date, price_cache=price_cache)
 
 
-    def market_value_cad(self, info_df, hist_date=None):
-        self.update_fx(hist_date=hist_date)
+    def market_value_cad(self, info_df, hist_date=None, price_cache=None):
+        self.update_fx(hist_date=hist_date, price_cache=price_cache)
         print('fx updated')
         self.get_security_info(info_df)
         print('security info updated')
-        self.get_market_price(info_df, hist_date=hist_date)
+        self.get_market_price(info_df, hist_date=hist_date, price_cache=price_cache)
         print('security market prices updated')
         market_value = 0
         for ccy in self.cash_dict.keys():
-            if ccy == 'CAD':
-                market_value += self.cash_dict[ccy]
-            else:
-                market_value += self.cash_dict[ccy] * self.fx_dict['{}cad'.format(ccy.lower())]
+            market_value += self.cash_dict[ccy] * self.fx_rate(ccy)
         for sec in self.security_list:
-            if sec.currency == 'CAD':
-                market_value += sec.quantity * sec.market_price
-            else:
-                market_value += sec.quantity * sec.market_price * self.fx_dict['{}cad'.format(sec.currency.lower())]
-        print('conversion to cad completed')
+            market_value += sec.quantity * sec.market_price * self.fx_rate(sec.currency)
+        print('conversion to {} completed'.format(self.base_currency.lower()))
         self.market_value = market_value
         if hist_date is not None:
             self.asof_time = hist_date
@@ -586,6 +1288,15 @@ class Holdings():
             self.asof_time = datetime.now()
 
 
+    def snapshot(self):
+        # immutable copy of the current state, see HoldingsSnapshot
+        positions = tuple(PositionSnapshot(sec.symbol, sec.currency, sec.instrument, sec.quantity, sec.average_cost,
+                                           sec.market_price, sec.market_price_time)
+                          for sec in sorted(self.security_list, key=lambda sec: sec.symbol))
+        return HoldingsSnapshot(self.asof_time, self.market_value, tuple(sorted(self.cash_dict.items())),
+                                tuple(sorted(self.fx_dict.items())), positions)
+
+
     def print_cash_info(self):
         for k in self.cash_dict.keys():
             print('{}: {:.2f}'.format(k, self.cash_dict[k]))
@@ -600,6 +1311,15 @@ class Holdings():
             print('market value: {:.2f}CAD, at {}'.format(self.market_value, self.asof_time.strftime('%Y-%m-%d %H:%M:%S')))
 
 
+    def lots_df(self):
+        # one row per open lot of every security
+        rows = [[sec.symbol, sec.currency, sec.instrument, lot[0], lot[1], lot[2]]
+                for sec in self.security_list for lot in sec.lots]
+        df = pd.DataFrame(rows, columns=['Symbol', 'Currency', 'Instrument', 'Trade Date', 'Quantity', 'Unit Cost'])
+        df['Book Cost'] = df['Quantity'] * df['Unit Cost']
+        return df
+
+
     def to_df(self, with_cash=True):
         # convert to pandas dataframe
         symbol_list = []
@@ -618,6 +1338,7 @@ class Holdings():
         underlying_market_price_time_list = []
         expiration_list = []
         strike_list = []
+        num_shares_list = []
         l = len(self.security_list)
         for i in range(l):
             i_sec = self.security_list[i]
@@ -637,6 +1358,7 @@ class Holdings():
                 underlying_market_price_time_list.append(i_sec.underlying_market_price_time)
                 expiration_list.append(i_sec.expiration)
                 strike_list.append(i_sec.strike)
+                num_shares_list.append(i_sec.num_shares)
             else:
                 option_type_list.append('NA')
                 underlying_symbol_list.append('')
@@ -644,6 +1366,7 @@ class Holdings():
                 underlying_market_price_time_list.append(np.nan)
                 expiration_list.append(np.nan)
                 strike_list.append(np.nan)
+                num_shares_list.append(np.nan)
 
         if with_cash:
             for cash in self.cash_dict:
@@ -662,6 +1385,7 @@ class Holdings():
                 underlying_market_price_time_list.append(np.nan)
                 expiration_list.append(np.nan)
                 strike_list.append(np.nan)
+                num_shares_list.append(np.nan)
 
         df = pd.DataFrame({'Symbol': symbol_list, 'Currency': currency_list, 'Instrument': instrument_list,
                            'Quantity': quantity_list, 'Asset Class': asset_class_list, 'Region': region_list,
@@ -669,13 +1393,12 @@ class Holdings():
                            'Book Cost': book_cost_local_ccy_list, 'Option Type': option_type_list,
                            'Option Underlying': underlying_symbol_list, 'Underlying Market Price': underlying_market_price_list,
                            'Underlying Price Time': underlying_market_price_time_list, 'Expiration': expiration_list,
-                           'Strike Price': strike_list})
+                           'Strike Price': strike_list, 'Num Shares': num_shares_list})
 
-        df['Market Price CAD'] = df['Market Price']
-        df.loc[df['Currency'] == 'USD', 'Market Price CAD'] = df['Market Price'] * self.fx_dict['usdcad']
-
-        df['Book Cost CAD'] = df['Book Cost']
-        df.loc[df['Currency'] == 'USD', 'Book Cost CAD'] = df['Book Cost'] * self.fx_dict['usdcad']
+        # one rate per currency, broadcast over the rows
+        fx = df['Currency'].map({c: self.fx_rate(c) for c in df['Currency'].unique()}).astype(float)
+        df['Market Price CAD'] = df['Market Price'] * fx
+        df['Book Cost CAD'] = df['Book Cost'] * fx
         df['Market Value CAD'] = df['Quantity'] * df['Market Price CAD']
 
         df['PnL CAD'] = (df['Market Price CAD'] - df['Book Cost CAD']) * df['Quantity']
@@ -688,17 +1411,8 @@ class Holdings():
 
 
 class Security():
-    symbol = ''
-    currency = ''
-    instrument = ''
-    asset_class = ''
-    region = ''
-    quantity = 0
-    average_cost = 0
-    market_price = 0
-    market_price_time = None
-    commission = 0
-    liquidated = False
+    __slots__ = ('symbol', 'currency', 'instrument', 'asset_class', 'region', 'quantity', 'average_cost',
+                 'market_price', 'market_price_time', 'commission', 'liquidated', 'lots')
 
 
     def __init__(self, symbol_, currency_, instrument_='', asset_class_='', region_=''):
@@ -707,9 +1421,16 @@ class Security():
         self.instrument = instrument_
         self.asset_class = asset_class_
         self.region = region_
+        self.quantity = 0
+        self.average_cost = 0
+        self.market_price = 0
+        self.market_price_time = None
+        self.commission = 0
+        self.liquidated = False
+        self.lots = [] # open lots, first in first out, each [trade date, signed quantity, unit cost with commission]
 
 
-    def new_trade(self, new_quantity, new_price, new_commission, liquidate_if_zero=True):
+    def new_trade(self, new_quantity, new_price, new_commission, liquidate_if_zero=True, trade_date=None):
         new_num_shares = self.quantity + new_quantity
         self.commission += new_commission
         if new_quantity > 0: # buy
@@ -718,6 +1439,25 @@ class Security():
         if (new_num_shares == 0) and (liquidate_if_zero):
             self.liquidated = True
         self.quantity = new_num_shares
+        self.update_lots(new_quantity, new_price, new_commission, trade_date)
+
+
+    def update_lots(self, new_quantity, new_price, new_commission, trade_date):
+        # close the oldest lots on the opposite side first, whatever is left opens a new lot
+        remaining = new_quantity
+        while (remaining != 0) and (len(self.lots) > 0) and ((self.lots[0][1] > 0) != (remaining > 0)):
+            closed = min(abs(remaining), abs(self.lots[0][1]))
+            if remaining > 0:
+                self.lots[0][1] += closed
+                remaining -= closed
+            else:
+                self.lots[0][1] -= closed
+                remaining += closed
+            if self.lots[0][1] == 0:
+                self.lots.pop(0)
+        if remaining != 0:
+            unit_cost = new_price + np.sign(remaining) * new_commission / abs(new_quantity)
+            self.lots.append([trade_date, remaining, unit_cost])
 
 
     def update_security_info(self, info_table, symbol_col):
@@ -726,37 +1466,48 @@ class Security():
         self.region = vlookup(info_table, self.symbol, symbol_col, 'region')
 
 
-    def update_market_price(self, info_table, symbol_col, date=None):
+    def update_market_price(self, info_table, symbol_col, date=None, price_cache=None):
         url_symbol = vlookup(info_table, self.symbol, symbol_col, 'ticker_url')
-        if date is not None:
-            # print('getting historical data for {} on {}'.format(self.symbol, date.strftime('%Y-%m-%d')))
-            self.market_price = useful_functions.get_hist_price(url_symbol, date)
-            self.market_price_time = date
-        else:
-            price_pair = get_last_price(url_symbol)
-            self.market_price = price_pair[1]
-            self.market_price_time = price_pair[0]
+        price_pair = cached_price(url_symbol, date=date, price_cache=price_cache)
+        self.market_price = price_pair[1]
+        self.market_price_time = price_pair[0]
 
 
     def reverse_split(self, ratio, new_share_num):
         # ratio should be the number of shares that are merged into one share
+        share_ratio = new_share_num / self.quantity
+        # fractional shares are paid out as cash in lieu, anything more means the ratio or the ledger is off
+        if abs(self.quantity / ratio - new_share_num) >= 1:
+            print('{}: {} shares at a {} to 1 ratio should become {:.2f} shares, not {}'.format(
+                self.symbol, self.quantity, ratio, self.quantity / ratio, new_share_num))
+        self.lots = [[lot[0], lot[1] * share_ratio, lot[2] / share_ratio] for lot in self.lots]
         self.quantity = new_share_num
         self.average_cost = self.average_cost * ratio
 
 
     def journal(self, symbol_to, date):
-        if self.currency == 'CAD':
-            fx_dict = useful_functions.get_fx(['CADUSD'], date=date)
-            fx = fx_dict['CADUSD']
-            self.currency = 'USD'
-        else: # the only other possibility is USD by the definition of journalling
-            fx_dict = useful_functions.get_fx(['USDCAD'], date=date)
-            fx = fx_dict['USDCAD']
-            self.currency = 'CAD'
+        # the only two possibilities by the definition of journalling
+        currency_to = 'USD' if self.currency == 'CAD' else 'CAD'
+        fx = spot_rate(self.currency, currency_to, date)
+        self.currency = currency_to
 
         self.symbol = symbol_to
         self.average_cost = self.average_cost * fx
         self.commission = self.commission * fx
+        self.lots = [[lot[0], lot[1], lot[2] * fx] for lot in self.lots]
+
+
+    def merge(self, other):
+        # take over another position in the same security, e.g. journalled into this one, keeping its lots and
+        # their trade dates; other's average cost already includes its commissions
+        new_num_shares = self.quantity + other.quantity
+        if new_num_shares != 0:
+            self.average_cost = (self.quantity * self.average_cost + other.quantity * other.average_cost) / new_num_shares
+        self.commission += other.commission
+        self.quantity = new_num_shares
+        self.liquidated = new_num_shares == 0
+        self.lots = sorted(self.lots + [list(lot) for lot in other.lots],
+                           key=lambda lot: pd.Timestamp.min if lot[0] is None else pd.Timestamp(lot[0]))
 
 
     def print_info(self):
@@ -776,22 +1527,17 @@ class Security():
 
 
 class Option(Security):
-    instrument = 'Option'
-    option_type = '' # 'Call' or 'Put'
-    underlying_symbol = ''
-    underlying_market_price = 0
-    underlying_market_price_time = None # python datetime object
-    expiration = None # python datetime object
-    strike = 0
-    num_shares = 0
+    __slots__ = ('option_type', 'underlying_symbol', 'underlying_market_price', 'underlying_market_price_time',
+                 'expiration', 'strike', 'num_shares')
 
 
     def __init__(self, symbol_, currency_, option_type_, underlying_symbol_, expiration_, strike_):
-        self.symbol = symbol_
-        self.currency = currency_
-        self.option_type = option_type_
+        Security.__init__(self, symbol_, currency_, instrument_='Option')
+        self.option_type = option_type_ # 'Call' or 'Put'
         self.underlying_symbol = underlying_symbol_
-        self.expiration = expiration_
+        self.underlying_market_price = 0
+        self.underlying_market_price_time = None # python datetime object
+        self.expiration = expiration_ # python datetime object
         self.strike = strike_
         self.num_shares = 100
 
@@ -801,16 +1547,15 @@ class Option(Security):
         self.region = vlookup(info_table, self.underlying_symbol, symbol_col, 'region')
 
 
-    def update_market_price(self, info_table, symbol_col, date=None):
+    def update_market_price(self, info_table, symbol_col, date=None, price_cache=None):
         url_symbol = vlookup(info_table, self.underlying_symbol, symbol_col, 'ticker_url')
         lookup_instrument = vlookup(info_table, self.underlying_symbol, symbol_col, 'instrument')
         if date is not None:
-            self.underlying_market_price = useful_functions.get_hist_price(self.underlying_symbol, date)
-            self.underlying_market_price_time = date
+            price_pair = cached_price(self.underlying_symbol, date=date, price_cache=price_cache)
         else:
-            price_pair = get_last_price(url_symbol)
-            self.underlying_market_price = price_pair[1]
-            self.underlying_market_price_time = price_pair[0]
+            price_pair = cached_price(url_symbol, price_cache=price_cache)
+        self.underlying_market_price = price_pair[1]
+        self.underlying_market_price_time = price_pair[0]
         # the market price of the option is intrinsic value only due to difficulties of getting market value of options
         if self.option_type == 'Call':
             self.market_price = max(0, self.underlying_market_price - self.strike) * self.num_shares
@@ -848,3 +1593,58 @@ class Option(Security):
         self.print_underlying_info()
 
 
+#% test
+if __name__ == '__main__':
+    import contextlib
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+
+    # many accounts valued in a thread pool against the same accounts valued one after another; every price
+    # is in the shared cache up front, so nothing is fetched
+    useful_functions.set_offline(True)
+    rng = np.random.default_rng(7)
+    symbols = ['XIU.TO', 'ZSP.TO', 'VFV.TO']
+    info_df = pd.DataFrame({'ticker_summary': symbols, 'ticker_url': symbols, 'instrument': ['ETF'] * 3,
+                            'asset_class': ['Equity'] * 3, 'region': ['Canada', 'US', 'US']})
+    asof_date = datetime(2026, 9, 30)
+
+    def questrade_row(date, activity, action, symbol, quantity, price, net):
+        date_str = date.strftime('%Y-%m-%d %H:%M:%S') + ' AM'
+        return {'Transaction Date': date_str, 'Settlement Date': date_str, 'Action': action, 'Symbol': symbol,
+                'Description': '', 'Quantity': quantity, 'Price': price, 'Gross Amount': net, 'Commission': 0.0,
+                'Net Amount': net, 'Currency': 'CAD', 'Activity Type': activity, 'Account #': 1,
+                'Account Type': 'TFSA'}
+
+    def random_ledger():
+        inception = datetime(2020, 1, 2) + timedelta(days=int(rng.integers(0, 365)))
+        rows = [questrade_row(inception, 'Deposits', 'DEP', np.nan, 0, 0, 100000.0)]
+        for day in np.sort(rng.integers(1, 2000, 30)):
+            symbol = symbols[rng.integers(0, 3)]
+            quantity = int(rng.integers(1, 20))
+            price = float(rng.uniform(20, 60))
+            rows.append(questrade_row(inception + timedelta(days=int(day)), 'Trades', 'Buy', symbol, quantity, price,
+                                      -quantity * price))
+        return pd.DataFrame(rows)
+
+    transactions = [TransactionHistory(random_ledger(), 'questrade') for _ in range(16)]
+    price_cache = {}
+    for transaction in transactions:
+        inception = transaction.first_transaction_date.to_pydatetime()
+        for date in [asof_date] + list(useful_functions.past_dates_dict(asof_date, inception).values()):
+            price_cache[('fx', ('usdcad',), date)] = {'usdcad': 1.35}
+            for symbol in symbols:
+                price_cache[(symbol, date)] = (date, 30 + symbols.index(symbol) + date.toordinal() % 97 / 10)
+
+    def value(transaction):
+        portfolio = Portfolio(transaction=transaction, asof_date=asof_date, info_df=info_df, price_cache=price_cache)
+        portfolio.get_hist_holdings(transaction, info_df, price_cache=price_cache)
+        portfolio.measure_performance()
+        return portfolio.snapshot()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial = [value(t) for t in transactions]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            parallel = list(executor.map(value, transactions))
+    assert serial == parallel
+    assert len(set(s.holdings.market_value for s in serial)) == len(serial)
+    print('{} portfolios valued in parallel, same as serial'.format(len(parallel)))
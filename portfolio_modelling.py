@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:03:11 2026
+
+@author: Frank Shi
+
+headless runner for the account pipeline, e.g.
+
+    python -m portfolio_modelling run --config config.json --accounts tfsa,rrsp
+    python -m portfolio_modelling run --config config.json --stages value,performance,export --as-of 2026-09-30
+    python -m portfolio_modelling run --config config.json --stages income
+    python -m portfolio_modelling run --config config.json --cassette cassettes/2026-09-30.json.gz --cassette-mode record
+
+every stage pickles its result into the work folder; the first selected stage starts from the pickle of the
+earlier stage written last, and the result is passed on over stages that are not selected
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+STAGES = ['ingest', 'normalize', 'replay', 'value', 'performance', 'risk', 'attribution', 'projection', 'stress',
+          'export', 'income']
+# stages that start from an earlier stage than the one before them, e.g. income only needs the ledger
+STAGE_INPUTS = {'income': 'normalize'}
+# stages that build a new result instead of adding to the portfolio; when one is skipped there is nothing to
+# carry forward to the next stage
+BUILD_STAGES = ['ingest', 'normalize', 'replay']
+
+# how each account is normalized, mirrors interface.py; can be overridden by an 'accounts' entry in the config
+DEFAULT_ACCOUNTS = {'tfsa': {'normalize': ['inkind_transfer'], 'split_reference': False},
+                    'rrsp': {'normalize': ['inkind_transfer'], 'split_reference': False},
+                    'q_margin': {'normalize': ['inkind_transfer', 'corporate_actions', 'journalling', 'misc_symbols'],
+                                 'split_reference': True}}
+
+
+def load_config(config_filename):
+    '''
+    Purpose
+    -------
+    read the json config and resolve the folder every relative path in it is relative to
+
+    Parameters
+    ----------
+    config_filename : str
+        path to config.json
+
+    Returns
+    -------
+    a dictionary, the config with an extra 'home_dir' key
+
+    '''
+    with open(config_filename) as f:
+        config = json.load(f)
+    config['home_dir'] = os.path.dirname(os.path.abspath(config_filename))
+    if config.get('accounts') is None:
+        config['accounts'] = DEFAULT_ACCOUNTS
+    return config
+
+
+def load_info_tables(config):
+    '''
+    Purpose
+    -------
+    read the info table workbook named in the config
+
+    Parameters
+    ----------
+    config : dict
+        the output of load_config
+
+    Returns
+    -------
+    three DataFrames: general info, transfer symbol lookup and split reference
+
+    '''
+    import pandas as pd
+
+    sheetname_dict = config['info_sheetnames']
+    info_file = pd.read_excel(os.path.join(config['home_dir'], config['filenames']['info_table']), sheet_name=None)
+    info_table = info_file[sheetname_dict['general_info']]
+    symbol_lookup_table = info_file[sheetname_dict['transfer_symbol_lookup']]
+    split_reference_table = info_file[sheetname_dict['split_reference']]
+    return info_table, symbol_lookup_table, split_reference_table
+
+
+def stage_filename(work_dir, account, stage):
+    return os.path.join(work_dir, '{}_{}.pkl'.format(account, stage))
+
+
+def save_stage(work_dir, account, stage, result):
+    with open(stage_filename(work_dir, account, stage), 'wb') as f:
+        pickle.dump(result, f)
+
+
+def load_stage(work_dir, account, stage):
+    filename = stage_filename(work_dir, account, stage)
+    if not os.path.exists(filename):
+        raise FileNotFoundError('{} stage has not been run for {}, expected {}'.format(stage, account, filename))
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def load_latest_stage(work_dir, account, stage):
+    # the input of stage from the work folder: the pickle of the earlier stage written last, back to the last
+    # build stage, e.g. performance rather than a stale stress for export after a run of value,performance
+    i = STAGES.index(stage)
+    first = max(j for j in range(i) if STAGES[j] in BUILD_STAGES) if i > 0 else 0
+    candidates = [(os.path.getmtime(stage_filename(work_dir, account, s)), j, s) for (j, s) in
+                  enumerate(STAGES[first:i], start=first) if os.path.exists(stage_filename(work_dir, account, s))]
+    if len(candidates) == 0:
+        return load_stage(work_dir, account, STAGES[i - 1])
+    return load_stage(work_dir, account, max(candidates)[2])
+
+
+def run_account(config, account, stages, asof_date=None, offline=False, cassette=None):
+    '''
+    Purpose
+    -------
+    run the selected stages of the pipeline for one account
+
+    Parameters
+    ----------
+    config : dict
+        the output of load_config
+
+    account : str
+        account key, e.g. 'tfsa', used to find '<account>_transactions' and '<account>_output' in the
+        filenames section of the config
+
+    stages : list
+        stages to run, a subset of STAGES; the result of the last stage run is passed on over unselected
+        stages, and only when nothing has been computed yet is a stage's input loaded from the work folder,
+        see load_latest_stage
+
+    asof_date : datetime, optional
+        valuation date replacing now, default None
+
+    offline : bool, optional
+        if True, no network request is made and stages that need one fail, default False
+
+    cassette : tuple, optional
+        (filename, mode) of a cassette.Cassette that answers every request, default None
+
+    Returns
+    -------
+    a dictionary with the account, the stages completed and an error message if a stage failed, plus the
+    cassette coverage if there is one
+
+    '''
+    if cassette is not None:
+        from cassette import Cassette
+        with Cassette(*cassette) as c:
+            status = run_account(config, account, stages, asof_date, offline)
+        status['coverage'] = c.coverage()
+        return status
+
+    import pandas as pd
+    import useful_functions
+    from objects import TransactionHistory, Portfolio
+    from price_store import PriceStore
+
+    useful_functions.set_offline(offline)
+
+    home_dir = config['home_dir']
+    filename_dict = config['filenames']
+    account_config = config['accounts'][account]
+    work_dir = os.path.join(home_dir, config['paths'].get('work_folder', 'work'))
+    os.makedirs(work_dir, exist_ok=True)
+
+    tables = None
+    transaction = None
+    result = None
+    status = {'account': account, 'completed': [], 'error': None}
+    first_stage = min(STAGES.index(s) for s in stages)
+    last_stage = max(STAGES.index(s) for s in stages)
+
+    for stage in STAGES[first_stage:last_stage + 1]:
+        if stage not in stages:
+            if stage in BUILD_STAGES:
+                result = None
+            continue
+
+        print('{}: {}'.format(account, stage))
+        try:
+            if stage in STAGE_INPUTS:
+                result = load_stage(work_dir, account, STAGE_INPUTS[stage]) if transaction is None else transaction
+            elif (result is None) and (stage != 'ingest'):
+                result = load_latest_stage(work_dir, account, stage)
+            if (tables is None) and (stage in ['normalize', 'value', 'performance', 'risk', 'attribution', 'projection']):
+                tables = load_info_tables(config)
+
+            if stage == 'ingest':
+                # one export or a list of overlapping ones; with a 'ledger_store' in the filenames section they
+                # are appended to it and the account is read back from it, see ledger_store.LedgerStore
+                export_filenames = filename_dict['{}_transactions'.format(account)]
+                if isinstance(export_filenames, str):
+                    export_filenames = [export_filenames]
+                export_filenames = [os.path.join(home_dir, config['paths']['transaction_hist_folder'], f)
+                                    for f in export_filenames]
+                exports = [pd.read_excel(f) for f in export_filenames]
+                if filename_dict.get('ledger_store') is not None:
+                    from ledger_store import LedgerStore
+                    ledger = LedgerStore(os.path.join(home_dir, filename_dict['ledger_store']))
+                    for (f, export) in zip(export_filenames, exports):
+                        ledger.ingest(export, account, source=os.path.basename(f))
+                    result = ledger.load(account)
+                    ledger.close()
+                elif len(exports) > 1:
+                    from ledger_store import dedupe
+                    result = dedupe(exports, account)
+                else:
+                    result = exports[0]
+
+            elif stage == 'normalize':
+                info_table, symbol_lookup_table, split_reference_table = tables
+                split_reference = split_reference_table if account_config.get('split_reference') else None
+                result = TransactionHistory(result, 'questrade', split_reference_=split_reference)
+                for step in account_config['normalize']:
+                    if step == 'journalling':
+                        result.update_journalling()
+                    else:
+                        getattr(result, 'update_{}'.format(step))(symbol_lookup_table)
+                transaction = result
+
+            elif stage == 'replay':
+                transaction = result
+                result = Portfolio(transaction=transaction, asof_date=asof_date)
+
+            elif stage == 'value':
+                result.current_holdings.market_value_cad(tables[0], hist_date=asof_date)
+
+            elif stage == 'performance':
+                if transaction is None:
+                    transaction = load_stage(work_dir, account, 'normalize')
+                result.get_hist_holdings(transaction, tables[0])
+                result.measure_performance()
+
+            elif stage == 'risk':
+                if transaction is None:
+                    transaction = load_stage(work_dir, account, 'normalize')
+                store = PriceStore(os.path.join(home_dir, config['paths'].get('price_store_folder', 'prices')))
+                result.build_nav_history(transaction, store, info_df=tables[0])
+                # the cash of the same nav pass; interest needs a 'margin_rates' csv in the filenames section,
+                # see margin.load_rates
+                rate_df = None
+                if filename_dict.get('margin_rates') is not None:
+                    import margin
+                    rate_df = margin.load_rates(os.path.join(home_dir, filename_dict['margin_rates']))
+                result.measure_margin(rate_df)
+                result.measure_risk(store, benchmarks=config.get('risk_benchmarks', ['SPY', 'XIU.TO']))
+                result.measure_contribution()
+
+            elif stage == 'attribution':
+                # needs a 'benchmark_weights' csv in the filenames section, see attribution.benchmark_panel
+                if filename_dict.get('benchmark_weights') is None:
+                    print('{}: no benchmark_weights file in the config, skipping attribution'.format(account))
+                else:
+                    store = PriceStore(os.path.join(home_dir, config['paths'].get('price_store_folder', 'prices')))
+                    benchmark_df = pd.read_csv(os.path.join(home_dir, filename_dict['benchmark_weights']))
+                    result.measure_attribution(tables[0], store, benchmark_df,
+                                               by=config.get('attribution_by', ['Asset Class', 'Region', 'Currency']))
+
+            elif stage == 'projection':
+                # e.g. "projection": {"years": 20, "n_paths": 100000, "seed": 0, "workers": 4} in the config
+                store = PriceStore(os.path.join(home_dir, config['paths'].get('price_store_folder', 'prices')))
+                result.project(store, tables[0], **config.get('projection', {}))
+
+            elif stage == 'stress':
+                # needs a 'stress_scenarios' csv in the filenames section, see stress.stress_test
+                if filename_dict.get('stress_scenarios') is None:
+                    print('{}: no stress_scenarios file in the config, skipping stress'.format(account))
+                else:
+                    result.stress_test(pd.read_csv(os.path.join(home_dir, filename_dict['stress_scenarios'])))
+
+            elif stage == 'export':
+                result.output_file(os.path.join(home_dir, filename_dict['{}_output'.format(account)]),
+                                   formats=config.get('export_formats', ['xlsx', 'feather']))
+
+            elif stage == 'income':
+                # a report of its own next to the account's, e.g. tfsa_output_income.xlsx
+                import income
+                from export import write_report
+                store = PriceStore(os.path.join(home_dir, config['paths'].get('price_store_folder', 'prices')))
+                result = income.income_report(result, store, asof_date)
+                output_filename = filename_dict.get('{}_income_output'.format(account))
+                if output_filename is None:
+                    output_filename = '{}_income{}'.format(*os.path.splitext(filename_dict['{}_output'.format(account)]))
+                write_report(result, os.path.join(home_dir, output_filename),
+                             formats=config.get('export_formats', ['xlsx', 'feather']))
+
+        except Exception as e:
+            # any failure stops this account only, the other accounts still run
+            status['error'] = '{} stage failed: {}: {}'.format(stage, type(e).__name__, e)
+            print('{}: {}'.format(account, status['error']))
+            return status
+
+        if stage != 'export':
+            save_stage(work_dir, account, stage, result)
+        status['completed'].append(stage)
+
+    return status
+
+
+def run(config_filename, accounts=None, stages=None, asof_date=None, offline=False, workers=1, cassette=None):
+    '''
+    Purpose
+    -------
+    run the selected stages for every selected account, optionally fanned out across processes
+
+    Parameters
+    ----------
+    config_filename : str
+        path to config.json
+
+    accounts : list, optional
+        account keys, default None means every account in the config
+
+    stages : list, optional
+        default None means every stage
+
+    asof_date : datetime, optional
+        valuation date replacing now, default None
+
+    offline : bool, optional
+        default False
+
+    workers : int, optional
+        number of worker processes, one account per process, default 1 runs everything in this process
+
+    cassette : tuple, optional
+        (filename, mode), see run_account; only replay can be shared by several workers, default None
+
+    Returns
+    -------
+    a list of status dictionaries, one per account
+
+    '''
+    config = load_config(config_filename)
+    if accounts is None:
+        accounts = list(config['accounts'].keys())
+    if stages is None:
+        stages = STAGES
+
+    if (workers > 1) and (cassette is not None) and (cassette[1] != 'replay'):
+        raise ValueError('recording a cassette needs a single worker, every worker would overwrite it')
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_account, config, a, stages, asof_date, offline, cassette) for a in accounts]
+            statuses = []
+            for (a, f) in zip(accounts, futures):
+                # e.g. a worker process that died, which run_account cannot catch itself
+                try:
+                    statuses.append(f.result())
+                except Exception as e:
+                    statuses.append({'account': a, 'completed': [], 'error': '{}: {}'.format(type(e).__name__, e)})
+            return statuses
+    return [run_account(config, a, stages, asof_date, offline, cassette) for a in accounts]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='portfolio_modelling', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the account pipeline')
+    run_parser.add_argument('--config', default='config.json', help='path to config.json')
+    run_parser.add_argument('--accounts', default=None, help='comma separated account keys, e.g. tfsa,rrsp')
+    run_parser.add_argument('--stages', default=','.join(STAGES),
+                            help='comma separated stages out of {}'.format(','.join(STAGES)))
+    run_parser.add_argument('--as-of', dest='as_of', default=None, help='valuation date, YYYY-MM-DD')
+    run_parser.add_argument('--offline', action='store_true', help='never reach the network')
+    run_parser.add_argument('--workers', type=int, default=1, help='number of accounts run in parallel')
+    run_parser.add_argument('--cassette', default=None, help='record or replay every request with this file')
+    run_parser.add_argument('--cassette-mode', dest='cassette_mode', default='replay',
+                            choices=['replay', 'record', 'refresh'], help='default replay')
+
+    args = parser.parse_args(argv)
+    args.stages = args.stages.split(',')
+    unknown_stages = [s for s in args.stages if s not in STAGES]
+    if len(unknown_stages) > 0:
+        parser.error('unknown stages: {}'.format(', '.join(unknown_stages)))
+    if args.accounts is not None:
+        args.accounts = args.accounts.split(',')
+    if args.as_of is not None:
+        args.as_of = datetime.strptime(args.as_of, '%Y-%m-%d')
+    if (args.cassette is not None) and (args.cassette_mode != 'replay') and (args.workers > 1):
+        parser.error('--cassette-mode {} needs --workers 1'.format(args.cassette_mode))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cassette = None if args.cassette is None else (args.cassette, args.cassette_mode)
+    statuses = run(args.config, accounts=args.accounts, stages=args.stages, asof_date=args.as_of,
+                   offline=args.offline, workers=args.workers, cassette=cassette)
+    failed = [s for s in statuses if s['error'] is not None]
+    for s in statuses:
+        print('{}: completed {}{}'.format(s['account'], ', '.join(s['completed']),
+                                          '' if s['error'] is None else ', ' + s['error']))
+        if 'coverage' in s:
+            c = s['coverage']
+            print('{}: cassette answered {} of {} requests ({:.0%}), recorded {}'.format(
+                s['account'], c['hits'], c['requests'], c['hit_rate'], c['recorded']))
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
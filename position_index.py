@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 23:41:09 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+
+from objects import Holdings, Option, Security, position_history
+
+
+# numeric and descriptive columns of objects.position_history kept per event
+VALUE_COLUMNS = ['Quantity', 'Average Cost', 'Commission', 'Strike Price', 'Num Shares']
+LABEL_COLUMNS = ['Currency', 'Instrument', 'Option Underlying', 'Option Type', 'Expiration']
+
+
+class PositionIndex():
+    '''
+    the holdings of an account on any date without replaying: per symbol, the sorted dates its position
+    changed with the quantity, average cost and commission after each change, and the cash balances after
+    every day; a date, or an array of thousands of dates, is one searchsorted per symbol
+
+    a date includes every transaction on or before it, the same as Holdings(transaction=..., asof_date=date)
+    '''
+    symbols = None
+    dates = None
+    values = None
+    labels = None
+    cash_dates = None
+    cash_values = None
+    currencies = None
+
+
+    def __init__(self, position_df, cash_df):
+        '''
+        Parameters
+        ----------
+        position_df, cash_df : DataFrame
+            outputs of objects.position_history
+
+        '''
+        self.dates = {}
+        self.values = {}
+        self.labels = {}
+        position_df = position_df.assign(Date=pd.DatetimeIndex(position_df['Date']))
+        for symbol, group in position_df.groupby('Symbol', sort=True):
+            group = group.sort_values(by='Date', kind='stable')
+            self.dates[symbol] = group['Date'].values
+            self.values[symbol] = group[VALUE_COLUMNS].values.astype(float)
+            self.labels[symbol] = group[LABEL_COLUMNS].values
+        self.symbols = list(self.dates.keys())
+
+        cash_df = cash_df.sort_index(kind='stable')
+        self.cash_dates = pd.DatetimeIndex(cash_df.index).values
+        self.currencies = list(cash_df.columns)
+        self.cash_values = cash_df.fillna(0).values.astype(float)
+
+
+    @classmethod
+    def from_transaction(cls, transaction):
+        # one replay of the whole history, see objects.position_history
+        return cls(*position_history(transaction))
+
+
+    def event_positions(self, symbol, dates):
+        # row of the last change of symbol on or before each date, -1 before its first trade
+        return np.searchsorted(self.dates[symbol], dates, side='right') - 1
+
+
+    def quantities(self, dates, column='Quantity'):
+        '''
+        Purpose
+        -------
+        a date by symbol matrix of quantities, or of another column of VALUE_COLUMNS, for any number of dates
+
+        Parameters
+        ----------
+        dates : array-like
+            datetime objects, in any order
+
+        column : str, optional
+            default 'Quantity'
+
+        Returns
+        -------
+        DataFrame with dates as index and symbols as columns, 0 before a symbol's first trade
+
+        '''
+        dates = pd.DatetimeIndex(dates)
+        j = VALUE_COLUMNS.index(column)
+        matrix = np.zeros((len(dates), len(self.symbols)))
+        for (k, symbol) in enumerate(self.symbols):
+            rows = self.event_positions(symbol, dates.values)
+            matrix[:, k] = np.where(rows >= 0, self.values[symbol][rows.clip(min=0), j], 0)
+        return pd.DataFrame(matrix, index=dates, columns=self.symbols)
+
+
+    def cash(self, dates):
+        # cash balance of every currency on each date, 0 before the first transaction
+        dates = pd.DatetimeIndex(dates)
+        rows = np.searchsorted(self.cash_dates, dates.values, side='right') - 1
+        balances = np.where((rows >= 0)[:, None], self.cash_values[rows.clip(min=0)], 0)
+        return pd.DataFrame(balances, index=dates, columns=self.currencies)
+
+
+    def positions(self, date):
+        '''
+        Purpose
+        -------
+        every position held on date, without prices
+
+        Parameters
+        ----------
+        date : datetime
+
+        Returns
+        -------
+        DataFrame with one row per symbol held: 'Symbol', the columns of LABEL_COLUMNS and VALUE_COLUMNS, and
+        'Book Cost'
+
+        '''
+        date = np.datetime64(pd.Timestamp(date))
+        rows = []
+        for symbol in self.symbols:
+            i = self.event_positions(symbol, date)
+            if (i >= 0) and (self.values[symbol][i, 0] != 0):
+                rows.append([symbol] + list(self.labels[symbol][i]) + list(self.values[symbol][i]))
+        df = pd.DataFrame(rows, columns=['Symbol'] + LABEL_COLUMNS + VALUE_COLUMNS)
+        df['Book Cost'] = df['Quantity'] * df['Average Cost']
+        return df
+
+
+    def holdings(self, date):
+        '''
+        Purpose
+        -------
+        a Holdings on date, ready for market_value_cad; lots are not kept in the index, so lots_df is empty
+
+        '''
+        security_dict = {}
+        for row in self.positions(date).to_dict('records'):
+            if row['Instrument'] == 'Option':
+                sec = Option(row['Symbol'], row['Currency'], row['Option Type'], row['Option Underlying'],
+                             row['Expiration'], row['Strike Price'])
+                sec.num_shares = row['Num Shares']
+            else:
+                sec = Security(row['Symbol'], row['Currency'], row['Instrument'])
+            sec.quantity = row['Quantity']
+            sec.average_cost = row['Average Cost']
+            sec.commission = row['Commission']
+            security_dict[row['Symbol']] = sec
+        cash_dict = self.cash([date]).iloc[0].to_dict()
+        return Holdings(security_dict=security_dict, cash_dict=cash_dict, asof_date=pd.Timestamp(date).to_pydatetime())
+
+
+#% test
+if __name__ == '__main__':
+    import time
+    from datetime import datetime, timedelta
+    import useful_functions
+    from objects import TransactionHistory
+
+    # point in time holdings against a full replay up to each date
+    useful_functions.set_offline(True)
+    rng = np.random.default_rng(3)
+    symbols = ['XIU.TO', 'ZSP.TO', 'VFV.TO', 'XEQT.TO']
+    rows = []
+    held = {s: 0 for s in symbols}
+    for day in np.sort(rng.integers(0, 2500, 400)):
+        date_str = (datetime(2019, 1, 2) + timedelta(days=int(day))).strftime('%Y-%m-%d %H:%M:%S') + ' AM'
+        symbol = symbols[rng.integers(0, len(symbols))]
+        quantity = int(rng.integers(1, 50)) * (1 if (held[symbol] == 0) or (rng.random() < 0.6) else -1)
+        quantity = max(quantity, -held[symbol])
+        held[symbol] += quantity
+        price = float(rng.uniform(20, 60))
+        rows.append({'Transaction Date': date_str, 'Settlement Date': date_str,
+                     'Action': 'Buy' if quantity > 0 else 'Sell', 'Symbol': symbol, 'Description': '',
+                     'Quantity': quantity, 'Price': price, 'Gross Amount': -quantity * price, 'Commission': -4.95,
+                     'Net Amount': -quantity * price - 4.95, 'Currency': 'CAD', 'Activity Type': 'Trades',
+                     'Account #': 1, 'Account Type': 'TFSA'})
+    transaction = TransactionHistory(pd.DataFrame(rows), 'questrade')
+
+    index = PositionIndex.from_transaction(transaction)
+    for date in pd.to_datetime(['2019-01-01', '2020-06-30', '2022-02-15', '2025-12-31']):
+        replayed = Holdings(transaction=transaction, asof_date=date)
+        expected = {sec.symbol: (sec.quantity, sec.average_cost) for sec in replayed.security_list if sec.quantity != 0}
+        positions = index.positions(date)
+        assert expected == dict(zip(positions['Symbol'], zip(positions['Quantity'], positions['Average Cost'])))
+        assert np.isclose(replayed.cash_dict['CAD'], index.cash([date])['CAD'].iloc[0])
+        holdings = index.holdings(date)
+        assert {sec.symbol: (sec.quantity, sec.average_cost) for sec in holdings.security_list} == expected
+
+    dates = pd.bdate_range('2019-01-01', '2026-10-16')
+    t = time.perf_counter()
+    quantity = index.quantities(dates)
+    print('{} dates x {} symbols in {:.4f}s'.format(len(dates), len(index.symbols), time.perf_counter() - t))
+    assert (quantity.iloc[-1] == pd.Series(held)[quantity.columns]).all()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:02:18 2026
+
+@author: Frank Shi
+"""
+import os
+import pandas as pd
+from datetime import timedelta
+
+import useful_functions
+
+
+# the first and last date already asked for of every symbol, next to its csv, see PriceStore.covered_range
+COVERAGE_FILENAME = 'coverage.csv'
+
+
+class PriceStore():
+    '''
+    daily closing prices kept on disk, one csv per yahoo finance symbol; only the days missing from the
+    file are ever fetched
+
+    the dates asked for are kept too, so a range that came back empty, e.g. before a symbol was listed or
+    a holiday at either end, is not asked for again
+    '''
+    folder = ''
+    histories = None
+    coverage = None
+
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.histories = {}
+        os.makedirs(folder, exist_ok=True)
+        self.coverage = {}
+        if os.path.exists(self.coverage_filename()):
+            df = pd.read_csv(self.coverage_filename(), parse_dates=['Covered From', 'Covered To'])
+            self.coverage = {s: (a, b) for (s, a, b) in zip(df['Symbol'], df['Covered From'], df['Covered To'])}
+
+
+    def filename(self, symbol):
+        return os.path.join(self.folder, '{}.csv'.format(symbol.replace('=', '_')))
+
+
+    def coverage_filename(self):
+        return os.path.join(self.folder, COVERAGE_FILENAME)
+
+
+    def load(self, symbol):
+        if symbol not in self.histories:
+            if os.path.exists(self.filename(symbol)):
+                self.histories[symbol] = pd.read_csv(self.filename(symbol), index_col='Date', parse_dates=['Date'])
+            else:
+                self.histories[symbol] = pd.DataFrame(columns=['Close', 'Adj Close'],
+                                                      index=pd.DatetimeIndex([], name='Date'), dtype=float)
+        return self.histories[symbol]
+
+
+    def covered_range(self, symbol):
+        # the first and last date of symbol on disk or already asked for, None if neither
+        df = self.load(symbol)
+        bounds = [self.coverage[symbol]] if symbol in self.coverage else []
+        if len(df) > 0:
+            bounds.append((df.index.min(), df.index.max()))
+        if len(bounds) == 0:
+            return None
+        return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+
+    def missing_ranges(self, symbol, start, end):
+        # the (start, end) ranges neither the local file nor an earlier request covers; there is no close to
+        # fetch on a weekend, so a range is compared by the business days it spans
+        covered = self.covered_range(symbol)
+        missing = []
+        if covered is None:
+            missing.append((start, end))
+        else:
+            first_close = pd.offsets.BDay().rollforward(pd.Timestamp(start).normalize())
+            last_close = pd.offsets.BDay().rollback(pd.Timestamp(end).normalize())
+            if first_close < covered[0]:
+                missing.append((start, covered[0] - timedelta(days=1)))
+            if last_close > covered[1]:
+                missing.append((covered[1] + timedelta(days=1), end))
+        return missing
+
+
+    def merge(self, symbol, fetched, answered=()):
+        '''
+        Purpose
+        -------
+        add fetched histories to the local file, and the (start, end) ranges the provider answered, with or
+        without a close, to the coverage; today is never covered, its close may still come
+
+        '''
+        if len(fetched) > 0:
+            df = pd.concat([self.load(symbol)] + fetched)
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+            self.histories[symbol] = df
+            df.to_csv(self.filename(symbol))
+
+        yesterday = pd.Timestamp.today().normalize() - timedelta(days=1)
+        answered = [(pd.Timestamp(a), min(pd.Timestamp(b), yesterday)) for (a, b) in answered]
+        answered = [(a, b) for (a, b) in answered if a <= b]
+        if len(answered) > 0:
+            bounds = answered + ([self.coverage[symbol]] if symbol in self.coverage else [])
+            self.coverage[symbol] = (min(b[0] for b in bounds), max(b[1] for b in bounds))
+            pd.DataFrame([(s, a, b) for (s, (a, b)) in self.coverage.items()],
+                         columns=['Symbol', 'Covered From', 'Covered To']).to_csv(self.coverage_filename(),
+                                                                                  index=False)
+
+
+    def prefetch(self, symbols, start, end):
+        '''
+        Purpose
+        -------
+        fetch whatever the local files do not cover for many symbols at once, through the shared
+        market_data client, so that the following history calls only read from disk
+
+        Parameters
+        ----------
+        symbols : list
+            yahoo finance symbols
+
+        start, end : datetime
+
+        Returns
+        -------
+        None.
+
+        '''
+        start = pd.Timestamp(start).normalize()
+        end = pd.Timestamp(end).normalize()
+        ranges = [(s, a, b) for s in symbols for (a, b) in self.missing_ranges(s, start, end)]
+        if len(ranges) == 0:
+            return
+        print('fetching {} ranges of {} symbols'.format(len(ranges), len(set(r[0] for r in ranges))))
+        from market_data import client
+        results = client().run(client().histories(ranges))
+        for symbol in dict.fromkeys(r[0] for r in ranges):
+            fetched = []
+            answered = []
+            for r in ranges:
+                if r[0] != symbol:
+                    continue
+                if isinstance(results[r], Exception):
+                    # offline, or no trading in the range; use what is on disk
+                    print('could not fetch {}: {}'.format(symbol, results[r]))
+                    if isinstance(results[r], IndexError):
+                        answered.append(r[1:])
+                else:
+                    fetched.append(results[r])
+                    answered.append(r[1:])
+            self.merge(symbol, fetched, answered)
+
+
+    def history(self, symbol, start, end, column='Close', fetch=True):
+        '''
+        Purpose
+        -------
+        daily prices of symbol between start and end, fetching whatever the local file does not cover
+
+        Parameters
+        ----------
+        symbol : str
+            yahoo finance symbol, e.g. 'XIU.TO', 'SPY' or 'CAD=X'
+
+        start, end : datetime
+
+        column : str, optional
+            'Close' (split-adjusted) or 'Adj Close' (split and dividend adjusted), default 'Close'
+
+        fetch : bool, optional
+            if False, only what is on disk is returned, e.g. after prefetch, default True
+
+        Returns
+        -------
+        Series indexed by date
+
+        '''
+        start = pd.Timestamp(start).normalize()
+        end = pd.Timestamp(end).normalize()
+        missing = self.missing_ranges(symbol, start, end) if fetch else []
+
+        if len(missing) > 0:
+            fetched = []
+            answered = []
+            for (fetch_start, fetch_end) in missing:
+                print('fetching {} from {} to {}'.format(symbol, fetch_start.strftime('%Y-%m-%d'),
+                                                         fetch_end.strftime('%Y-%m-%d')))
+                try:
+                    fetched.append(useful_functions.get_price_history(symbol, fetch_start, fetch_end))
+                    answered.append((fetch_start, fetch_end))
+                except IndexError as e:
+                    # no trading in the range
+                    print('could not fetch {}: {}'.format(symbol, e))
+                    answered.append((fetch_start, fetch_end))
+                except ConnectionError as e:
+                    # offline; use what is on disk
+                    print('could not fetch {}: {}'.format(symbol, e))
+            self.merge(symbol, fetched, answered)
+
+        df = self.load(symbol)
+        return df.loc[(df.index >= start) & (df.index <= end), column]
+
+
+    def price_matrix(self, symbols, dates, column='Close'):
+        '''
+        Purpose
+        -------
+        a dense date by symbol matrix of prices, carrying the last close forward over holidays
+
+        Parameters
+        ----------
+        symbols : list
+            yahoo finance symbols
+
+        dates : DatetimeIndex
+            the rows of the matrix
+
+        column : str, optional
+            default 'Close'
+
+        Returns
+        -------
+        DataFrame with dates as index and symbols as columns
+
+        '''
+        dates = pd.DatetimeIndex(dates)
+        # a week of look back so that the first rows have a close to carry forward
+        start = dates.min() - timedelta(days=7)
+        self.prefetch(symbols, start, dates.max())
+        matrix = {}
+        for symbol in symbols:
+            series = self.history(symbol, start, dates.max(), column=column, fetch=False)
+            matrix[symbol] = series.reindex(series.index.union(dates)).ffill().reindex(dates)
+        return pd.DataFrame(matrix, index=dates)
+
+
+#% test
+if __name__ == '__main__':
+    import tempfile
+    import numpy as np
+
+    # a provider that lists NEW on 2026-03-02 and counts the requests
+    requests = []
+
+    def get_price_history(symbol, start, end):
+        requests.append((symbol, start, end))
+        dates = pd.bdate_range(max(start, pd.Timestamp('2026-03-02')), end, name='Date')
+        if len(dates) == 0:
+            raise IndexError('no prices of {} in the range'.format(symbol))
+        close = np.arange(len(dates), dtype=float)
+        return pd.DataFrame({'Close': close, 'Adj Close': close}, index=dates)
+
+    useful_functions.get_price_history = get_price_history
+    folder = tempfile.mkdtemp()
+    store = PriceStore(folder)
+    start, end = pd.Timestamp('2026-01-01'), pd.Timestamp('2026-04-30')
+    history = store.history('NEW', start, end)
+    assert (len(requests) == 1) and (history.index.min() == pd.Timestamp('2026-03-02'))
+
+    # listed after start, and start is a holiday: nothing is asked for again, in this run or the next
+    store.history('NEW', start, end)
+    assert len(requests) == 1
+    assert PriceStore(folder).missing_ranges('NEW', start, end) == []
+
+    # only the days past the covered range are fetched
+    store = PriceStore(folder)
+    store.history('NEW', start, pd.Timestamp('2026-05-29'))
+    assert requests[-1][1:] == (pd.Timestamp('2026-05-01'), pd.Timestamp('2026-05-29'))
+
+    # a range that came back empty is covered, one that could not be fetched is not
+    def offline(symbol, start, end):
+        raise ConnectionError('offline mode')
+
+    useful_functions.get_price_history = offline
+    store.history('OLD', start, end)
+    assert store.missing_ranges('OLD', start, end) == [(start, end)]
+    assert not os.path.exists(store.filename('OLD'))
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:02:51 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from fx import FXMatrix
+from nav import ticker_urls
+
+
+PERCENTILES = [5, 25, 50, 75, 95]
+# the simulation steps monthly
+DAYS_PER_STEP = 21
+# resolution of the value histograms, see simulate_chunk
+N_BINS = 4000
+
+
+def holdings_weights(holdings_df, info_df=None, symbol_col='ticker_summary'):
+    '''
+    Purpose
+    -------
+    weight of every yahoo finance symbol in an account; options count as their underlying, foreign cash as
+    its currency code, e.g. 'USD', whose only risk is its rate to cad, and cad cash as a riskless 'CAD'
+
+    Parameters
+    ----------
+    holdings_df : DataFrame
+        output of Holdings.to_df, after market_value_cad
+
+    info_df : DataFrame, optional
+        the info table, to map symbols to yahoo finance symbols, default None
+
+    Returns
+    -------
+    two objects: Series of weights indexed by yahoo finance symbol, and a dictionary of symbol to currency
+
+    '''
+    df = holdings_df.copy()
+    is_option = (df['Instrument'] == 'Option').values
+    df['Exposure'] = np.where(is_option, df['Option Underlying'], df['Symbol'])
+    urls = ticker_urls(info_df, set(df.loc[df['Instrument'] != 'Cash', 'Exposure']), symbol_col)
+    df['Exposure'] = [urls.get(s, s) for s in df['Exposure']]
+    is_cash = (df['Instrument'] == 'Cash').values
+    df.loc[is_cash, 'Exposure'] = df.loc[is_cash, 'Currency']
+
+    weights = df.groupby('Exposure')['Market Value CAD'].sum()
+    weights = weights / weights.sum()
+    currencies = df.groupby('Exposure')['Currency'].first().to_dict()
+    return weights, currencies
+
+
+def estimate_moments(store, symbols, currencies, end_date, years=5):
+    '''
+    Purpose
+    -------
+    mean and covariance of monthly log returns in cad, from daily prices in the price store
+
+    Parameters
+    ----------
+    store : PriceStore
+
+    symbols : list
+        yahoo finance symbols, the risky assets
+
+    currencies : dict
+        currency of every symbol; prices are converted with the rate to cad of the same day, and a symbol
+        that is its own currency, i.e. foreign cash, has a local price of 1
+
+    end_date : datetime
+
+    years : int, optional
+        length of the price history used, default 5
+
+    Returns
+    -------
+    two numpy arrays, the mean vector and the covariance matrix
+
+    '''
+    dates = pd.bdate_range(pd.Timestamp(end_date) - pd.DateOffset(years=years), end_date)
+    symbol_currencies = [currencies.get(s, 'CAD') for s in symbols]
+    is_cash = np.array([s == c for (s, c) in zip(symbols, symbol_currencies)], dtype=bool)
+    traded = [s for (s, c) in zip(symbols, is_cash) if not c]
+    prices = np.ones((len(dates), len(symbols)))
+    if len(traded) > 0:
+        prices[:, ~is_cash] = store.price_matrix(traded, dates).values
+    fx_matrix = FXMatrix.from_store(store, set(symbol_currencies) | {'CAD'}, dates)
+    prices_cad = prices * fx_matrix.columns(symbol_currencies)
+
+    log_returns = np.diff(np.log(prices_cad), axis=0)
+    log_returns = log_returns[np.isfinite(log_returns).all(axis=1)]
+    mu = log_returns.mean(axis=0) * DAYS_PER_STEP
+    cov = np.atleast_2d(np.cov(log_returns, rowvar=False)) * DAYS_PER_STEP
+    return mu, cov
+
+
+def contribution_schedule(cash_flows_df, step_dates, years=5, date_col='Transaction Date', amount_col='Net Amount'):
+    '''
+    Purpose
+    -------
+    planned contributions and withdrawals of every step, assuming each calendar month repeats its average
+    net external cash flow over the last few years, e.g. a january tfsa deposit recurs every january
+
+    Parameters
+    ----------
+    cash_flows_df : DataFrame
+        e.g. Portfolio.external_cash_flow_df, in cad
+
+    step_dates : DatetimeIndex
+        month end of every step
+
+    years : int, optional
+        length of the cash flow history used, default 5 like the price history of estimate_moments
+
+    Returns
+    -------
+    numpy array, one amount per step
+
+    '''
+    if (cash_flows_df is None) or (len(cash_flows_df) == 0):
+        return np.zeros(len(step_dates))
+    flows = cash_flows_df.set_index(pd.DatetimeIndex(cash_flows_df[date_col]))[amount_col]
+    last = flows.index.max()
+    flows = flows[flows.index > last - pd.DateOffset(years=years)]
+    n_years = max((flows.index.max() - flows.index.min()).days / 365.25, 1)
+    by_month = flows.groupby(flows.index.month).sum() / n_years
+    return by_month.reindex(pd.DatetimeIndex(step_dates).month, fill_value=0).values
+
+
+def simulate_chunk(args):
+    '''
+    Purpose
+    -------
+    simulate one chunk of paths and reduce it to a histogram of log value per step, so that memory does not
+    grow with the number of paths; top level so that it can run in a worker process
+
+    Parameters
+    ----------
+    args : tuple
+        (seed sequence, number of paths, starting value, weights of the risky assets, mean vector, cholesky
+        factor of the covariance, contributions per step, log value bin edges)
+
+    Returns
+    -------
+    two numpy arrays: counts of shape (steps, bins + 1), the first column counting depleted paths, and the
+    sum of the values of every step
+
+    '''
+    seed, n_paths, value0, weights, mu, chol, contributions, edges = args
+    rng = np.random.default_rng(seed)
+    n_steps = len(contributions)
+
+    # (path x step x asset) log returns, portfolio rebalanced to the same weights every step
+    z = rng.standard_normal((n_paths, n_steps, len(mu)))
+    asset_returns = np.expm1(mu + z @ chol.T)
+    portfolio_returns = asset_returns @ weights
+
+    values = np.empty((n_paths, n_steps))
+    v = np.full(n_paths, float(value0))
+    for t in range(n_steps):
+        v = np.maximum(v * (1 + portfolio_returns[:, t]) + contributions[t], 0)
+        values[:, t] = v
+
+    counts = np.zeros((n_steps, len(edges)), dtype=np.int64)
+    with np.errstate(divide='ignore'):
+        bins = np.clip(np.searchsorted(edges, np.log(values), side='right'), 1, len(edges) - 1)
+    bins[values <= 0] = 0
+    for t in range(n_steps):
+        counts[t] = np.bincount(bins[:, t], minlength=len(edges))
+    return counts, values.sum(axis=0)
+
+
+def histogram_percentiles(counts, edges, percentiles):
+    # percentiles of every row of counts, interpolated in log value within a bin; depleted paths are 0
+    answer = np.zeros((counts.shape[0], len(percentiles)))
+    cum = np.cumsum(counts, axis=1)
+    total = cum[:, -1]
+    for j, q in enumerate(percentiles):
+        target = total * q / 100
+        idx = np.array([np.searchsorted(cum[t], target[t]) for t in range(len(total))])
+        below = cum[np.arange(len(total)), idx - 1]
+        frac = (target - below) / np.maximum(counts[np.arange(len(total)), idx], 1)
+        lower = edges[np.clip(idx - 1, 0, len(edges) - 1)]
+        upper = edges[np.clip(idx, 0, len(edges) - 1)]
+        answer[:, j] = np.where(idx == 0, 0, np.exp(lower + frac * (upper - lower)))
+    return answer
+
+
+def project(value0, weights, mu, cov, contributions, step_dates, n_paths=10000, seed=0, workers=1,
+            max_chunk_bytes=64 * 2 ** 20, start_date=None):
+    '''
+    Purpose
+    -------
+    monte carlo projection of portfolio value with contributions and withdrawals, reported as percentile
+    bands per step
+
+    Parameters
+    ----------
+    value0 : float
+        market value today in cad
+
+    weights : array-like
+        weights of the risky assets, in the order of mu; whatever is left of 1 is cad cash earning nothing
+
+    mu, cov : numpy arrays
+        mean and covariance of monthly log returns, see estimate_moments
+
+    contributions : array-like
+        net cash flow of every step, see contribution_schedule
+
+    step_dates : DatetimeIndex
+        date of every step
+
+    n_paths : int, optional
+        default 10000
+
+    seed : int, optional
+        paths are split into chunks, each with its own seed spawned from this one, so the result is the same
+        for any number of workers, default 0
+
+    workers : int, optional
+        number of worker processes, default 1 runs every chunk in this process
+
+    max_chunk_bytes : int, optional
+        memory cap of the random numbers of a chunk, default 64MB
+
+    start_date : datetime, optional
+        date of value0, the first row, default None for the month end before the first step
+
+    Returns
+    -------
+    DataFrame with one row per step: 'Date', percentile columns such as 'P50', 'Mean', 'Depleted' (share
+    of paths at 0) and 'Cumulative Contributions'
+
+    '''
+    weights = np.asarray(weights, dtype=float)
+    contributions = np.asarray(contributions, dtype=float)
+    n_steps = len(contributions)
+    # a tiny jitter keeps the cholesky factor defined for perfectly correlated assets, e.g. two share classes
+    chol = np.linalg.cholesky(cov + np.eye(len(mu)) * 1e-12)
+
+    # one set of log value bins shared by every chunk, wide enough that clipping at the ends is rare
+    top = np.log(max(value0 + contributions.clip(min=0).sum(), 1))
+    spread = 8 * np.sqrt(max(weights @ cov @ weights, 1e-8) * n_steps) + abs(weights @ mu) * n_steps
+    edges = np.linspace(0, top + max(spread, 3), N_BINS)
+
+    chunk_size = max(1, min(n_paths, int(max_chunk_bytes / (8 * n_steps * max(len(mu), 1)))))
+    sizes = [chunk_size] * (n_paths // chunk_size)
+    if n_paths % chunk_size > 0:
+        sizes.append(n_paths % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    chunk_args = [(s, n, value0, weights, mu, chol, contributions, edges) for (s, n) in zip(seeds, sizes)]
+    print('projecting {} paths over {} steps in {} chunks'.format(n_paths, n_steps, len(sizes)))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(simulate_chunk, chunk_args))
+    else:
+        results = [simulate_chunk(a) for a in chunk_args]
+    counts = sum(r[0] for r in results)
+    sums = sum(r[1] for r in results)
+
+    df = pd.DataFrame(histogram_percentiles(counts, edges, PERCENTILES),
+                      columns=['P{}'.format(q) for q in PERCENTILES])
+    df.insert(0, 'Date', pd.DatetimeIndex(step_dates))
+    df['Mean'] = sums / n_paths
+    df['Depleted'] = counts[:, 0] / n_paths
+    df['Cumulative Contributions'] = np.cumsum(contributions)
+    if start_date is None:
+        start_date = pd.DatetimeIndex(step_dates)[0] - pd.offsets.MonthEnd()
+    start = pd.DataFrame({'Date': [pd.Timestamp(start_date)], 'Mean': [value0],
+                          'Depleted': [0.0], 'Cumulative Contributions': [0.0]})
+    for q in PERCENTILES:
+        start['P{}'.format(q)] = value0
+    return pd.concat([start, df], ignore_index=True)[df.columns]
+
+
+#% test
+if __name__ == '__main__':
+    import time
+    mu = np.array([0.006, 0.004, 0.001])
+    vol = np.array([0.045, 0.035, 0.02])
+    corr = np.array([[1, 0.7, 0.1], [0.7, 1, 0.2], [0.1, 0.2, 1]])
+    cov = corr * np.outer(vol, vol)
+    weights = np.array([0.5, 0.3, 0.1])
+    dates = pd.date_range('2026-10-31', periods=120, freq=pd.offsets.MonthEnd())
+    contributions = np.where(dates.month == 1, 7000, 0)
+
+    t = time.perf_counter()
+    df = project(100000, weights, mu, cov, contributions, dates, n_paths=200000, seed=1, max_chunk_bytes=8 * 2 ** 20)
+    print('{:.2f}s'.format(time.perf_counter() - t))
+    print(df.iloc[[0, 12, 60, 120]])
+
+    # the histogram median against the exact median of the same paths
+    seeds = np.random.SeedSequence(1).spawn(1)
+    chol = np.linalg.cholesky(cov + np.eye(3) * 1e-12)
+    edges = np.linspace(0, 20, N_BINS)
+    rng = np.random.default_rng(seeds[0])
+    z = rng.standard_normal((5000, 120, 3))
+    r = np.expm1(mu + z @ chol.T) @ weights
+    v = np.full(5000, 100000.0)
+    for step in range(120):
+        v = np.maximum(v * (1 + r[:, step]) + contributions[step], 0)
+    counts, _ = simulate_chunk((seeds[0], 5000, 100000, weights, mu, chol, contributions, edges))
+    assert abs(histogram_percentiles(counts, edges, [50])[-1, 0] / np.median(v) - 1) < 0.01
+
+    # same seed, same answer, whatever the number of workers
+    a = project(100000, weights, mu, cov, contributions, dates, n_paths=20000, seed=3, max_chunk_bytes=2 ** 20)
+    b = project(100000, weights, mu, cov, contributions, dates, n_paths=20000, seed=3, max_chunk_bytes=2 ** 20, workers=2)
+    assert np.allclose(a['P50'].values, b['P50'].values)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:02:33 2026
+
+@author: Frank Shi
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import useful_functions
+from fx import legs_needed, leg_symbol
+from nav import ticker_urls
+
+
+class QuoteCache():
+    '''
+    latest quotes in memory, each valid for ttl seconds after it was fetched; past max_size entries the least
+    recently used one is dropped
+    '''
+    ttl = 60
+    max_size = 1000
+    entries = None
+    lock = None
+
+
+    def __init__(self, ttl=60, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, symbol, allow_stale=False):
+        '''
+        Returns
+        -------
+        (quote time, price) of symbol, or None if it is not cached or has expired and allow_stale is False
+
+        '''
+        with self.lock:
+            entry = self.entries.get(symbol)
+            if entry is None:
+                return None
+            self.entries.move_to_end(symbol)
+            fetched_at, quote_time, price = entry
+            if (not allow_stale) and (time.monotonic() - fetched_at > self.ttl):
+                return None
+            return quote_time, price
+
+
+    def put(self, symbol, quote_time, price):
+        with self.lock:
+            self.entries[symbol] = (time.monotonic(), quote_time, price)
+            self.entries.move_to_end(symbol)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+    def stale(self, symbols):
+        # the symbols that are not cached or have expired, i.e. the ones to fetch
+        now = time.monotonic()
+        with self.lock:
+            return [s for s in symbols if (s not in self.entries) or (now - self.entries[s][0] > self.ttl)]
+
+
+class QuoteService():
+    '''
+    polls the distinct quote symbols of every account on an interval and keeps each account's nav up to date
+    incrementally: a new quote only revalues the positions that depend on it, including every foreign position
+    when the usd leg of its currency or of cad moves
+
+    readers, e.g. dashboard refreshes, call nav and quote, which only read memory
+    '''
+    symbols = None
+    accounts = None
+    cache = None
+    interval = 30
+    max_workers = 8
+    fetch = None
+    prices = None
+    position_values = None
+    account_nav = None
+
+
+    def __init__(self, holdings_df_dict, info_df=None, interval=30, ttl=60, max_size=1000, max_workers=8,
+                 fetch=None, symbol_col='ticker_summary'):
+        '''
+        Parameters
+        ----------
+        holdings_df_dict : dict
+            account names as keys and Holdings.to_df outputs, or 'Current Holdings' sheets, as values
+
+        info_df : DataFrame, optional
+            the info table, to map symbols to yahoo finance symbols, default None
+
+        interval : float, optional
+            seconds between polls, default 30
+
+        ttl, max_size : optional
+            see QuoteCache
+
+        max_workers : int, optional
+            most quotes fetched at the same time, default 8
+
+        fetch : function, optional
+            symbol to (quote time, price), default None for useful_functions.get_last_price
+
+        '''
+        import pandas as pd
+
+        self.interval = interval
+        self.max_workers = max_workers
+        self.fetch = useful_functions.get_last_price if fetch is None else fetch
+        self.cache = QuoteCache(ttl=ttl, max_size=max_size)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        df = pd.concat([d.assign(Account=a) for (a, d) in holdings_df_dict.items()], ignore_index=True)
+        self.accounts = list(holdings_df_dict.keys())
+        is_option = (df['Instrument'] == 'Option').values
+        is_cash = (df['Instrument'] == 'Cash').values
+        quoted = np.where(is_option, df['Option Underlying'], df['Symbol'])
+        urls = ticker_urls(info_df, set(quoted[~is_cash]), symbol_col)
+        quote_symbol = np.array([None if c else urls[q] for (q, c) in zip(quoted, is_cash)], dtype=object)
+
+        # the usd leg of every currency held, a cross is cad per usd over currency per usd like fx.FXMatrix
+        currencies = df['Currency'].fillna('CAD').values
+        legs = legs_needed(set(currencies), 'CAD')
+        self.symbols = sorted(set(quote_symbol[~is_cash]) | set(leg_symbol(c) for c in legs))
+        symbol_pos = {s: i for (i, s) in enumerate(self.symbols)}
+        leg_pos = {c: symbol_pos[leg_symbol(c)] for c in legs}
+
+        # one entry per position, everything the value needs as arrays
+        self.account_idx = np.array([self.accounts.index(a) for a in df['Account']])
+        self.quantity = df['Quantity'].values.astype(float)
+        self.quote_idx = np.array([-1 if q is None else symbol_pos[q] for q in quote_symbol])
+        is_foreign = currencies != 'CAD'
+        self.fx_idx = np.where(is_foreign, leg_pos.get('CAD', -1), -1)
+        self.ccy_idx = np.array([leg_pos.get(c, -1) if f else -1 for (c, f) in zip(currencies, is_foreign)])
+        self.is_option = is_option
+        self.is_call = (df['Option Type'] == 'Call').values
+        self.strike = df['Strike Price'].fillna(0).values.astype(float)
+        num_shares = df['Num Shares'] if 'Num Shares' in df.columns else pd.Series(100, index=df.index)
+        self.num_shares = num_shares.fillna(100).values.astype(float)
+        self.position_symbols = df['Symbol'].values
+
+        # positions depending on each symbol, directly or through the fx rate
+        self.dependents = {i: np.flatnonzero((self.quote_idx == i) | (self.fx_idx == i) | (self.ccy_idx == i))
+                           for i in range(len(self.symbols))}
+
+        self.prices = np.full(len(self.symbols), np.nan)
+        self.position_values = np.zeros(len(df))
+        self.account_nav = np.zeros(len(self.accounts))
+        self.revalue(np.arange(len(df)))
+
+
+    def values_of(self, positions):
+        # cad value of some positions at the current prices; positions missing a quote are worth 0 for now
+        local = np.where(self.quote_idx[positions] >= 0, self.prices[self.quote_idx[positions]], 1)
+        intrinsic = np.where(self.is_call[positions], local - self.strike[positions],
+                             self.strike[positions] - local).clip(min=0) * self.num_shares[positions]
+        local = np.where(self.is_option[positions], intrinsic, local)
+        fx = (np.where(self.fx_idx[positions] >= 0, self.prices[self.fx_idx[positions]], 1) /
+              np.where(self.ccy_idx[positions] >= 0, self.prices[self.ccy_idx[positions]], 1))
+        return np.nan_to_num(self.quantity[positions] * local * fx)
+
+
+    def revalue(self, positions):
+        # only the change of the revalued positions goes into each account's nav
+        with self.lock:
+            new_values = self.values_of(positions)
+            delta = new_values - self.position_values[positions]
+            self.position_values[positions] = new_values
+            self.account_nav += np.bincount(self.account_idx[positions], weights=delta, minlength=len(self.accounts))
+
+
+    def apply_quotes(self, quotes):
+        '''
+        Purpose
+        -------
+        store new quotes and revalue the positions affected by the ones whose price changed
+
+        Parameters
+        ----------
+        quotes : dict
+            symbol as keys and (quote time, price) as values
+
+        Returns
+        -------
+        the number of positions revalued
+
+        '''
+        changed = []
+        for (symbol, (quote_time, price)) in quotes.items():
+            self.cache.put(symbol, quote_time, price)
+            i = self.symbols.index(symbol)
+            if self.prices[i] != price:
+                self.prices[i] = price
+                changed.append(i)
+        if len(changed) == 0:
+            return 0
+        positions = np.unique(np.concatenate([self.dependents[i] for i in changed]))
+        self.revalue(positions)
+        return len(positions)
+
+
+    def fetch_one(self, symbol):
+        try:
+            return symbol, self.fetch(symbol)
+        except Exception as e:
+            # a failed quote keeps the last price, the next poll tries again
+            print('could not fetch {}: {}'.format(symbol, e))
+            return symbol, None
+
+
+    def poll_once(self):
+        # fetch every expired quote, at most max_workers at a time
+        stale = self.cache.stale(self.symbols)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self.fetch_one, stale))
+        return self.apply_quotes({s: q for (s, q) in results if q is not None})
+
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.poll_once()
+            self.stop_event.wait(self.interval)
+
+
+    def start(self):
+        # poll in a background thread until stop is called
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+    def nav(self):
+        # market value in cad of every account from memory
+        with self.lock:
+            return dict(zip(self.accounts, self.account_nav.copy()))
+
+
+    def quote(self, symbol):
+        return self.cache.get(symbol, allow_stale=True)
+
+
+    def missing_quotes(self):
+        return [s for (i, s) in enumerate(self.symbols) if np.isnan(self.prices[i])]
+
+
+def serve_quotes(prices, host='127.0.0.1', port=0):
+    '''
+    Purpose
+    -------
+    a local stand-in for the yahoo finance quote page that useful_functions.get_last_price scrapes, for
+    testing; point useful_functions.YAHOO_BASE_URL at the returned url
+
+    Parameters
+    ----------
+    prices : dict
+        symbol as keys and price as values, read on every request so that it can be changed while serving
+
+    host : str, optional
+        default '127.0.0.1'
+
+    port : int, optional
+        default 0 for any free port
+
+    Returns
+    -------
+    the server, running in a background thread until its shutdown method is called, and its base url
+
+    '''
+    class QuoteHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            symbol = self.path.rstrip('/').split('/')[-1]
+            if (not self.path.startswith('/quote/')) or (symbol not in prices):
+                self.send_error(404)
+                return
+            body = ('<html><body><div id="quote-header-info"><div></div><div></div><div><div><div>'
+                    '<span>{}</span></div></div></div></div></body></html>').format(prices[symbol]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), QuoteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://{}:{}'.format(host, server.server_address[1])
+
+
+#% test
+if __name__ == '__main__':
+    import pandas as pd
+
+    prices = {'XIU.TO': 35.0, 'SPY': 580.0, 'CAD=X': 1.38, 'EUR=X': 0.92}
+    server, base_url = serve_quotes(prices)
+    useful_functions.YAHOO_BASE_URL = base_url
+
+    def holdings(symbols, currencies, instruments, quantities, option_type='NA', underlying='', strike=np.nan):
+        n = len(symbols)
+        return pd.DataFrame({'Symbol': symbols, 'Currency': currencies, 'Instrument': instruments,
+                             'Quantity': quantities, 'Option Type': [option_type] * n,
+                             'Option Underlying': [underlying] * n, 'Strike Price': [strike] * n,
+                             'Num Shares': [100 if i == 'Option' else np.nan for i in instruments]})
+
+    tfsa = holdings(['XIU.TO', 'SPY', 'CAD', 'USD', 'EUR'], ['CAD', 'USD', 'CAD', 'USD', 'EUR'],
+                    ['ETF', 'ETF', 'Cash', 'Cash', 'Cash'], [100, 10, 500, 200, 300])
+    margin = pd.concat([holdings(['SPY'], ['USD'], ['ETF'], [5]),
+                        holdings(['SPY20DEC2026C550.00'], ['USD'], ['Option'], [1], 'Call', 'SPY', 550.0)])
+    service = QuoteService({'tfsa': tfsa, 'margin': margin}, interval=0.2, ttl=0.1, max_workers=2)
+    service.poll_once()
+
+    def full_nav():
+        return {'tfsa': (100 * prices['XIU.TO'] + (10 * prices['SPY'] + 200) * prices['CAD=X']) + 500 +
+                        300 * prices['CAD=X'] / prices['EUR=X'],
+                'margin': (5 * prices['SPY'] + max(prices['SPY'] - 550, 0) * 100) * prices['CAD=X']}
+
+    assert all(abs(service.nav()[a] - v) < 1e-9 for (a, v) in full_nav().items()), service.nav()
+
+    # a moved quote revalues only its positions: spy in both accounts and the option on it
+    prices['SPY'] = 600.0
+    time.sleep(0.15)
+    assert service.poll_once() == 3
+    prices['CAD=X'] = 1.40
+    service.start()
+    time.sleep(0.6)
+    service.stop()
+    assert all(abs(service.nav()[a] - v) < 1e-9 for (a, v) in full_nav().items()), service.nav()
+    # a euro move only revalues the euro cash
+    prices['EUR=X'] = 0.95
+    time.sleep(0.15)
+    assert service.poll_once() == 1
+    assert all(abs(service.nav()[a] - v) < 1e-9 for (a, v) in full_nav().items()), service.nav()
+    print(service.nav(), service.quote('SPY'))
+    server.shutdown()
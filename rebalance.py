@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:11:26 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+
+
+# questrade stock and etf commissions in the currency of the trade; etf buys are free
+DEFAULT_COMMISSION = {'per_share': 0.01, 'minimum': 4.95, 'maximum': 9.95, 'free_etf_buys': True}
+
+
+class Rebalancer():
+    '''
+    what-if trades that move the exposure of an account by one attribute to target weights; the holdings
+    are turned into arrays once, after which every candidate target is a few matrix operations, so a batch
+    of candidates, e.g. every position of a slider, is evaluated at once
+
+    securities in a segment are scaled pro rata, which trades the least value for the segment to reach its
+    target; cash and options are not traded, every trade settles in cad cash
+    '''
+    attribute = ''
+    segments = None
+    holdings_df = None
+    membership = None
+    tradable = None
+    price = None
+    fx = None
+    value_cad = None
+    total = 0
+    cash_segment = 0
+    cad_cash_row = 0
+    commission = None
+
+
+    def __init__(self, holdings_df, attribute, commission=None, price_cache=None, refresh=False):
+        '''
+        Parameters
+        ----------
+        holdings_df : DataFrame
+            the 'Current Holdings' sheet or Holdings.to_df, with cash rows
+
+        attribute : str
+            'Region', 'Asset Class' or 'Currency'
+
+        commission : dict, optional
+            see DEFAULT_COMMISSION, default None
+
+        price_cache : dict, optional
+            shared with the holdings valuation, see objects.cached_price, default None
+
+        refresh : bool, optional
+            if True, the latest prices are fetched through price_cache once here, instead of using the prices
+            of the report, default False
+
+        '''
+        df = holdings_df.reset_index(drop=True).copy()
+        self.attribute = attribute
+        self.commission = dict(DEFAULT_COMMISSION) if commission is None else commission
+
+        if refresh:
+            from objects import cached_price
+            if price_cache is None:
+                price_cache = {}
+            is_quoted = ~df['Instrument'].isin(['Cash', 'Option'])
+            fx = df['Market Price CAD'] / df['Market Price']
+            for i in df.index[is_quoted]:
+                df.loc[i, 'Market Price'] = cached_price(df.loc[i, 'Symbol'], price_cache=price_cache)[1]
+            df.loc[is_quoted, 'Market Price CAD'] = df.loc[is_quoted, 'Market Price'] * fx[is_quoted]
+            df['Market Value CAD'] = df['Quantity'] * df['Market Price CAD']
+
+        # every trade settles in cad cash, so the segment cad cash sits in absorbs what the others trade
+        cash_label = 'CAD' if attribute == 'Currency' else 'Cash'
+        if not ((df['Instrument'] == 'Cash') & (df['Currency'] == 'CAD')).any():
+            cash_row = {c: np.nan for c in df.columns}
+            cash_row.update({'Symbol': 'CAD', 'Currency': 'CAD', 'Instrument': 'Cash', 'Quantity': 0,
+                             'Market Price': 1, 'Market Price CAD': 1, 'Market Value CAD': 0, attribute: cash_label})
+            df = pd.concat([df, pd.DataFrame([cash_row])], ignore_index=True)
+        self.holdings_df = df
+
+        self.segments = sorted(df[attribute].astype(str).unique())
+        labels = df[attribute].astype(str).values
+        self.membership = (labels[:, None] == np.array(self.segments)[None, :]).astype(float)
+        self.cash_segment = self.segments.index(cash_label)
+        self.cad_cash_row = int(np.flatnonzero(((df['Instrument'] == 'Cash') & (df['Currency'] == 'CAD')).values)[0])
+
+        self.tradable = (~df['Instrument'].isin(['Cash', 'Option'])).values
+        self.price = df['Market Price'].values.astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.fx = np.nan_to_num(df['Market Price CAD'].values / df['Market Price'].values, nan=1.0)
+        self.value_cad = df['Market Value CAD'].values.astype(float)
+        self.total = self.value_cad.sum()
+        # the combined view of several accounts only carries the cad book cost
+        if 'Book Cost' not in df.columns:
+            df['Book Cost'] = df['Book Cost CAD'] / self.fx
+
+
+    def current_weights(self):
+        return self.value_cad @ self.membership / self.total
+
+
+    def commissions(self, shares):
+        # commission of every trade in the currency of the trade, same shape as shares
+        c = self.commission
+        fee = np.clip(np.abs(shares) * c['per_share'], c['minimum'], c['maximum'])
+        if c.get('free_etf_buys'):
+            is_etf = (self.holdings_df['Instrument'] == 'ETF').values
+            fee = np.where(is_etf[None, :] & (shares > 0), 0, fee)
+        return np.where(shares != 0, fee, 0)
+
+
+    def evaluate(self, targets):
+        '''
+        Purpose
+        -------
+        trades, commissions and post trade exposures of a batch of candidate targets
+
+        Parameters
+        ----------
+        targets : array-like
+            (candidate x segment) target weights in the order of self.segments, or a single row; rows are
+            normalized to sum to 1
+
+        Returns
+        -------
+        a dictionary of arrays: 'shares' and 'commission' (candidate x holding, commission in the currency of
+        the trade), 'trade_value_cad' and 'commission_cad' (candidate), 'turnover' (candidate, traded value over
+        total value) and 'exposure' (candidate x segment, weights after the trades)
+
+        '''
+        targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        targets = targets / targets.sum(axis=1, keepdims=True)
+
+        tradable_value = self.value_cad * self.tradable
+        fixed_by_segment = (self.value_cad - tradable_value) @ self.membership
+        tradable_by_segment = tradable_value @ self.membership
+
+        # value of tradable securities each segment needs; the cad cash segment is left alone, it just absorbs
+        needed = np.clip(targets * self.total - fixed_by_segment[None, :], 0, None)
+        needed[:, self.cash_segment] = tradable_by_segment[self.cash_segment]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(tradable_by_segment > 0, needed / tradable_by_segment, 1)
+
+        new_value = tradable_value[None, :] * (scale @ self.membership.T)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = np.where(self.tradable, np.nan_to_num((new_value - tradable_value) / (self.price * self.fx)), 0)
+        shares = np.round(shares)
+        commission = self.commissions(shares)
+
+        trade_cad = shares * self.price * self.fx
+        commission_cad = commission * self.fx
+        post_value = self.value_cad[None, :] + trade_cad
+        post_value[:, self.cad_cash_row] -= trade_cad.sum(axis=1) + commission_cad.sum(axis=1)
+
+        return {'shares': shares, 'commission': commission, 'trade_value_cad': np.abs(trade_cad).sum(axis=1),
+                'commission_cad': commission_cad.sum(axis=1), 'turnover': np.abs(trade_cad).sum(axis=1) / self.total,
+                'exposure': post_value @ self.membership / post_value.sum(axis=1, keepdims=True)}
+
+
+    def target_vector(self, target_dict):
+        # weights in the order of self.segments; segments left out of target_dict share what is left of 1 in
+        # their current proportions
+        current = self.current_weights()
+        given = np.array([s in target_dict for s in self.segments])
+        target = np.array([target_dict.get(s, 0) for s in self.segments], dtype=float)
+        rest = current * ~given
+        if rest.sum() > 0:
+            target = target + rest / rest.sum() * max(1 - target.sum(), 0)
+        return target
+
+
+    def sweep(self, segment, steps=101):
+        '''
+        Purpose
+        -------
+        candidate targets that move one segment from 0 to 100% with the other segments kept in their current
+        proportions, e.g. every position of a slider
+
+        Returns
+        -------
+        two numpy arrays: the weights of segment, and the (candidate x segment) targets
+
+        '''
+        current = self.current_weights()
+        j = self.segments.index(segment)
+        others = np.delete(current, j)
+        others = others / others.sum() if others.sum() > 0 else np.full(len(others), 1 / len(others))
+        weights = np.linspace(0, 1, steps)
+        targets = np.insert(np.outer(1 - weights, others), j, weights, axis=1)
+        return weights, targets
+
+
+    def trade_list(self, target):
+        '''
+        Purpose
+        -------
+        the trades of one candidate, with the average cost after each trade computed like Security.new_trade
+
+        Parameters
+        ----------
+        target : dict or array-like
+            segment weights, see target_vector and evaluate
+
+        Returns
+        -------
+        DataFrame with one row per trade
+
+        '''
+        if isinstance(target, dict):
+            target = self.target_vector(target)
+        result = self.evaluate(target)
+        shares = result['shares'][0]
+        commission = result['commission'][0]
+        traded = np.flatnonzero(shares)
+
+        df = self.holdings_df.loc[traded, ['Symbol', 'Currency', 'Instrument', self.attribute, 'Quantity',
+                                           'Market Price', 'Book Cost']].copy()
+        df['Action'] = np.where(shares[traded] > 0, 'Buy', 'Sell')
+        df['Trade Quantity'] = shares[traded]
+        df['Commission'] = commission[traded]
+        df['Trade Value CAD'] = shares[traded] * self.price[traded] * self.fx[traded]
+        df['Quantity After'] = df['Quantity'] + df['Trade Quantity']
+        # buys fold the commission into the average cost, sells leave it unchanged
+        is_buy = df['Trade Quantity'] > 0
+        df['Average Cost After'] = df['Book Cost']
+        df.loc[is_buy, 'Average Cost After'] = ((df['Quantity'] * df['Book Cost'] + df['Trade Quantity'] * df['Market Price']
+                                                + df['Commission']) / df['Quantity After'])[is_buy]
+        return df.drop(columns=['Book Cost']).reset_index(drop=True)
+
+
+    def exposure_df(self, target):
+        # current, target and post trade weight of every segment of one candidate
+        if isinstance(target, dict):
+            target = self.target_vector(target)
+        target = np.asarray(target, dtype=float) / np.sum(target)
+        return pd.DataFrame({self.attribute: self.segments, 'Current': self.current_weights(), 'Target': target,
+                             'Post Trade': self.evaluate(target)['exposure'][0]})
+
+
+#% test
+if __name__ == '__main__':
+    import time
+    holdings_df = pd.DataFrame({'Symbol': ['XIU.TO', 'ZSP.TO', 'VFV.TO', 'AAPL', 'CAD', 'USD'],
+                                'Currency': ['CAD', 'CAD', 'CAD', 'USD', 'CAD', 'USD'],
+                                'Instrument': ['ETF', 'ETF', 'ETF', 'Stock', 'Cash', 'Cash'],
+                                'Quantity': [400, 150, 50, 30, 2500, 1000],
+                                'Asset Class': ['Equity'] * 4 + ['Cash'] * 2,
+                                'Region': ['Canada', 'US', 'US', 'US', 'Cash', 'Cash'],
+                                'Market Price': [35.0, 70.0, 140.0, 230.0, 1, 1],
+                                'Book Cost': [30.0, 60.0, 120.0, 150.0, 1, 1]})
+    holdings_df['Market Price CAD'] = holdings_df['Market Price'] * np.where(holdings_df['Currency'] == 'USD', 1.38, 1)
+    holdings_df['Market Value CAD'] = holdings_df['Quantity'] * holdings_df['Market Price CAD']
+
+    rebalancer = Rebalancer(holdings_df, 'Region')
+    print(rebalancer.exposure_df({'Canada': 0.5, 'US': 0.45, 'Cash': 0.05}))
+    print(rebalancer.trade_list({'Canada': 0.5, 'US': 0.45, 'Cash': 0.05}))
+
+    t = time.perf_counter()
+    weights, targets = rebalancer.sweep('Canada', steps=1001)
+    batch = rebalancer.evaluate(targets)
+    print('{} candidates in {:.4f}s'.format(len(weights), time.perf_counter() - t))
+    # post trade exposure is within whole share rounding of the target
+    assert np.abs(batch['exposure'] - targets).max() < 0.02
+    # the batch agrees with evaluating a candidate on its own
+    single = rebalancer.evaluate(targets[400])
+    assert np.allclose(single['shares'], batch['shares'][400])
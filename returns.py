@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:05:27 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from pandas.tseries.offsets import DateOffset
+
+
+def to_days(dates):
+    # datetimes as float days since the epoch, so that time weights are plain arithmetic
+    return pd.DatetimeIndex(dates).values.astype('datetime64[ns]').astype(np.int64) / 86400e9
+
+
+def cash_flow_series(cash_flows_df, date_col='Transaction Date', amount_col='Net Amount'):
+    '''
+    Purpose
+    -------
+    turn an external cash flow dataframe, e.g. Portfolio.external_cash_flow_df, into a series
+
+    Parameters
+    ----------
+    cash_flows_df : DataFrame
+        cash flows in the currency of the nav series
+
+    date_col, amount_col : str, optional
+        default 'Transaction Date' and 'Net Amount'
+
+    Returns
+    -------
+    Series of amounts indexed by date
+
+    '''
+    return cash_flows_df.set_index(date_col)[amount_col].sort_index()
+
+
+class ReturnEngine():
+    '''
+    prefix sums of a nav series and its external cash flows; after the O(n) set up every (start, end)
+    window costs a constant number of array lookups, so any grid of windows is evaluated in one pass
+    '''
+    nav_dates = None
+    nav_days = None
+    nav_values = None
+    flow_sum = None
+    flow_time_sum = None
+    log_growth = None
+
+
+    def __init__(self, nav_series, cash_flows):
+        '''
+        Parameters
+        ----------
+        nav_series : Series
+            market value indexed by date, e.g. daily
+
+        cash_flows : Series
+            external cash flows indexed by date, positive into the portfolio, see cash_flow_series
+
+        '''
+        nav_series = nav_series.sort_index()
+        self.nav_dates = pd.DatetimeIndex(nav_series.index)
+        self.nav_days = to_days(self.nav_dates)
+        self.nav_values = nav_series.values.astype(float)
+
+        # flow_sum[k] and flow_time_sum[k] are the sums of f and t * f over every flow up to nav date k;
+        # a flow between two nav dates counts from the later one, matching the (start, end] windows
+        flow_days = to_days(cash_flows.index)
+        flow_amounts = cash_flows.values.astype(float)
+        flow_pos = np.searchsorted(self.nav_days, flow_days, side='left')
+        n = len(self.nav_days)
+        self.flow_sum = np.cumsum(np.bincount(flow_pos, weights=flow_amounts, minlength=n + 1))[:n]
+        self.flow_time_sum = np.cumsum(np.bincount(flow_pos, weights=flow_days * flow_amounts, minlength=n + 1))[:n]
+
+        # daily modified dietz returns chain linked as a running log sum for time weighted returns
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily = self.dietz_by_position(np.arange(n - 1), np.arange(1, n))
+        # days with nothing invested have no return
+        daily = np.where(np.isfinite(daily), daily, 0)
+        self.log_growth = np.concatenate([[0], np.cumsum(np.log1p(daily))])
+
+
+    def daily_returns(self):
+        # flow adjusted return of every nav date over the previous one
+        return pd.Series(np.expm1(np.diff(self.log_growth)), index=self.nav_dates[1:])
+
+
+    def growth_index(self):
+        # value of 1 invested at the first nav date, net of external cash flows
+        return pd.Series(np.exp(self.log_growth), index=self.nav_dates)
+
+
+    def positions(self, dates):
+        # position of the last nav date on or before each date
+        return np.searchsorted(self.nav_days, to_days(dates), side='right') - 1
+
+
+    def dietz_by_position(self, start_pos, end_pos):
+        start_days = self.nav_days[start_pos]
+        end_days = self.nav_days[end_pos]
+        flows = self.flow_sum[end_pos] - self.flow_sum[start_pos]
+        time_flows = self.flow_time_sum[end_pos] - self.flow_time_sum[start_pos]
+        weighted_flows = (end_days * flows - time_flows) / (end_days - start_days)
+        starting_balance = self.nav_values[start_pos]
+        ending_balance = self.nav_values[end_pos]
+        return (ending_balance - starting_balance - flows) / (starting_balance + weighted_flows)
+
+
+    def period_returns(self, start_dates, end_dates, method='dietz'):
+        '''
+        Purpose
+        -------
+        returns of every (start, end) window
+
+        Parameters
+        ----------
+        start_dates, end_dates : array-like
+            datetimes of the same length; each is moved back to the last nav date on or before it
+
+        method : str, optional
+            'dietz' for one modified dietz return over the window, the same as Portfolio.measure_performance,
+            or 'twr' for daily modified dietz returns chain linked over the window, default 'dietz'
+
+        Returns
+        -------
+        DataFrame with 'Start', 'End' and 'Return' columns; windows starting before the first nav date are NaN
+
+        '''
+        start_pos = self.positions(start_dates)
+        end_pos = self.positions(end_dates)
+        valid = (start_pos >= 0) & (end_pos > start_pos)
+        start_clip = np.clip(start_pos, 0, None)
+        end_clip = np.clip(end_pos, 0, None)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if method == 'dietz':
+                answer = self.dietz_by_position(start_clip, end_clip)
+            elif method == 'twr':
+                answer = np.expm1(self.log_growth[end_clip] - self.log_growth[start_clip])
+            else:
+                raise ValueError('unknown method {}'.format(method))
+        answer = np.where(valid, answer, np.nan)
+        return pd.DataFrame({'Start': pd.DatetimeIndex(start_dates), 'End': pd.DatetimeIndex(end_dates), 'Return': answer})
+
+
+def rolling_windows(end_dates, months=12):
+    '''
+    Purpose
+    -------
+    a grid of trailing windows of the same length ending at each of end_dates, e.g. rolling 12 months
+
+    Parameters
+    ----------
+    end_dates : array-like
+        datetimes
+
+    months : int, optional
+        default 12
+
+    Returns
+    -------
+    two DatetimeIndex objects, start dates and end dates
+
+    '''
+    end_dates = pd.DatetimeIndex(end_dates)
+    return end_dates - DateOffset(months=months), end_dates
+
+
+def calendar_windows(first_date, last_date, period='year'):
+    '''
+    Purpose
+    -------
+    a grid of calendar periods between two dates, e.g. calendar years or quarters; the first and last
+    periods are cut at first_date and last_date
+
+    Parameters
+    ----------
+    first_date, last_date : datetime
+
+    period : str, optional
+        'year', 'quarter' or 'month', default 'year'
+
+    Returns
+    -------
+    two DatetimeIndex objects, start dates and end dates
+
+    '''
+    freq = {'year': pd.offsets.YearEnd(), 'quarter': pd.offsets.QuarterEnd(), 'month': pd.offsets.MonthEnd()}[period]
+    period_ends = pd.date_range(first_date, last_date, freq=freq)
+    starts = pd.DatetimeIndex([pd.Timestamp(first_date)]).append(period_ends)
+    ends = period_ends.append(pd.DatetimeIndex([pd.Timestamp(last_date)]))
+    keep = starts < ends
+    return starts[keep], ends[keep]
+
+
+def past_dates_windows(current_date, inception_date):
+    '''
+    Purpose
+    -------
+    the windows of useful_functions.past_dates_dict as a grid
+
+    Returns
+    -------
+    a list of period names, and two DatetimeIndex objects, start dates and end dates
+
+    '''
+    import useful_functions
+    dates_dict = useful_functions.past_dates_dict(current_date, inception_date)
+    names = list(dates_dict.keys())
+    starts = pd.DatetimeIndex([dates_dict[k] for k in names])
+    ends = pd.DatetimeIndex([current_date] * len(names))
+    return names, starts, ends
+
+
+#% test
+if __name__ == '__main__':
+    # compare the prefix sum windows against modified dietz computed the same way as Portfolio
+    from objects import modified_dietz
+
+    nav_dates = pd.bdate_range('2015-01-01', '2026-10-16')
+    rng = np.random.default_rng(0)
+    flows = pd.Series(rng.normal(500, 2000, 300), index=pd.DatetimeIndex(rng.choice(nav_dates, 300)).sort_values())
+    nav = pd.Series(10000 * np.cumprod(1 + rng.normal(0.0003, 0.01, len(nav_dates))), index=nav_dates)
+    nav = nav + flows.groupby(level=0).sum().reindex(nav_dates, fill_value=0).cumsum()
+
+    engine = ReturnEngine(nav, flows)
+    starts, ends = rolling_windows(nav_dates[300::20])
+    fast = engine.period_returns(starts, ends)
+
+    flows_df = pd.DataFrame({'Transaction Date': flows.index, 'Net Amount': flows.values})
+    for i in range(0, len(fast), 25):
+        s = nav.index[engine.positions([starts[i]])[0]]
+        e = nav.index[engine.positions([ends[i]])[0]]
+        slow = modified_dietz(nav[s], nav[e], s, e, flows_df)
+        assert abs(slow - fast.loc[i, 'Return']) < 1e-9, (i, slow, fast.loc[i, 'Return'])
+    print(fast.tail())
+    print(engine.period_returns(*calendar_windows(nav_dates[0], nav_dates[-1]), method='twr'))
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:10:04 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from numpy.lib.stride_tricks import sliding_window_view
+
+from returns import ReturnEngine
+
+
+PERIODS_PER_YEAR = 252
+
+
+def drawdown(growth_index):
+    '''
+    Purpose
+    -------
+    drawdown from the running peak and the number of periods since that peak
+
+    Parameters
+    ----------
+    growth_index : array-like
+        value of 1 invested, net of cash flows, e.g. ReturnEngine.growth_index
+
+    Returns
+    -------
+    two numpy arrays: drawdown (0 or negative) and periods since the last peak
+
+    '''
+    growth_index = np.asarray(growth_index, dtype=float)
+    running_peak = np.maximum.accumulate(growth_index)
+    positions = np.arange(len(growth_index))
+    last_peak = np.maximum.accumulate(np.where(growth_index >= running_peak, positions, 0))
+    return growth_index / running_peak - 1, positions - last_peak
+
+
+def value_at_risk(returns, confidence=0.95):
+    '''
+    Purpose
+    -------
+    one period historical and parametric (normal) value at risk and conditional value at risk
+
+    Parameters
+    ----------
+    returns : array-like
+        periodic returns
+
+    confidence : float, optional
+        default 0.95
+
+    Returns
+    -------
+    a dictionary of four positive numbers, losses as a fraction of value
+
+    '''
+    returns = np.asarray(returns, dtype=float)
+    returns = returns[~np.isnan(returns)]
+    historical_var = -np.quantile(returns, 1 - confidence)
+    tail = returns[returns <= -historical_var]
+
+    mu = returns.mean()
+    sigma = returns.std(ddof=1)
+    z = NormalDist().inv_cdf(1 - confidence)
+    parametric_var = -(mu + z * sigma)
+    parametric_cvar = -(mu - sigma * NormalDist().pdf(z) / (1 - confidence))
+
+    return {'Historical VaR': historical_var, 'Historical CVaR': -tail.mean() if len(tail) > 0 else np.nan,
+            'Parametric VaR': parametric_var, 'Parametric CVaR': parametric_cvar}
+
+
+def risk_summary(returns, growth_index, benchmark_returns=None, risk_free=0.0, confidence=0.95):
+    '''
+    Purpose
+    -------
+    whole period risk statistics of one return series
+
+    Parameters
+    ----------
+    returns : Series
+        daily returns indexed by date
+
+    growth_index : Series
+        value of 1 invested, indexed by date, starting one period before returns
+
+    benchmark_returns : DataFrame, optional
+        daily returns of benchmarks, one column each, indexed by date, default None
+
+    risk_free : float, optional
+        annual risk free rate, default 0
+
+    confidence : float, optional
+        for value at risk, default 0.95
+
+    Returns
+    -------
+    Series of statistics
+
+    '''
+    r = returns.dropna().values
+    annual_return = growth_index.iloc[-1] ** (PERIODS_PER_YEAR / max(len(growth_index) - 1, 1)) - 1
+    volatility = r.std(ddof=1) * np.sqrt(PERIODS_PER_YEAR)
+    downside = np.sqrt(np.mean(np.minimum(r, 0) ** 2)) * np.sqrt(PERIODS_PER_YEAR)
+    dd, dd_duration = drawdown(growth_index.values)
+    # periods are business days, the longest drawdown is reported in calendar days from its peak
+    dates = pd.DatetimeIndex(growth_index.index)
+    positions = np.arange(len(dates))
+    dd_days = (dates - dates[positions - dd_duration]).days
+
+    summary = {'Annualized Return': annual_return, 'Annualized Volatility': volatility,
+               'Sharpe Ratio': (annual_return - risk_free) / volatility,
+               'Sortino Ratio': (annual_return - risk_free) / downside,
+               'Max Drawdown': dd.min(), 'Max Drawdown Days': int(dd_days.max()),
+               'Current Drawdown': dd[-1]}
+    summary.update(value_at_risk(r, confidence))
+
+    if benchmark_returns is not None:
+        aligned = benchmark_returns.reindex(returns.index)
+        both = aligned.notna().values & returns.notna().values[:, None]
+        for i, benchmark in enumerate(aligned.columns):
+            x = aligned[benchmark].values[both[:, i]]
+            y = returns.values[both[:, i]]
+            cov = np.cov(x, y)
+            summary['Beta {}'.format(benchmark)] = cov[0, 1] / cov[0, 0]
+            summary['Correlation {}'.format(benchmark)] = cov[0, 1] / np.sqrt(cov[0, 0] * cov[1, 1])
+
+    return pd.Series(summary)
+
+
+def rolling_risk(returns, growth_index, benchmark_returns=None, window=63):
+    '''
+    Purpose
+    -------
+    rolling volatility, drawdown and beta, every window computed at once on strided views of the
+    return arrays instead of a loop over windows; 'Rolling Drawdown' is from the peak within each window,
+    'Drawdown From Peak' from the all-time peak
+
+    Parameters
+    ----------
+    returns : Series
+        daily returns indexed by date
+
+    growth_index : Series
+        value of 1 invested, indexed by date, starting one period before returns
+
+    benchmark_returns : DataFrame, optional
+        daily returns of benchmarks, one column each, indexed by date, default None
+
+    window : int, optional
+        number of periods in each window, default 63, about a quarter
+
+    Returns
+    -------
+    DataFrame indexed by the last date of each window
+
+    '''
+    r = returns.fillna(0).values
+    if len(r) < window:
+        return pd.DataFrame()
+    r_windows = sliding_window_view(r, window)
+    end_dates = returns.index[window - 1:]
+
+    df = pd.DataFrame({'Rolling Volatility': r_windows.std(axis=1, ddof=1) * np.sqrt(PERIODS_PER_YEAR)},
+                      index=end_dates)
+    # each window of returns with the growth index value it starts from
+    g_windows = sliding_window_view(growth_index.values[-(len(r) + 1):], window + 1)
+    df['Rolling Drawdown'] = g_windows[:, -1] / g_windows.max(axis=1) - 1
+    df['Drawdown From Peak'] = drawdown(growth_index.values)[0][-len(end_dates):]
+
+    if benchmark_returns is not None:
+        aligned = benchmark_returns.reindex(returns.index).fillna(0)
+        r_demeaned = r_windows - r_windows.mean(axis=1, keepdims=True)
+        for benchmark in aligned.columns:
+            b_windows = sliding_window_view(aligned[benchmark].values, window)
+            b_demeaned = b_windows - b_windows.mean(axis=1, keepdims=True)
+            covariance = (r_demeaned * b_demeaned).sum(axis=1)
+            variance = (b_demeaned ** 2).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df['Rolling Beta {}'.format(benchmark)] = covariance / variance
+    df.index.name = 'Date'
+    return df
+
+
+def account_risk(nav_series, cash_flows, benchmark_prices=None, risk_free=0.0, confidence=0.95, window=63):
+    '''
+    Purpose
+    -------
+    every risk statistic of one account in one call
+
+    Parameters
+    ----------
+    nav_series : Series
+        daily market value indexed by date, e.g. NavHistory.nav()
+
+    cash_flows : Series
+        external cash flows indexed by date, see returns.cash_flow_series
+
+    benchmark_prices : DataFrame, optional
+        daily prices of benchmarks, one column each, on the same dates, e.g. PriceStore.price_matrix,
+        default None
+
+    risk_free, confidence, window : optional
+        see risk_summary and rolling_risk
+
+    Returns
+    -------
+    two DataFrames: the summary with one row per statistic, and the rolling statistics
+
+    '''
+    engine = ReturnEngine(nav_series, cash_flows)
+    returns = engine.daily_returns()
+    growth_index = engine.growth_index()
+    benchmark_returns = None
+    if benchmark_prices is not None:
+        benchmark_returns = benchmark_prices.sort_index().pct_change().iloc[1:]
+
+    summary = risk_summary(returns, growth_index, benchmark_returns, risk_free, confidence)
+    rolling = rolling_risk(returns, growth_index, benchmark_returns, window)
+    summary_df = summary.to_frame('Value')
+    summary_df.index.name = 'Statistic'
+    return summary_df.reset_index(), rolling.reset_index()
+
+
+#% test
+if __name__ == '__main__':
+    dates = pd.bdate_range('2018-01-01', '2026-10-16')
+    rng = np.random.default_rng(1)
+    market = pd.Series(rng.normal(0.0003, 0.01, len(dates)), index=dates)
+    nav = pd.Series(50000 * np.cumprod(1 + 0.8 * market + rng.normal(0, 0.004, len(dates))), index=dates)
+    flows = pd.Series([], index=pd.DatetimeIndex([]), dtype=float)
+    benchmarks = pd.DataFrame({'SPY': 300 * np.cumprod(1 + market)}, index=dates)
+
+    summary_df, rolling_df = account_risk(nav, flows, benchmarks)
+    print(summary_df)
+    print(rolling_df.tail())
+
+    # strided rolling volatility against a plain loop
+    r = nav.pct_change().iloc[1:]
+    loop = np.array([r.values[i - 62:i + 1].std(ddof=1) for i in range(62, len(r))]) * np.sqrt(PERIODS_PER_YEAR)
+    assert np.allclose(loop, rolling_df['Rolling Volatility'].values)
+
+    # rolling drawdown against a plain loop over the same windows of the growth index
+    g = ReturnEngine(nav, flows).growth_index().values
+    loop = np.array([g[i] / g[i - 63:i + 1].max() - 1 for i in range(63, len(g))])
+    assert np.allclose(loop, rolling_df['Rolling Drawdown'].values)
+    assert (rolling_df['Rolling Drawdown'] >= rolling_df['Drawdown From Peak'] - 1e-12).all()
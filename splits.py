@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 22:20:47 2026
+
+@author: Frank Shi
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+# the index shared by useful_functions.get_hist_price, see split_index
+_split_index = None
+_split_index_lock = threading.Lock()
+
+
+class SplitIndex():
+    '''
+    per symbol, the sorted split dates and the product of the share multipliers (new shares per old share) of
+    every split from each one on; the factor of any date, or array of dates, is one searchsorted
+
+    a split-adjusted close times the factor of its date is the close actually traded on that date; a split
+    counts from its own date on, the close of the split date is already in new shares
+
+    symbols are loaded once, from the provider on first use, or all at once from the split_reference sheet or
+    the ledger itself
+    '''
+    dates = None
+    multipliers = None
+    suffix = None
+    fetch = True
+
+
+    def __init__(self, fetch=True):
+        '''
+        Parameters
+        ----------
+        fetch : bool, optional
+            whether a symbol that has not been added is looked up on the provider, default True; if False it
+            has no splits
+
+        '''
+        self.dates = {}
+        self.multipliers = {}
+        self.suffix = {}
+        self.fetch = fetch
+        self.lock = threading.Lock()
+
+
+    def add(self, symbol, dates, multipliers):
+        # replaces the splits of symbol; symbol None holds splits only known by date, e.g. a reference sheet
+        # without a symbol column
+        dates = pd.DatetimeIndex(dates).normalize()
+        order = np.argsort(dates.values, kind='stable')
+        dates = dates.values[order]
+        multipliers = np.asarray(multipliers, dtype=float)[order]
+        with self.lock:
+            self.dates[symbol] = dates
+            self.multipliers[symbol] = multipliers
+            self.suffix[symbol] = np.append(np.cumprod(multipliers[::-1])[::-1], 1)
+
+
+    @classmethod
+    def from_reference(cls, split_reference, fetch=False):
+        '''
+        Purpose
+        -------
+        an index of the split_reference sheet of the info file: 'date' and 'multiplier' columns, and a
+        'symbol' column if the sheet has one
+
+        '''
+        index = cls(fetch=fetch)
+        if split_reference is None:
+            return index
+        df = split_reference.dropna(subset=['date', 'multiplier'])
+        if 'symbol' in df.columns:
+            for symbol, group in df.groupby('symbol'):
+                index.add(symbol, group['date'], group['multiplier'])
+        else:
+            index.add(None, df['date'], df['multiplier'])
+        return index
+
+
+    def load(self, symbol):
+        # the split history of symbol from the provider, once; a failed lookup is retried next time
+        import useful_functions
+        if symbol in self.dates:
+            return
+        if not self.fetch:
+            self.add(symbol, [], [])
+            return
+        try:
+            df = useful_functions.get_split_history(symbol)
+        except (ConnectionError, IndexError) as e:
+            print('could not fetch the splits of {}: {}'.format(symbol, e))
+            return
+        self.add(symbol, df['date'], df['multiplier'])
+
+
+    def factor(self, symbol, dates):
+        '''
+        Purpose
+        -------
+        the multiplier from split-adjusted to unadjusted prices of symbol on dates
+
+        Parameters
+        ----------
+        symbol : str
+
+        dates : datetime or array-like
+
+        Returns
+        -------
+        a float for a single date, otherwise a numpy array of the same length as dates
+
+        '''
+        self.load(symbol)
+        scalar = np.ndim(dates) == 0
+        values = pd.DatetimeIndex([dates] if scalar else dates).normalize().values
+        if symbol not in self.dates:
+            result = np.ones(len(values))
+        else:
+            result = self.suffix[symbol][np.searchsorted(self.dates[symbol], values, side='right')]
+        return float(result[0]) if scalar else result
+
+
+    def to_unadjusted(self, symbol, dates, prices):
+        return np.asarray(prices) * self.factor(symbol, dates)
+
+
+    def to_adjusted(self, symbol, dates, prices):
+        return np.asarray(prices) / self.factor(symbol, dates)
+
+
+    def multiplier(self, date, symbol=None):
+        '''
+        Purpose
+        -------
+        the multiplier of the split on date, of symbol if it is listed, otherwise of any split on that date
+        that is listed, e.g. for the REV and ADJ rows of a ledger
+
+        Returns
+        -------
+        float, or None if there is no split on date
+
+        '''
+        date = np.datetime64(pd.Timestamp(date).normalize())
+        if symbol is not None:
+            self.load(symbol)
+        candidates = [symbol] if symbol in self.dates else []
+        candidates += [s for s in self.dates if s != symbol]
+        for s in candidates:
+            i = np.searchsorted(self.dates[s], date, side='left')
+            if (i < len(self.dates[s])) and (self.dates[s][i] == date):
+                return float(self.multipliers[s][i])
+        return None
+
+
+def as_split_index(split_reference):
+    # a SplitIndex of split_reference, which may already be one
+    if isinstance(split_reference, SplitIndex):
+        return split_reference
+    return SplitIndex.from_reference(split_reference)
+
+
+def split_index():
+    # the index shared by every module, filled from the provider symbol by symbol
+    global _split_index
+    with _split_index_lock:
+        if _split_index is None:
+            _split_index = SplitIndex()
+    return _split_index
+
+
+#% test
+if __name__ == '__main__':
+    import time
+
+    index = SplitIndex(fetch=False)
+    # a 2:1 split, then a 1:10 reverse split
+    index.add('ABC', ['2021-06-01', '2024-03-15'], [2, 0.1])
+    assert index.factor('ABC', pd.Timestamp('2021-05-31')) == 0.2
+    assert index.factor('ABC', pd.Timestamp('2021-06-01')) == 0.1
+    assert index.factor('ABC', pd.Timestamp('2024-03-15')) == 1
+    assert index.factor('XYZ', pd.Timestamp('2021-05-31')) == 1
+    assert index.multiplier(pd.Timestamp('2024-03-15 09:30'), 'ABC') == 0.1
+    assert index.multiplier(pd.Timestamp('2024-03-14'), 'ABC') is None
+
+    reference = SplitIndex.from_reference(pd.DataFrame({'date': [pd.Timestamp('2022-01-10')], 'multiplier': [0.2]}))
+    assert reference.multiplier(pd.Timestamp('2022-01-10'), 'ANY.TO') == 0.2
+
+    dates = pd.bdate_range('2000-01-01', '2026-10-16')
+    t = time.perf_counter()
+    factors = index.factor('ABC', dates)
+    print('{} dates in {:.4f}s'.format(len(dates), time.perf_counter() - t))
+    assert np.allclose(index.to_adjusted('ABC', dates, index.to_unadjusted('ABC', dates, np.ones(len(dates)))), 1)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 01:24:18 2026
+
+@author: Frank Shi
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+
+# position attributes a factor can select on; 'Symbol' is the underlying for an option
+FACTOR_ATTRIBUTES = ['Region', 'Asset Class', 'Currency', 'Instrument', 'Symbol']
+
+
+def parse_factor(factor):
+    '''
+    Purpose
+    -------
+    the conditions of a factor name: 'Attribute=Value' terms joined by ' & ', e.g. 'Region=US & Asset Class=Equity';
+    a factor of a single 'Currency' term shocks the fx rate of that currency to cad, any other factor shocks
+    the prices of the positions it selects
+
+    Returns
+    -------
+    a list of (attribute, value) tuples
+
+    '''
+    conditions = []
+    for term in factor.split(' & '):
+        attribute, value = [t.strip() for t in term.split('=', 1)]
+        if attribute not in FACTOR_ATTRIBUTES:
+            raise ValueError('{}: factors select on {}, not {}'.format(factor, FACTOR_ATTRIBUTES, attribute))
+        conditions.append((attribute, value))
+    return conditions
+
+
+def is_fx_factor(conditions):
+    return (len(conditions) == 1) and (conditions[0][0] == 'Currency')
+
+
+def position_table(holdings_df):
+    '''
+    Purpose
+    -------
+    the arrays a scenario needs from a holdings report: attributes to select on, the fx rate to cad and the
+    option terms of every row
+
+    Parameters
+    ----------
+    holdings_df : DataFrame
+        Holdings.to_df output or a 'Current Holdings' sheet, after market_value_cad
+
+    Returns
+    -------
+    DataFrame, one row per holdings row
+
+    '''
+    df = holdings_df.reset_index(drop=True)
+    is_option = (df['Instrument'] == 'Option').values
+    table = pd.DataFrame({'Region': df['Region'], 'Asset Class': df['Asset Class'], 'Currency': df['Currency'],
+                          'Instrument': df['Instrument'],
+                          'Symbol': np.where(is_option, df['Option Underlying'], df['Symbol'])})
+    table[FACTOR_ATTRIBUTES] = table[FACTOR_ATTRIBUTES].fillna('').astype(str)
+
+    # to_df converts market price and book cost with the same rate, whichever of the two is nonzero gives it;
+    # combined holdings only keep the cad book cost
+    price = df['Market Price'].astype(float).values
+    book = df['Book Cost'].astype(float).values if 'Book Cost' in df.columns else np.zeros(len(df))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fx = np.where(price != 0, df['Market Price CAD'].values / price,
+                      np.where(book != 0, df['Book Cost CAD'].values / book, np.nan))
+    fx = pd.Series(fx).groupby(table['Currency']).transform('max').fillna(1.0)
+    table['FX'] = fx.values
+    table['Quantity'] = df['Quantity'].astype(float).values
+    table['Price'] = price
+    table['Is Option'] = is_option
+    table['Is Call'] = (df['Option Type'] == 'Call').values
+    table['Is Cash'] = (df['Instrument'] == 'Cash').values
+    table['Underlying Price'] = df['Underlying Market Price'].astype(float).fillna(0).values
+    table['Strike'] = df['Strike Price'].astype(float).fillna(0).values
+    num_shares = df['Num Shares'] if 'Num Shares' in df.columns else pd.Series(100, index=df.index)
+    table['Num Shares'] = num_shares.astype(float).fillna(100).values
+    table['Market Value CAD'] = df['Market Value CAD'].astype(float).values
+    return table
+
+
+def exposure_matrix(table, factors):
+    '''
+    Purpose
+    -------
+    factor by position matrix of 0 and 1: which positions each factor selects; cash has no price, so price
+    factors never select it
+
+    Returns
+    -------
+    two numpy arrays: the exposure matrix and whether each factor is an fx factor
+
+    '''
+    exposure = np.zeros((len(factors), len(table)))
+    fx_factor = np.zeros(len(factors), dtype=bool)
+    for (k, factor) in enumerate(factors):
+        conditions = parse_factor(factor)
+        selected = np.ones(len(table), dtype=bool)
+        for (attribute, value) in conditions:
+            selected &= (table[attribute] == value).values
+        fx_factor[k] = is_fx_factor(conditions)
+        if not fx_factor[k]:
+            selected &= ~table['Is Cash'].values
+        exposure[k] = selected
+    return exposure, fx_factor
+
+
+def stress_test(holdings_df, scenario_df):
+    '''
+    Purpose
+    -------
+    market value change of the holdings under every scenario, all scenarios at once: the scenario by factor
+    shock matrix times the factor by position exposure matrix gives the price and fx return of every position
+    in every scenario, and options are revalued at the intrinsic value of their shocked underlying
+
+    shocks of factors selecting the same position add up, e.g. 'Region=US' -0.1 and 'Asset Class=Equity' -0.05
+    is -0.15 on us equity
+
+    Parameters
+    ----------
+    holdings_df : DataFrame
+        Holdings.to_df output or a 'Current Holdings' sheet, after market_value_cad
+
+    scenario_df : DataFrame
+        one row per scenario: a 'Scenario' name column and one column per factor, see parse_factor, with
+        returns as fractions, e.g. -0.2; blank is 0
+
+    Returns
+    -------
+    two DataFrames: one row per scenario with 'Scenario', 'P&L CAD', 'Pct Change' and 'Market Value CAD'
+    after the shock, and the scenario by symbol P&L
+
+    '''
+    table = position_table(holdings_df)
+    factors = [c for c in scenario_df.columns if c != 'Scenario']
+    exposure, fx_factor = exposure_matrix(table, factors)
+    shocks = scenario_df[factors].fillna(0).values.astype(float)
+
+    price_return = shocks[:, ~fx_factor] @ exposure[~fx_factor]
+    fx_return = shocks[:, fx_factor] @ exposure[fx_factor]
+
+    # options at the intrinsic value of the shocked underlying, everything else scaled by its price return
+    underlying = table['Underlying Price'].values * (1 + price_return)
+    strike = table['Strike'].values
+    intrinsic = np.where(table['Is Call'].values, underlying - strike, strike - underlying).clip(min=0)
+    price = np.where(table['Is Option'].values, intrinsic * table['Num Shares'].values,
+                     table['Price'].values * (1 + price_return))
+    value = table['Quantity'].values * price * table['FX'].values * (1 + fx_return)
+    pnl = value - table['Market Value CAD'].values
+
+    base_value = table['Market Value CAD'].sum()
+    total = pnl.sum(axis=1)
+    summary_df = pd.DataFrame({'Scenario': scenario_df['Scenario'].values if 'Scenario' in scenario_df.columns
+                               else np.arange(len(scenario_df)), 'P&L CAD': total,
+                               'Pct Change': total / base_value, 'Market Value CAD': base_value + total})
+    symbols = holdings_df['Symbol'].values
+    pnl_df = pd.DataFrame(pnl, index=summary_df['Scenario'].values, columns=symbols).T.groupby(level=0).sum().T
+    return summary_df, pnl_df
+
+
+def scenario_grid(factor_shocks):
+    '''
+    Purpose
+    -------
+    every combination of the shocks of several factors, e.g. {'Region=US': [-0.3, -0.2, -0.1, 0],
+    'Currency=USD': [-0.1, 0, 0.1]} is 12 scenarios
+
+    Returns
+    -------
+    DataFrame in the format stress_test takes
+
+    '''
+    factors = list(factor_shocks.keys())
+    rows = list(itertools.product(*[factor_shocks[f] for f in factors]))
+    df = pd.DataFrame(rows, columns=factors)
+    df.insert(0, 'Scenario', [', '.join('{} {:+.0%}'.format(f, s) for (f, s) in zip(factors, r) if s != 0) or 'Base'
+                              for r in rows])
+    return df
+
+
+#% test
+if __name__ == '__main__':
+    import time
+
+    holdings_df = pd.DataFrame({'Symbol': ['SPY', 'XIU.TO', 'SPY20DEC2026P500.00', 'USD', 'CAD'],
+                                'Currency': ['USD', 'CAD', 'USD', 'USD', 'CAD'],
+                                'Instrument': ['ETF', 'ETF', 'Option', 'Cash', 'Cash'],
+                                'Quantity': [10, 100, 1, 1000, 500],
+                                'Asset Class': ['Equity', 'Equity', 'Equity', 'Cash', 'Cash'],
+                                'Region': ['US', 'Canada', 'US', 'Cash', 'Cash'],
+                                'Market Price': [600.0, 35.0, 0.0, 1, 1], 'Book Cost': [500.0, 30.0, 250.0, 1, 1],
+                                'Option Type': ['NA', 'NA', 'Put', 'NA', 'NA'],
+                                'Option Underlying': ['', '', 'SPY', np.nan, np.nan],
+                                'Underlying Market Price': [np.nan, np.nan, 600.0, np.nan, np.nan],
+                                'Strike Price': [np.nan, np.nan, 500.0, np.nan, np.nan],
+                                'Num Shares': [np.nan, np.nan, 100, np.nan, np.nan]})
+    fx = np.where(holdings_df['Currency'] == 'USD', 1.4, 1.0)
+    holdings_df['Market Price CAD'] = holdings_df['Market Price'] * fx
+    holdings_df['Book Cost CAD'] = holdings_df['Book Cost'] * fx
+    holdings_df['Market Value CAD'] = holdings_df['Quantity'] * holdings_df['Market Price CAD']
+
+    scenario_df = pd.DataFrame({'Scenario': ['US equity -20%', 'USDCAD +10%', 'Underlyings -30%'],
+                                'Region=US & Asset Class=Equity': [-0.2, 0, 0], 'Currency=USD': [0, 0.1, 0],
+                                'Instrument=Option': [0, 0, -0.3], 'Symbol=SPY': [0, 0, 0]})
+    summary_df, pnl_df = stress_test(holdings_df, scenario_df)
+    pnl = summary_df.set_index('Scenario')['P&L CAD']
+    # the put is 500 - 480 = 20 in the money after a 20% drop
+    assert np.isclose(pnl['US equity -20%'], 10 * 600 * -0.2 * 1.4 + 20 * 100 * 1.4)
+    assert np.isclose(pnl['USDCAD +10%'], (10 * 600 + 1000) * 1.4 * 0.1)
+    # only the option's underlying moves in the third scenario: 500 - 420
+    assert np.isclose(pnl['Underlyings -30%'], 80 * 100 * 1.4)
+    assert np.isclose(pnl_df.loc['USDCAD +10%', 'USD'], 1000 * 1.4 * 0.1)
+
+    grid = scenario_grid({'Region=US': np.linspace(-0.5, 0.2, 36), 'Region=Canada': np.linspace(-0.5, 0.2, 36),
+                          'Currency=USD': np.linspace(-0.15, 0.15, 7)})
+    t = time.perf_counter()
+    summary_df, pnl_df = stress_test(holdings_df, grid)
+    print('{} scenarios in {:.4f}s'.format(len(grid), time.perf_counter() - t))
+    assert np.isclose(summary_df.loc[summary_df['Scenario'] == 'Base', 'P&L CAD'].iloc[0], 0)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 02:05:31 2026
+
+@author: Frank Shi
+"""
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from objects import description_to_option
+from position_index import PositionIndex
+
+
+# a loss is superficial if the same security is bought within this many days before or after the sale, in any
+# account including registered ones
+SUPERFICIAL_DAYS = 30
+
+
+def trade_symbols(trades_df):
+    # the symbol replay files a trade under: options by their description, everything else as exported
+    symbols = trades_df['Symbol'].fillna('').astype(str).values.copy()
+    descriptions = trades_df['Description'].fillna('').astype(str)
+    is_option = descriptions.str.startswith('PUT ') | descriptions.str.startswith('CALL ')
+    for i in np.flatnonzero(is_option.values):
+        symbols[i] = description_to_option(descriptions.iloc[i], trades_df['Currency'].iloc[i]).symbol
+    return symbols
+
+
+class AcquisitionIndex():
+    '''
+    every acquisition of every symbol across accounts: per symbol, sorted trade dates with the account and
+    quantity of each buy or transfer in, so that the buys in any window of any number of sales are two
+    searchsorted calls per symbol
+    '''
+    dates = None
+    accounts = None
+    quantities = None
+
+
+    def __init__(self, transaction_dict):
+        '''
+        Parameters
+        ----------
+        transaction_dict : dict
+            account names as keys and TransactionHistory as values, every account that can trigger the rule
+
+        '''
+        frames = []
+        for (account, transaction) in transaction_dict.items():
+            df = transaction.df
+            rows = df[df['Activity Type'].isin(['Trades', 'Transfers']) & (df['Quantity'] > 0)]
+            frames.append(pd.DataFrame({'Symbol': trade_symbols(rows), 'Account': account,
+                                        'Date': pd.DatetimeIndex(rows['Transaction Date']).normalize(),
+                                        'Quantity': rows['Quantity'].values.astype(float)}))
+        df = pd.concat(frames, ignore_index=True).sort_values(by=['Symbol', 'Date'], kind='stable')
+        self.dates = {}
+        self.accounts = {}
+        self.quantities = {}
+        for (symbol, group) in df.groupby('Symbol', sort=False):
+            self.dates[symbol] = group['Date'].values
+            self.accounts[symbol] = group['Account'].values
+            self.quantities[symbol] = group['Quantity'].values
+
+
+    def window(self, symbol, dates, days=SUPERFICIAL_DAYS):
+        '''
+        Purpose
+        -------
+        first and one past the last buy of symbol within days of each date, both ends included
+
+        Returns
+        -------
+        two numpy arrays of positions into the sorted buys of symbol
+
+        '''
+        dates = pd.DatetimeIndex(dates).normalize().values
+        buys = self.dates.get(symbol, np.array([], dtype='datetime64[ns]'))
+        start = np.searchsorted(buys, dates - np.timedelta64(days, 'D'), side='left')
+        end = np.searchsorted(buys, dates + np.timedelta64(days, 'D'), side='right')
+        return start, end
+
+
+    def last_before(self, symbol, dates):
+        # the last buy of symbol on or before each date, NaT if there is none
+        dates = pd.DatetimeIndex(dates).normalize().values
+        buys = self.dates.get(symbol, np.array([], dtype='datetime64[ns]'))
+        if len(buys) == 0:
+            return np.full(len(dates), np.datetime64('NaT'), dtype='datetime64[ns]')
+        i = np.searchsorted(buys, dates, side='right') - 1
+        return np.where(i >= 0, buys[i.clip(min=0)], np.datetime64('NaT'))
+
+
+def realized_gains(transaction, account, acquisitions, fx_matrix=None):
+    '''
+    Purpose
+    -------
+    gain or loss of every sale of an account at its average cost, with the sales whose loss may be superficial
+    flagged: a buy within SUPERFICIAL_DAYS of the sale in any account; whether the shares are still held at the
+    end of the window is left to check by hand
+
+    the average cost is the one at the end of the day before the sale, from a PositionIndex, so a buy on the
+    day of a sale is not in it
+
+    Parameters
+    ----------
+    transaction : TransactionHistory
+
+    account : str
+        name of the account in acquisitions
+
+    acquisitions : AcquisitionIndex
+        buys of every account
+
+    fx_matrix : fx.FXMatrix, optional
+        rates to cad on the sale dates, default None to fetch one for the currencies sold
+
+    Returns
+    -------
+    DataFrame with one row per sale: 'Date', 'Symbol', 'Currency', 'Quantity', 'Proceeds', 'Average Cost',
+    'Gain', 'Gain CAD', 'Buys In Window' and 'Superficial'
+
+    '''
+    df = transaction.df
+    sales = df[(df['Activity Type'] == 'Trades') & (df['Quantity'] < 0)]
+    sales_df = pd.DataFrame({'Date': pd.DatetimeIndex(sales['Transaction Date']).normalize(),
+                             'Symbol': trade_symbols(sales), 'Currency': sales['Currency'].str.upper().values,
+                             'Quantity': -sales['Quantity'].values.astype(float),
+                             'Proceeds': sales['Net Amount'].values.astype(float)})
+    sales_df['Average Cost'] = np.nan
+    sales_df['Buys In Window'] = 0
+
+    index = PositionIndex.from_transaction(transaction)
+    for (symbol, rows) in sales_df.groupby('Symbol').groups.items():
+        if symbol not in index.dates:
+            continue
+        dates = sales_df.loc[rows, 'Date'].values
+        before = np.searchsorted(index.dates[symbol], dates, side='left') - 1
+        sales_df.loc[rows, 'Average Cost'] = np.where(before >= 0, index.values[symbol][before.clip(min=0), 1], np.nan)
+        start, end = acquisitions.window(symbol, dates)
+        sales_df.loc[rows, 'Buys In Window'] = end - start
+
+    sales_df['Gain'] = sales_df['Proceeds'] - sales_df['Quantity'] * sales_df['Average Cost']
+    if len(sales_df) > 0:
+        if fx_matrix is None:
+            from fx import FXMatrix
+            fx_matrix = FXMatrix.from_provider(sales_df['Currency'].unique(), sales_df['Date'].unique())
+        sales_df['Gain CAD'] = fx_matrix.convert(sales_df['Gain'], sales_df['Currency'], sales_df['Date'])
+    else:
+        sales_df['Gain CAD'] = []
+    sales_df['Superficial'] = (sales_df['Gain'] < 0) & (sales_df['Buys In Window'] > 0)
+    sales_df.insert(0, 'Account', account)
+    return sales_df
+
+
+def harvest_candidates(holdings, account, acquisitions, asof_date=None, basis='average'):
+    '''
+    Purpose
+    -------
+    positions of a valued Holdings that are under water, with how much loss selling them would realize and
+    whether a sale today would be superficial because of a buy in the past SUPERFICIAL_DAYS days in any
+    account; a buy in the days after the sale would make it superficial too, 'Rebuy After' is the first clean
+    day
+
+    Parameters
+    ----------
+    holdings : Holdings
+        after market_value_cad
+
+    account : str
+
+    acquisitions : AcquisitionIndex
+
+    asof_date : datetime, optional
+        date of the sale, default None for holdings.asof_time, or now if it has none
+
+    basis : str, optional
+        'average' for the average cost of every position, or 'lots' for one row per open lot at its own unit
+        cost, default 'average'
+
+    Returns
+    -------
+    DataFrame sorted by loss, one row per position or lot with a loss: 'Account', 'Symbol', 'Currency',
+    'Quantity', 'Unit Cost', 'Market Price', 'Loss', 'Loss CAD', 'Last Buy', 'Superficial', 'Harvestable CAD'
+    and 'Rebuy After'
+
+    '''
+    if asof_date is None:
+        asof_date = holdings.asof_time if holdings.asof_time is not None else datetime.now()
+    asof_date = pd.Timestamp(asof_date).normalize()
+    rows = []
+    for sec in holdings.security_list:
+        if sec.quantity <= 0:
+            continue
+        if basis == 'lots':
+            lots = [(lot[1], lot[2]) for lot in sec.lots if lot[1] > 0]
+        else:
+            lots = [(sec.quantity, sec.average_cost)]
+        for (quantity, unit_cost) in lots:
+            rows.append([sec.symbol, sec.currency, quantity, unit_cost, sec.market_price, holdings.fx_rate(sec.currency)])
+    df = pd.DataFrame(rows, columns=['Symbol', 'Currency', 'Quantity', 'Unit Cost', 'Market Price', 'FX'])
+    df['Loss'] = df['Quantity'] * (df['Market Price'] - df['Unit Cost'])
+    df = df[df['Loss'] < 0].reset_index(drop=True)
+    # cad at today's rate, the adjusted cost base in cad would use the rate of every purchase
+    df['Loss CAD'] = df['Loss'] * df['FX']
+
+    df['Last Buy'] = pd.NaT
+    for (symbol, positions) in df.groupby('Symbol').groups.items():
+        df.loc[positions, 'Last Buy'] = acquisitions.last_before(symbol, [asof_date] * len(positions))
+    df['Last Buy'] = pd.to_datetime(df['Last Buy'])
+    window_start = asof_date - pd.Timedelta(days=SUPERFICIAL_DAYS)
+    df['Superficial'] = df['Last Buy'].notna() & (df['Last Buy'] >= window_start)
+    df['Harvestable CAD'] = np.where(df['Superficial'], 0, df['Loss CAD'])
+    df['Rebuy After'] = asof_date + pd.Timedelta(days=SUPERFICIAL_DAYS + 1)
+    df.insert(0, 'Account', account)
+    return df.drop(columns=['FX']).sort_values(by='Loss CAD', kind='stable').reset_index(drop=True)
+
+
+def scan(holdings_dict, transaction_dict, taxable, asof_date=None, basis='average'):
+    '''
+    Purpose
+    -------
+    harvest candidates and realized gains of the taxable accounts, with buys in every account counted
+
+    Parameters
+    ----------
+    holdings_dict : dict
+        account names as keys and valued Holdings as values, at least the taxable ones
+
+    transaction_dict : dict
+        account names as keys and TransactionHistory as values, every account
+
+    taxable : list
+        account names to scan, e.g. ['q_margin']
+
+    Returns
+    -------
+    two DataFrames, see harvest_candidates and realized_gains
+
+    '''
+    acquisitions = AcquisitionIndex(transaction_dict)
+    candidates = [harvest_candidates(holdings_dict[a], a, acquisitions, asof_date, basis) for a in taxable]
+    realized = [realized_gains(transaction_dict[a], a, acquisitions) for a in taxable]
+    return pd.concat(candidates, ignore_index=True), pd.concat(realized, ignore_index=True)
+
+
+#% test
+if __name__ == '__main__':
+    import time
+    import useful_functions
+    from fx import FXMatrix
+    from objects import Holdings, TransactionHistory
+
+    useful_functions.set_offline(True)
+
+    def trade(date, symbol, quantity, price, account_type='Margin'):
+        date_str = pd.Timestamp(date).strftime('%Y-%m-%d %H:%M:%S') + ' AM'
+        return {'Transaction Date': date_str, 'Settlement Date': date_str, 'Action': 'Buy' if quantity > 0 else 'Sell',
+                'Symbol': symbol, 'Description': '', 'Quantity': quantity, 'Price': price,
+                'Gross Amount': -quantity * price, 'Commission': 0.0, 'Net Amount': -quantity * price,
+                'Currency': 'CAD', 'Activity Type': 'Trades', 'Account #': 1, 'Account Type': account_type}
+
+    deposit = dict(trade('2026-01-02', np.nan, 0, 0), **{'Activity Type': 'Deposits', 'Action': 'DEP',
+                                                         'Net Amount': 100000.0, 'Quantity': 0})
+    margin = TransactionHistory(pd.DataFrame([deposit,
+                                              trade('2026-01-05', 'XIU.TO', 100, 40.0),
+                                              trade('2026-02-10', 'XIU.TO', -50, 35.0),
+                                              trade('2026-03-02', 'ZSP.TO', 100, 80.0),
+                                              trade('2026-06-01', 'ZSP.TO', -40, 70.0),
+                                              trade('2026-09-01', 'VFV.TO', 10, 150.0)]), 'questrade')
+    # the tfsa buys xiu two weeks after the margin account sells it at a loss
+    tfsa = TransactionHistory(pd.DataFrame([trade('2026-02-24', 'XIU.TO', 10, 36.0, 'TFSA'),
+                                            trade('2026-10-01', 'VFV.TO', 5, 140.0, 'TFSA')]), 'questrade')
+    transactions = {'q_margin': margin, 'tfsa': tfsa}
+    acquisitions = AcquisitionIndex(transactions)
+    per_usd = pd.DataFrame({'CAD': 1.37}, index=pd.bdate_range('2025-12-01', '2026-10-31'))
+    realized = realized_gains(margin, 'q_margin', acquisitions, fx_matrix=FXMatrix(per_usd))
+    by_symbol = realized.set_index('Symbol')
+    assert np.isclose(by_symbol.loc['XIU.TO', 'Gain'], 50 * (35 - 40))
+    assert by_symbol.loc['XIU.TO', 'Superficial'] and not by_symbol.loc['ZSP.TO', 'Superficial']
+
+    holdings = Holdings(transaction=margin, asof_date=pd.Timestamp('2026-10-16'))
+    prices = {'XIU.TO': 38.0, 'ZSP.TO': 75.0, 'VFV.TO': 145.0}
+    for sec in holdings.security_list:
+        sec.market_price = prices[sec.symbol]
+    holdings.fx_dict = {'usdcad': 1.37}
+    candidates = harvest_candidates(holdings, 'q_margin', acquisitions).set_index('Symbol')
+    assert np.isclose(candidates.loc['ZSP.TO', 'Harvestable CAD'], 60 * (75 - 80))
+    # vfv was bought in the tfsa fifteen days ago
+    assert candidates.loc['VFV.TO', 'Superficial'] and candidates.loc['VFV.TO', 'Harvestable CAD'] == 0
+
+    # a hundred thousand sales against a hundred thousand buys
+    rng = np.random.default_rng(6)
+    n = 100000
+    acquisitions.dates = {'S{}'.format(i): np.sort(np.datetime64('2010-01-01') + rng.integers(0, 6000, n // 50).astype('timedelta64[D]'))
+                          for i in range(50)}
+    sale_dates = pd.DatetimeIndex(np.datetime64('2010-01-01') + rng.integers(0, 6000, n).astype('timedelta64[D]'))
+    t = time.perf_counter()
+    counts = [np.subtract(*acquisitions.window('S{}'.format(i), sale_dates[i::50])[::-1]) for i in range(50)]
+    print('{} sale windows in {:.4f}s'.format(n, time.perf_counter() - t))
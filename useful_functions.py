@@ -4,18 +4,85 @@ Created on Mon Dec 21 18:23:26 2020
 
 @author: Frank Shi
 """
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
-import holidays
-from requests import get
 import pandas as pd
 import time
-import lxml
-from lxml import html
 from pandas.tseries.offsets import DateOffset
 
+# bs4, holidays, requests and lxml are imported inside the functions that use them so that importing
+# this module (and objects.py, charting.py on top of it) stays cheap for short command line runs
+
+# when True, every network request raises instead of reaching the website, see set_offline
+OFFLINE = False
+
+# record/replay of every request when set, see set_cassette and cassette.Cassette
+CASSETTE = None
+
+# every yahoo finance url starts with this, e.g. a local stand-in server for testing, see quote_service.py
+YAHOO_BASE_URL = 'https://finance.yahoo.com'
+
 
 #%
+def set_offline(offline=True):
+    '''
+    Purpose
+    -------
+    switch offline mode on or off for every scraping function in this module
+
+    Parameters
+    ----------
+    offline : bool, optional
+        default True
+
+    Returns
+    -------
+    None.
+
+    '''
+    global OFFLINE
+    OFFLINE = offline
+
+
+def set_cassette(cassette=None):
+    # answer requests from a cassette.Cassette, or from the network again if None
+    global CASSETTE
+    CASSETTE = cassette
+
+
+def fetch(url, headers=None):
+    # GET url from the network through the shared client, so that every call reuses its pooled keep-alive
+    # connections
+    if OFFLINE:
+        raise ConnectionError('offline mode, not fetching {}'.format(url))
+    from market_data import client
+    return client().run(client().fetch_live(url, headers))
+
+
+def get(url, headers=None):
+    '''
+    Purpose
+    -------
+    send a GET request, importing requests on first use
+
+    Parameters
+    ----------
+    url : str
+        the full url
+
+    headers : dict, optional
+        request headers, default None
+
+    Returns
+    -------
+    a response with content, text and status_code, see market_data.MarketDataClient; from the cassette
+    instead if one is set, even in offline mode
+
+    '''
+    if CASSETTE is not None:
+        return CASSETTE.get(url, headers, fetch)
+    return fetch(url, headers)
+
+
 def vlookup(table, item, column_from, column_to):
     '''
     Parameters
@@ -71,6 +138,8 @@ def last_business_day(start_date, country='NA'):
     datetime object
 
     '''
+    import holidays
+
     relevant_years = [start_date.year - 1, start_date.year]
     if country == 'NA':
         relevant_holidays = holidays.CA(years=relevant_years) + holidays.US(years=relevant_years)
@@ -90,13 +159,18 @@ def subdomain_last_price(symbol):
      return subdomain
 
 
-def scrape_last_price(url, header):
-     page = get(url, headers=header)
-     element_html = html.fromstring(page.content)
+def parse_last_price(content):
+     from lxml import html
+     element_html = html.fromstring(content)
      elements = element_html.xpath('//*[@id="quote-header-info"]/div[3]/div[1]/div/span[1]')
      return elements
 
 
+def scrape_last_price(url, header):
+     page = get(url, headers=header)
+     return parse_last_price(page.content)
+
+
 def get_last_price(symbol):
     '''
     Purpose
@@ -113,7 +187,7 @@ def get_last_price(symbol):
     datetime object and a floating point value representing price
 
     '''
-    base_url = 'https://finance.yahoo.com'
+    base_url = YAHOO_BASE_URL
     url = base_url + subdomain_last_price(symbol)
     url_header = header_function(subdomain_last_price(symbol))
     elements = scrape_last_price(url, url_header)
@@ -144,6 +218,8 @@ def get_last_price_old(symbol, instrument, currency):
     datetime object and a floating point value representing price
 
     '''
+    from bs4 import BeautifulSoup
+
     if instrument == 'Stock':
         quote_url_root = 'https://www.marketwatch.com/investing/stock/'
     else:
@@ -182,83 +258,110 @@ def subdomain(symbol, start, end, filter='history'):
      return subdomain
 
 
+# the same for every page, built once; header_function only adds the path
+YAHOO_HEADERS = {"authority": "finance.yahoo.com",
+                 "method": "GET",
+                 "scheme": "https",
+                 "accept": "text/html",
+                 "accept-encoding": "gzip, deflate, br",
+                 "accept-language": "en-US,en;q=0.9",
+                 "cache-control": "no-cache",
+                 "dnt": "1",
+                 "pragma": "no-cache",
+                 "sec-fetch-mode": "navigate",
+                 "sec-fetch-site": "same-origin",
+                 "sec-fetch-user": "?1",
+                 "upgrade-insecure-requests": "1",
+                 "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64)"}
+
+
 def header_function(subdomain):
-     hdrs =  {"authority": "finance.yahoo.com",
-               "method": "GET",
-               "path": subdomain,
-               "scheme": "https",
-               "accept": "text/html",
-               "accept-encoding": "gzip, deflate, br",
-               "accept-language": "en-US,en;q=0.9",
-               "cache-control": "no-cache",
-               "dnt": "1",
-               "pragma": "no-cache",
-               "sec-fetch-mode": "navigate",
-               "sec-fetch-site": "same-origin",
-               "sec-fetch-user": "?1",
-               "upgrade-insecure-requests": "1",
-               "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64)"}
+     hdrs = dict(YAHOO_HEADERS)
+     hdrs["path"] = subdomain
      return hdrs
 
 
-def scrape_page(url, header):
-     page = get(url, headers=header)
-     element_html = html.fromstring(page.content)
+def parse_tables(content):
+     import lxml.etree
+     from lxml import html
+     element_html = html.fromstring(content)
      table = element_html.xpath('//table')
      table_tree = lxml.etree.tostring(table[0], method='xml')
      panda = pd.read_html(table_tree)
      return panda
 
 
-def split_multiplier(symbol, date):
+def scrape_page(url, header):
+     page = get(url, headers=header)
+     return parse_tables(page.content)
+
+
+def get_split_history(symbol):
     '''
     Purpose
     -------
-    get the mutliplier that gives the closing price of a security from yahoo finance,
-    NOT adjusted for splits
+    every split of a security from yahoo finance, in one request
 
     Parameters
     ----------
     symbol: str
         security name, e.g. ZSP.TO
 
-    date: python datetime
-        the date of the price. price is obtained at close
-
     Returns
     -------
-    a multiplier that, if applied to the split-adjusted price, will give the unadjusted price on
-    the given date
+    a DataFrame with 'date' and 'multiplier' columns, the same as the split_reference sheet; the multiplier
+    is the number of new shares per old share, e.g. 2 for a 2:1 split and 0.1 for a 1:10 reverse split
 
     '''
-
-    # get the splits
-
     range_end = datetime(datetime.now().year, datetime.now().month, datetime.now().day)
 
-    start_string = format_date(date)
-    end_string = format_date(range_end)
+    start_string = format_date(datetime(1970, 1, 2))
+    end_string = format_date(range_end + timedelta(days=1))
 
     sub = subdomain(symbol, start_string, end_string, filter='split')
     html_header = header_function(sub)
 
-    base_url = 'https://finance.yahoo.com'
+    base_url = YAHOO_BASE_URL
     url = base_url + sub
 
     split_history = scrape_page(url, html_header)[0]
 
-    # print(split_history)
-
-    multiplier = 1
-
+    dates = []
+    multipliers = []
     for i in split_history.index:
-        i_str = split_history.loc[i, 'Open']
+        i_str = str(split_history.loc[i, 'Open'])
         if ':' in i_str:
             ratio_str = i_str.split(' ')[0]
-            i_multiplier = int(ratio_str.split(':')[0]) / int(ratio_str.split(':')[1])
-            multiplier = multiplier * i_multiplier
+            dates.append(datetime.strptime(split_history.loc[i, 'Date'], '%b %d, %Y'))
+            multipliers.append(int(ratio_str.split(':')[0]) / int(ratio_str.split(':')[1]))
 
-    return multiplier
+    return pd.DataFrame({'date': dates, 'multiplier': multipliers})
+
+
+def split_multiplier(symbol, date):
+    '''
+    Purpose
+    -------
+    get the mutliplier that gives the closing price of a security from yahoo finance,
+    NOT adjusted for splits
+
+    Parameters
+    ----------
+    symbol: str
+        security name, e.g. ZSP.TO
+
+    date: python datetime or array-like
+        the date of the price. price is obtained at close
+
+    Returns
+    -------
+    a multiplier that, if applied to the split-adjusted price, will give the unadjusted price on
+    the given date; an array for an array of dates
+
+    '''
+    # the split history of each symbol is fetched once, see splits.SplitIndex
+    from splits import split_index
+    return split_index().factor(symbol, date)
 
 
 def get_hist_price_wrapper(symbol, date, split_adjust=False):
@@ -303,7 +406,7 @@ def get_hist_price_wrapper(symbol, date, split_adjust=False):
     sub = subdomain(symbol, start_string, end_string)
     html_header = header_function(sub)
 
-    base_url = 'https://finance.yahoo.com'
+    base_url = YAHOO_BASE_URL
     url = base_url + sub
 
     price_history = scrape_page(url, html_header)[0]
@@ -339,6 +442,50 @@ def get_hist_price(symbol, date, split_adjust=False):
         return get_hist_price(symbol, date, split_adjust=split_adjust)
 
 
+def get_price_history(symbol, start, end):
+    '''
+    Purpose
+    -------
+    get daily closing prices of a security over a date range from yahoo finance
+
+    Parameters
+    ----------
+    symbol: str
+        security name as displayed in yahoo finance, e.g. ZSP.TO, or 'CAD=X' for USDCAD
+
+    start, end: python datetime
+        first and last day of the range
+
+    Returns
+    -------
+    a DataFrame indexed by date with 'Close' (split-adjusted) and 'Adj Close' (split and dividend adjusted)
+    columns; dividend and split rows are dropped
+
+    '''
+    start_string = format_date(start)
+    end_string = format_date(end + timedelta(days=1))
+
+    sub = subdomain(symbol.replace('=', '%3D'), start_string, end_string)
+    html_header = header_function(sub)
+
+    base_url = YAHOO_BASE_URL
+    url = base_url + sub
+
+    return clean_price_history(scrape_page(url, html_header)[0])
+
+
+def clean_price_history(price_history):
+    # the history table of a yahoo finance page to what get_price_history returns
+    price_history = price_history.rename(columns={'Close*': 'Close', 'Adj Close**': 'Adj Close'})
+
+    # dividend and split rows carry text in the price columns
+    price_history['Close'] = pd.to_numeric(price_history['Close'], errors='coerce')
+    price_history['Adj Close'] = pd.to_numeric(price_history['Adj Close'], errors='coerce')
+    price_history = price_history.dropna(subset=['Close'])
+    price_history['Date'] = pd.to_datetime(price_history['Date'], format='%b %d, %Y')
+    return price_history.set_index('Date')[['Close', 'Adj Close']].sort_index()
+
+
 def get_hist_fx(pair, date):
     '''
     Purpose
@@ -365,16 +512,12 @@ def get_hist_fx(pair, date):
     start_string = format_date(date)
     end_string = format_date(range_end)
 
-    pair = pair.upper()
-    if pair[:3] == 'USD':
-        symbol = pair[3:] + '%3DX' # url equivalent of '=X'
-    else:
-        symbol = pair + '%3DX'
+    symbol = fx_symbol(pair).replace('=', '%3D') # url equivalent of '=X'
 
     sub = subdomain(symbol, start_string, end_string)
     html_header = header_function(sub)
 
-    base_url = 'https://finance.yahoo.com'
+    base_url = YAHOO_BASE_URL
     url = base_url + sub
 
     price_history = scrape_page(url, html_header)[0]
@@ -385,6 +528,14 @@ def get_hist_fx(pair, date):
     return float(price_str)
 
 
+def fx_symbol(pair):
+    # yahoo finance symbol of a currency pair, e.g. 'CAD=X' for usdcad
+    pair = pair.upper()
+    if pair[:3] == 'USD':
+        return pair[3:] + '=X'
+    return pair + '=X'
+
+
 def get_last_fx(pair):
     '''
     Purpose
@@ -401,6 +552,8 @@ def get_last_fx(pair):
     float, representing the latest exchange rate
 
     '''
+    from bs4 import BeautifulSoup
+
     fx_url = 'https://www.marketwatch.com/investing/currency/' + pair
     quote_site = get(fx_url)
     # print(url)